@@ -0,0 +1,330 @@
+# This project is licensed under the terms of the GPL v3.0 license. Copyright 2024 Cyteon
+
+# Economy load test: drives the pay/rob/daily command callbacks of the
+# Economy cog with fake contexts at a given concurrency, then reports
+# throughput, latency percentiles and whether the money supply added up.
+#
+# Uses its own database and redis db so it never touches bot data. Run
+# from the project root against local stand-ins, e.g.:
+#   docker run -d -p 27017:27017 mongo
+#   docker run -d -p 6379:6379 redis
+#   python benchmarks/economy.py --users 200 --ops 20000 --concurrency 50
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+ROOT = os.path.realpath(os.path.join(os.path.dirname(__file__), ".."))
+
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault("MONGODB_URL", "mongodb://localhost:27017")
+os.environ.setdefault("REDIS_URL", "redis://localhost:6379/15")
+os.environ.setdefault("OWNER_ID", "0")
+
+GUILD_ID = 1
+DAILY_CASH = 50
+
+class FakeUser:
+    def __init__(self, user_id: int) -> None:
+        self.id = user_id
+        self.bot = False
+        self.name = f"user{user_id}"
+        self.nick = None
+        self.display_name = self.name
+        self.mention = f"<@{user_id}>"
+
+    def __str__(self) -> str:
+        return self.name
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, FakeUser) and other.id == self.id
+
+    def __hash__(self) -> int:
+        return self.id
+
+class FakeGuild:
+    def __init__(self, guild_id: int, members: list) -> None:
+        self.id = guild_id
+        self.members = members
+
+class FakeContext:
+    def __init__(self, author: FakeUser, guild: FakeGuild, data, yield_on_send: bool) -> None:
+        self.author = author
+        self.guild = guild
+        self.data = data
+        self.yield_on_send = yield_on_send
+        self.messages = []
+
+    async def send(self, content: str = None, **kwargs) -> None:
+        self.messages.append(content)
+
+        if self.yield_on_send:
+            # Replies are network round trips in the bot, let other
+            # commands run in between like they would there
+            await asyncio.sleep(0)
+
+class FakeBot:
+    def __init__(self, config: dict, wallets, ledger, guild_settings) -> None:
+        self.config = config
+        self.wallets = wallets
+        self.ledger = ledger
+        self.guild_settings = guild_settings
+
+def use_database(name: str):
+    # Has to run before anything else imports DBClient.db
+    from utils import DBClient
+
+    DBClient.db = DBClient.client[name]
+
+    return DBClient.db
+
+def percentiles(samples: list) -> dict:
+    if not samples:
+        return {}
+
+    samples = sorted(samples)
+
+    def pick(p):
+        return round(samples[min(len(samples) - 1, int(len(samples) * p))] * 1000, 3)
+
+    return {
+        "count": len(samples),
+        "p50_ms": pick(0.50),
+        "p90_ms": pick(0.90),
+        "p99_ms": pick(0.99),
+        "max_ms": round(samples[-1] * 1000, 3),
+    }
+
+def outcome(command: str, message: str) -> str:
+    if message is None:
+        return "no reply"
+
+    if command == "daily":
+        return "claimed" if message.startswith("Added") else "waiting"
+
+    if command == "pay":
+        return "paid" if message.startswith("Paid") else "rejected"
+
+    if message.startswith("You successfully robbed"):
+        return "robbed"
+    if message.startswith("You got caught"):
+        return "caught"
+
+    return "rejected"
+
+def money_supply(db) -> int:
+    result = list(db["users"].aggregate([
+        {"$match": {"guild_id": GUILD_ID}},
+        {"$group": {"_id": None, "total": {"$sum": "$wallet"}}},
+    ]))
+
+    return result[0]["total"] if result else 0
+
+def seed(db, users: int, balance: int) -> None:
+    from utils import CONSTANTS
+
+    db["users"].delete_many({"guild_id": GUILD_ID})
+    db["guilds"].delete_many({"id": GUILD_ID})
+
+    documents = []
+
+    for user_id in range(1, users + 1):
+        data = CONSTANTS.user_data_template(user_id, GUILD_ID)
+        data["wallet"] = balance
+        documents.append(data)
+
+    db["users"].insert_many(documents)
+    db["economy_ledger"].delete_many({})
+    db["economy_snapshots"].delete_many({})
+
+    guild = CONSTANTS.guild_data_template(GUILD_ID)
+    guild["daily_cash"] = DAILY_CASH
+    db["guilds"].insert_one(guild)
+
+async def run(args, db) -> dict:
+    from utils import CachedDB, DataContext, GuildSettings, Ledger, WriteBehind
+    from cogs.economy import Economy
+
+    # Cached documents from an earlier run would hide what this one wrote
+    client = CachedDB.get_redis()
+    stale = list(client.scan_iter(match=f'users:*"guild_id": {GUILD_ID}}}'))
+    client.delete(f"baltop:{GUILD_ID}", *stale)
+
+    wallets = WriteBehind.WriteBuffer(
+        db["users"], enabled=args.write_behind, interval=args.interval_ms / 1000, max_ops=args.max_ops
+    )
+    ledger = Ledger.LedgerWriter(db["economy_ledger"])
+
+    # Not started, nothing else changes the settings during a run
+    bot = FakeBot({}, wallets, ledger, GuildSettings.GuildSettings())
+
+    # Not added to a bot, so cog_load and its background loops never start
+    cog = Economy(bot)
+
+    users = [FakeUser(user_id) for user_id in range(1, args.users + 1)]
+    guild = FakeGuild(GUILD_ID, users)
+
+    mix = {"pay": args.pay, "rob": args.rob, "daily": args.daily}
+    commands = list(mix)
+    weights = [mix[command] for command in commands]
+
+    latencies = {command: [] for command in commands}
+    outcomes = {command: {} for command in commands}
+    errors = {}
+
+    rng = random.Random(args.seed)
+    remaining = [args.ops]
+
+    async def worker() -> None:
+        while remaining[0] > 0:
+            remaining[0] -= 1
+
+            command = rng.choices(commands, weights)[0]
+            author, target = rng.sample(users, 2)
+            context = FakeContext(author, guild, DataContext.DataContext(bot), not args.no_yield)
+
+            start_time = time.perf_counter()
+
+            try:
+                if command == "pay":
+                    await cog.pay.callback(cog, context, target, rng.randint(1, args.max_amount))
+                elif command == "rob":
+                    await cog.rob.callback(cog, context, target)
+                else:
+                    await cog.daily.callback(cog, context)
+            except Exception as e:
+                name = f"{command}: {type(e).__name__}: {e}"
+                errors[name] = errors.get(name, 0) + 1
+                continue
+            finally:
+                latencies[command].append(time.perf_counter() - start_time)
+
+            result = outcome(command, context.messages[-1] if context.messages else None)
+            outcomes[command][result] = outcomes[command].get(result, 0) + 1
+
+    wallets.start()
+    ledger.start()
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(args.concurrency)])
+    elapsed = time.perf_counter() - start_time
+
+    flush_start = time.perf_counter()
+    await wallets.stop()
+    await ledger.stop()
+    flush_ms = (time.perf_counter() - flush_start) * 1000
+
+    total_ops = sum(len(samples) for samples in latencies.values())
+
+    return {
+        "elapsed_s": round(elapsed, 3),
+        "ops": total_ops,
+        "ops_per_sec": round(total_ops / elapsed, 1) if elapsed > 0 else 0,
+        "final_flush_ms": round(flush_ms, 2),
+        "latency": {command: percentiles(samples) for command, samples in latencies.items()},
+        "latency_all": percentiles([sample for samples in latencies.values() for sample in samples]),
+        "outcomes": outcomes,
+        "errors": errors,
+        "write_behind": wallets.stats(),
+    }
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True
+        ).stdout.strip()
+    except OSError:
+        return ""
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load test the economy commands")
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+    parser.add_argument("--database", default="potatobot_loadtest", help="Mongo database to use, dropped afterwards")
+    parser.add_argument("--keep", action="store_true", help="Don't drop the database afterwards")
+    parser.add_argument("--users", type=int, default=100, help="Users in the test guild")
+    parser.add_argument("--balance", type=int, default=10000, help="Starting wallet of every user")
+    parser.add_argument("--ops", type=int, default=10000, help="Commands to run in total")
+    parser.add_argument("--concurrency", type=int, default=20, help="Commands in flight at once")
+    parser.add_argument("--pay", type=float, default=80, help="Weight of pay in the command mix")
+    parser.add_argument("--rob", type=float, default=15, help="Weight of rob in the command mix")
+    parser.add_argument("--daily", type=float, default=5, help="Weight of daily in the command mix")
+    parser.add_argument("--max-amount", type=int, default=100, help="Largest amount paid at once")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for the command mix")
+    parser.add_argument("--write-behind", action="store_true", help="Buffer wallet writes")
+    parser.add_argument("--interval-ms", type=int, default=500, help="Write-behind flush interval")
+    parser.add_argument("--max-ops", type=int, default=200, help="Write-behind flush size")
+    parser.add_argument("--no-yield", action="store_true", help="Don't yield to other commands on replies")
+    parser.add_argument("--verify-ledger", action="store_true", help="Also check the ledger against the wallets")
+    args = parser.parse_args()
+
+    if args.users < 2:
+        parser.error("--users must be at least 2")
+
+    if args.database == "potatobot":
+        parser.error("refusing to run against the bot's database")
+
+    db = use_database(args.database)
+
+    seed(db, args.users, args.balance)
+
+    if args.verify_ledger:
+        from utils import Ledger
+
+        Ledger.bootstrap(GUILD_ID)
+
+    initial = money_supply(db)
+
+    try:
+        report = asyncio.run(run(args, db))
+
+        final = money_supply(db)
+        minted = report["outcomes"]["daily"].get("claimed", 0) * DAILY_CASH
+
+        report["money"] = {
+            "initial": initial,
+            "minted_by_daily": minted,
+            "expected": initial + minted,
+            "final": final,
+            "difference": final - (initial + minted),
+            "conserved": final == initial + minted,
+            "negative_wallets": db["users"].count_documents({"guild_id": GUILD_ID, "wallet": {"$lt": 0}}),
+        }
+
+        if args.verify_ledger:
+            from utils import Ledger
+
+            result = Ledger.verify(GUILD_ID)
+            report["ledger"] = {
+                "entries": result["entries"],
+                "wallet_mismatches": len(result["wallet_mismatches"]),
+            }
+    finally:
+        if not args.keep:
+            db.client.drop_database(args.database)
+
+    report = {
+        "time": time.time(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": f"{platform.system()} {platform.release()}",
+        "config": vars(args),
+        **report,
+    }
+
+    output = json.dumps(report, indent=2)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+# This project is licensed under the terms of the GPL v3.0 license. Copyright 2024 Cyteon
+
+# Startup benchmark: measures import time per module, load time per cog and
+# db/cache connection setup, and writes a JSON report.
+#
+# Run from the project root against local stand-ins, e.g.:
+#   docker run -d -p 27017:27017 mongo
+#   docker run -d -p 6379:6379 redis
+#   python benchmarks/startup.py --output bench_output.json
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.realpath(os.path.join(os.path.dirname(__file__), ".."))
+
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault("MONGODB_URL", "mongodb://localhost:27017")
+os.environ.setdefault("REDIS_URL", "redis://localhost:6379")
+os.environ.setdefault("OWNER_ID", "0")
+
+THIRD_PARTY = ["discord", "aiohttp", "pymongo", "redis", "pickledb", "lavalink", "deep_translator"]
+
+def find_modules() -> list:
+    modules = []
+
+    for package in ["utils", "cogs"]:
+        for file in sorted(os.listdir(os.path.join(ROOT, package))):
+            if file.endswith(".py"):
+                modules.append(f"{package}.{file[:-3]}")
+
+    return modules
+
+def run_importtime(code: str) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+    )
+
+def parse_importtime(output: str, module: str, top: int, baseline=frozenset()) -> dict:
+    entries = []
+    cumulative = None
+
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+
+        try:
+            self_us, cumulative_us, name = [part.strip() for part in line[len("import time:"):].split("|")]
+            self_us, cumulative_us = int(self_us), int(cumulative_us)
+        except ValueError:
+            continue
+
+        if name in baseline:
+            continue
+
+        entries.append((name, self_us))
+
+        if name == module:
+            cumulative = cumulative_us
+
+    entries.sort(key=lambda entry: entry[1], reverse=True)
+
+    return {
+        "cumulative_ms": round(cumulative / 1000, 2) if cumulative is not None else None,
+        "top": [{"module": name, "self_ms": round(self_us / 1000, 2)} for name, self_us in entries[:top]],
+    }
+
+def interpreter_modules() -> frozenset:
+    # Modules imported by the interpreter itself (site, encodings, ...)
+    result = run_importtime("pass")
+    entries = parse_importtime(result.stderr, "", top=sys.maxsize)["top"]
+
+    return frozenset(entry["module"] for entry in entries)
+
+def measure_import(module: str, top: int, baseline=frozenset()) -> dict:
+    # __import__ rather than importlib.import_module, -X importtime only
+    # reports imports that go through the builtin import machinery
+    code = (
+        "import time\n"
+        "start = time.perf_counter()\n"
+        f"__import__({module!r})\n"
+        "print((time.perf_counter() - start) * 1000)\n"
+    )
+
+    result = run_importtime(code)
+
+    if result.returncode != 0:
+        error = result.stderr.strip().splitlines()
+        return {"error": error[-1] if error else f"exit code {result.returncode}"}
+
+    report = parse_importtime(result.stderr, module, top, baseline)
+    report["wall_ms"] = round(float(result.stdout.strip().splitlines()[-1]), 2)
+
+    return report
+
+def measure_imports(modules: list, top: int) -> dict:
+    baseline = interpreter_modules()
+
+    return {module: measure_import(module, top, baseline) for module in modules}
+
+async def measure_cogs() -> dict:
+    import discord
+    import pickledb
+    from discord.ext import commands
+
+    from utils import DataContext, Services
+
+    with open(os.path.join(ROOT, "config.example.json")) as file:
+        config = json.load(file)
+
+    class BenchBot(commands.AutoShardedBot):
+        def __init__(self) -> None:
+            super().__init__(command_prefix=",", intents=discord.Intents.default(), help_command=None)
+
+            self.prefixDB = pickledb.load(os.path.join(tempfile.mkdtemp(), "prefix.db"), False)
+
+            # Same services as the real bot, nothing is started
+            Services.attach(self, config)
+
+        async def get_context(self, origin, /, *, cls=DataContext.Context):
+            return await super().get_context(origin, cls=cls)
+
+    bot = BenchBot()
+    report = {}
+
+    for file in sorted(os.listdir(os.path.join(ROOT, "cogs"))):
+        if not file.endswith(".py"):
+            continue
+
+        extension = file[:-3]
+        start_time = time.perf_counter()
+
+        try:
+            await bot.load_extension(f"cogs.{extension}")
+            report[extension] = {"load_ms": round((time.perf_counter() - start_time) * 1000, 2)}
+        except Exception as e:
+            report[extension] = {"error": f"{type(e).__name__}: {e}"}
+
+    await bot.close()
+
+    return report
+
+def timed(func) -> dict:
+    start_time = time.perf_counter()
+
+    try:
+        func()
+        return {"ms": round((time.perf_counter() - start_time) * 1000, 2)}
+    except Exception as e:
+        return {"ms": round((time.perf_counter() - start_time) * 1000, 2), "error": f"{type(e).__name__}: {e}"}
+
+def measure_connections(timeout_ms: int) -> dict:
+    import pymongo
+    import redis
+
+    report = {}
+    mongo = {}
+    cache = {}
+
+    report["mongo_client"] = timed(lambda: mongo.setdefault(
+        "client",
+        pymongo.MongoClient(os.getenv("MONGODB_URL"), connect=False, serverSelectionTimeoutMS=timeout_ms),
+    ))
+    report["mongo_ping"] = timed(lambda: mongo["client"].admin.command("ping"))
+
+    report["redis_pool"] = timed(lambda: cache.setdefault(
+        "client",
+        redis.Redis(connection_pool=redis.ConnectionPool.from_url(
+            os.getenv("REDIS_URL"), socket_connect_timeout=timeout_ms / 1000
+        )),
+    ))
+    report["redis_ping"] = timed(lambda: cache["client"].ping())
+
+    mongo["client"].close()
+    cache["client"].close()
+
+    return report
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True
+        ).stdout.strip()
+    except OSError:
+        return ""
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure bot startup costs")
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+    parser.add_argument("--top", type=int, default=5, help="Slowest nested imports to list per module")
+    parser.add_argument("--timeout", type=int, default=2000, help="Connection timeout in ms")
+    parser.add_argument("--skip-third-party", action="store_true", help="Only measure project modules")
+    args = parser.parse_args()
+
+    modules = find_modules()
+
+    if not args.skip_third_party:
+        modules = THIRD_PARTY + modules
+
+    report = {
+        "time": time.time(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": f"{platform.system()} {platform.release()}",
+        "imports": measure_imports(modules, args.top),
+        "connections": measure_connections(args.timeout),
+        "cogs": asyncio.run(measure_cogs()),
+    }
+
+    output = json.dumps(report, indent=2)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
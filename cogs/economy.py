@@ -1,109 +1,181 @@
 # This project is licensed under the terms of the GPL v3.0 license. Copyright 2024 Cyteon
 
+import asyncio
+import logging
 import random
 import discord
 import time
+from datetime import datetime, timezone
 
 from discord import ui
-from discord.ext import commands
+from discord.ext import commands, tasks
 from discord.ext.commands import Context
 
-from utils import CONSTANTS, DBClient, CachedDB, Checks
+from utils import DBClient, Checks, Cooldowns, DataContext, EconomyStats, Leaderboard, Ledger, Members
 
 db = DBClient.db
 
+logger = logging.getLogger("discord_bot")
+
+# Guilds nobody asked for stats in this long stop being refreshed
+STATS_IDLE = 7 * 86400
+
 class Economy(commands.Cog, name="🪙 Economy"):
     def __init__(self, bot) -> None:
         self.bot = bot
 
+    async def cog_load(self) -> None:
+        self.reconcile_leaderboards.start()
+
+        self.compact_ledger.change_interval(minutes=self.bot.config.get("ledger", {}).get("compact_minutes", 60))
+        self.compact_ledger.start()
+
+        self.stats_interval = self.bot.config.get("economy_stats", {}).get("refresh_minutes", 30) * 60
+        self.refresh_stats.change_interval(seconds=self.stats_interval)
+        self.refresh_stats.start()
+
+    async def cog_unload(self) -> None:
+        self.reconcile_leaderboards.cancel()
+        self.compact_ledger.cancel()
+        self.refresh_stats.cancel()
+
+    def update_leaderboard(self, guild: discord.Guild, *balances) -> None:
+        Leaderboard.set_balances(guild.id, {member.id: wallet for member, wallet in balances if not member.bot})
+
+    @tasks.loop(hours=6)
+    async def reconcile_leaderboards(self) -> None:
+        guild_ids = await asyncio.to_thread(db["users"].distinct, "guild_id")
+
+        for guild_id in guild_ids:
+            guild = self.bot.get_guild(guild_id)
+
+            # Each cluster process rebuilds the guilds it has
+            if guild is None:
+                continue
+
+            # Bots and members that left are dropped when a page shows them
+            try:
+                await asyncio.to_thread(Leaderboard.reconcile, guild.id)
+            except Exception as e:
+                logger.warning(f"Failed to reconcile leaderboard for {guild.id}: {type(e).__name__}: {e}")
+
+    @reconcile_leaderboards.before_loop
+    async def before_reconcile_leaderboards(self) -> None:
+        await self.bot.wait_until_ready()
+
+    @tasks.loop(minutes=60)
+    async def compact_ledger(self) -> None:
+        # Snapshots are global, one cluster process is enough
+        if self.bot.shard_ids is not None and 0 not in self.bot.shard_ids:
+            return
+
+        try:
+            result = await asyncio.to_thread(Ledger.compact)
+        except Exception as e:
+            logger.warning(f"Failed to compact the economy ledger: {type(e).__name__}: {e}")
+            return
+
+        if result["scanned"]:
+            logger.info(f"Compacted {result['scanned']} ledger entries into {result['snapshots']} snapshot(s)")
+
+    @compact_ledger.before_loop
+    async def before_compact_ledger(self) -> None:
+        await self.bot.wait_until_ready()
+
+    @tasks.loop(minutes=30)
+    async def refresh_stats(self) -> None:
+        guild_ids = await asyncio.to_thread(EconomyStats.due, time.time() - STATS_IDLE)
+
+        for guild_id in guild_ids:
+            # Each cluster process refreshes the guilds it has
+            if self.bot.get_guild(guild_id) is None:
+                continue
+
+            try:
+                await asyncio.to_thread(EconomyStats.refresh, guild_id)
+            except Exception as e:
+                logger.warning(f"Failed to refresh economy stats for {guild_id}: {type(e).__name__}: {e}")
+
+    @refresh_stats.before_loop
+    async def before_refresh_stats(self) -> None:
+        await self.bot.wait_until_ready()
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member: discord.Member) -> None:
+        Leaderboard.remove(member.guild.id, member.id)
+
     @commands.hybrid_command(
         name="balance",
         aliases=["wallet", "bal"],
         description="See yours or someone else's wallet",
         usage="balance [optional: user]"
     )
+    @DataContext.needs("global_author", "author")
     @commands.check(Checks.is_not_blacklisted)
-    @commands.cooldown(3, 10, commands.BucketType.user)
+    @Cooldowns.cooldown(3, 10, commands.BucketType.user)
     async def wallet(self, context: Context, user: discord.Member = None) -> None:
         if not user:
             user = context.author
 
-        c = db["users"]
-        data = c.find_one({"id": user.id, "guild_id": context.guild.id})
+        data = await context.data.user(context.guild.id, user.id, create=True)
 
-        if not data:
-            data = CONSTANTS.user_data_template(user.id, context.guild.id)
-            c.insert_one(data)
-        await context.send(f"**{user}** has ${data['wallet']} in their wallet")
+        await context.send(f"**{user}** has ${data.wallet} in their wallet")
 
     @commands.hybrid_command(
         name="daily",
         description="Get your daily cash",
         usage="daily"
     )
+    @DataContext.needs("global_author", "author", "guild")
     @commands.check(Checks.is_not_blacklisted)
     async def daily(self, context: Context) -> None:
-        c = db["users"]
-        data = await CachedDB.find_one(c, {"id": context.author.id, "guild_id": context.guild.id})
+        data = await context.data.user(context.guild.id, context.author.id, create=True)
 
-        if not data:
-            data = CONSTANTS.user_data_template(context.author.id, context.guild.id)
-            c.insert_one(data)
-        if time.time() - data["last_daily"] < 86400:
-            eta = data["last_daily"] + 86400
+        if time.time() - data.last_daily < 86400:
+            eta = data.last_daily + 86400
             await context.send(
                 f"You can claim your daily cash <t:{int(eta)}:R>"
             )
             return
 
-        guild = db["guilds"]
-        guild_data = await CachedDB.find_one(guild, {"id": context.guild.id})
-
-        if not guild_data:
-            guild_data = CONSTANTS.guild_data_template(context.guild.id)
-            guild.insert_one(guild_data)
+        guild_data = await context.data.guild(context.guild.id)
 
-        data["wallet"] += guild_data["daily_cash"]
-        newdata = {
-            "$set": {"wallet": data["wallet"], "last_daily": time.time()}
-        }
+        data.wallet += guild_data.daily_cash
 
-        await CachedDB.update_one(c, {"id": context.author.id, "guild_id": context.guild.id}, newdata)
+        await self.bot.wallets.update(data.query, inc={"wallet": guild_data.daily_cash}, set={"last_daily": time.time()})
+        self.bot.ledger.record(context.guild.id, context.author.id, "daily", guild_data.daily_cash)
+        self.update_leaderboard(context.guild, (context.author, data.wallet))
 
-        await context.send(f"Added {guild_data['daily_cash']}$ to wallet")
+        await context.send(f"Added {guild_data.daily_cash}$ to wallet")
 
     @commands.hybrid_command(
         name="rob",
         description="Rob someone's wallet",
         usage="rob <user>"
     )
+    @DataContext.needs("global_author", "author")
     @commands.check(Checks.is_not_blacklisted)
-    @commands.cooldown(1, 3600, commands.BucketType.user)
+    @Cooldowns.cooldown(1, 3600, commands.BucketType.user)
     async def rob(self, context: Context, user: discord.Member) -> None:
+        # Nothing was tried in the early returns, the hour isn't used up
         if user == context.author:
+            Cooldowns.refund(context)
             await context.send("You can't rob yourself")
             return
 
-        c = db["users"]
+        target_data = await context.data.user(context.guild.id, user.id)
 
-        target_data = await CachedDB.find_one(c, {"id": user.id, "guild_id": context.guild.id})
-
-        if not target_data:
-            return await context.send("User has no money")
-
-        if target_data["wallet"] == 0:
+        if not target_data or target_data.wallet <= 0:
+            Cooldowns.refund(context)
             return await context.send("User has no money")
 
-        author_data = await CachedDB.find_one(c, {"id": context.author.id, "guild_id": context.guild.id})
-
-        if not author_data:
-            author_data = CONSTANTS.user_data_template(context.author.id, context.guild.id)
-            c.insert_one(author_data)
+        author_data = await context.data.user(context.guild.id, context.author.id, create=True)
 
-        max_payout = target_data["wallet"] // 5
+        max_payout = target_data.wallet // 5
 
-        if target_data["last_robbed_at"] > time.time() - 10800:
-            eta = target_data["last_robbed_at"] + 10800
+        if target_data.last_robbed_at > time.time() - 10800:
+            Cooldowns.refund(context)
+            eta = target_data.last_robbed_at + 10800
             await context.send(
                 f"This user can be robbed again <t:{int(eta)}:R>"
             )
@@ -112,43 +184,31 @@ class Economy(commands.Cog, name="🪙 Economy"):
         result = random.randint(0, 2)
         if result == 0:
             payout = random.randint(1, max_payout)
-            author_data["wallet"] += payout
-            target_data["wallet"] -= payout
 
-            newdata = {
-                "$set": {
-                    "wallet": author_data["wallet"],
-                }
-            }
+            if not await self.bot.wallets.debit(target_data.query, "wallet", payout, set={"last_robbed_at": time.time()}):
+                Cooldowns.refund(context)
+                return await context.send("User has no money")
 
-            newdata2 = {
-                "$set": {
-                    "wallet": target_data["wallet"],
-                    "last_robbed_at": time.time()
-                }
-            }
+            author_data.wallet += payout
+            target_data.wallet -= payout
 
-            await CachedDB.update_one(c, {"id": context.author.id, "guild_id": context.guild.id}, newdata)
-            await CachedDB.update_one(c, {"id": user.id, "guild_id": context.guild.id}, newdata2)
+            await self.bot.wallets.update(author_data.query, inc={"wallet": payout})
+            self.bot.ledger.transfer(context.guild.id, user.id, context.author.id, payout, "rob")
+            self.update_leaderboard(context.guild, (context.author, author_data.wallet), (user, target_data.wallet))
 
             await context.send(f"You successfully robbed {user} and got {payout}$")
         elif result == 1:
-            payout = min(random.randint(1, max_payout//2), author_data["wallet"]//3, 10000)
-            author_data["wallet"] -= payout
-            target_data["wallet"] += payout
+            payout = min(random.randint(1, max_payout//2), author_data.wallet//3, 10000)
 
-            newdata = {
-                "$set": {
-                    "wallet": author_data["wallet"],
-                }
-            }
+            if not await self.bot.wallets.debit(author_data.query, "wallet", payout):
+                return await context.send(f"You failed to rob {user}, but lost nothing")
 
-            newdata2 = {
-                "$set": {"wallet": target_data["wallet"], "last_robbed_at": time.time()}
-            }
+            author_data.wallet -= payout
+            target_data.wallet += payout
 
-            await CachedDB.update_one(c, {"id": context.author.id, "guild_id": context.guild.id}, newdata)
-            await CachedDB.update_one(c, {"id": user.id, "guild_id": context.guild.id}, newdata2)
+            await self.bot.wallets.update(target_data.query, inc={"wallet": payout}, set={"last_robbed_at": time.time()})
+            self.bot.ledger.transfer(context.guild.id, context.author.id, user.id, payout, "rob")
+            self.update_leaderboard(context.guild, (context.author, author_data.wallet), (user, target_data.wallet))
 
             await context.send(f"You got caught by {user} and they took {payout}$")
         else:
@@ -156,32 +216,111 @@ class Economy(commands.Cog, name="🪙 Economy"):
 
     @commands.hybrid_command(
         name="baltop",
-        description="See the top 10 richest users",
-        usage="baltop"
+        description="See the richest users",
+        usage="baltop [optional: page]"
     )
     @commands.check(Checks.is_not_blacklisted)
-    async def baltop(self, context: Context) -> None:
-        c = db["users"]
-        data = c.find({"guild_id": context.guild.id}).sort("wallet", -1).limit(10)
+    async def baltop(self, context: Context, page: int = 1) -> None:
+        page = max(1, page)
+
+        if not Leaderboard.exists(context.guild.id):
+            await asyncio.to_thread(Leaderboard.reconcile, context.guild.id)
+
+        entries, members = await self.leaderboard_page(context.guild, page)
+        position, wallet, total = Leaderboard.rank(context.guild.id, context.author.id)
 
         embed = discord.Embed(
             title="Top Balances",
-            description="",
+            description="" if entries else "Nobody on this page yet.",
+            color=discord.Color.gold(),
+        )
+
+        for i, (user_id, balance) in enumerate(entries, start=(page - 1) * Leaderboard.PAGE_SIZE + 1):
+            member = members[user_id]
+            embed.add_field(
+                name=f"{i}. {member.nick if member.nick else member.display_name if member.display_name else member.name}",
+                value=f"${balance}",
+                inline=False,
+            )
+
+        pages = max(1, -(-total // Leaderboard.PAGE_SIZE))
+        footer = f"Page {page}/{pages}"
+
+        if position is not None:
+            footer += f" • Your rank: #{position} (${wallet})"
+
+        embed.set_footer(text=footer)
+
+        await context.send(embed=embed)
+
+    async def leaderboard_page(self, guild: discord.Guild, page: int):
+        # Drop users that left or are bots as they're found, then read the
+        # page again so it still shows a full page. Users whose lookup failed
+        # are only left off this page
+        for _ in range(3):
+            entries = Leaderboard.page(guild.id, page)
+            members, unresolved = await Members.resolve_members(guild, [user_id for user_id, _ in entries])
+
+            stale = [
+                user_id for user_id, _ in entries
+                if (user_id not in members and user_id not in unresolved) or (user_id in members and members[user_id].bot)
+            ]
+
+            if not stale:
+                break
+
+            Leaderboard.remove(guild.id, *stale)
+
+        entries = [(user_id, balance) for user_id, balance in entries if user_id in members and not members[user_id].bot]
+
+        return entries, members
+
+    @commands.hybrid_command(
+        name="ecostats",
+        aliases=["economystats"],
+        description="See stats about the server's economy",
+        usage="ecostats"
+    )
+    @commands.check(Checks.is_not_blacklisted)
+    @Cooldowns.cooldown(1, 10, commands.BucketType.guild)
+    async def ecostats(self, context: Context) -> None:
+        data = await EconomyStats.get(context.guild.id)
+
+        # Also covers stats the refresh loop hasn't picked up yet, e.g. the
+        # first request or one after the guild went idle
+        if not data or data["time"] < time.time() - 2 * self.stats_interval:
+            await asyncio.to_thread(EconomyStats.refresh, context.guild.id)
+            data = await EconomyStats.get(context.guild.id)
+
+        if not data:
+            await context.send("Nobody here has used the economy yet")
+            return
+
+        if data.get("requested_at", 0) < time.time() - 86400:
+            await asyncio.to_thread(EconomyStats.requested, context.guild.id)
+
+        embed = discord.Embed(
+            title="Economy Stats",
             color=discord.Color.gold(),
+            timestamp=datetime.fromtimestamp(data["time"], tz=timezone.utc),
         )
 
-        i = 1
-        for _, user in enumerate(data, start=1):
-            member = context.guild.get_member(user["id"])
-            if member != None:
-                if member.bot:
-                    continue
-                embed.add_field(
-                    name=f"{i}. {member.nick if member.nick else member.display_name if member.display_name else member.name}",
-                    value=f"${user['wallet']}",
-                    inline=False,
-                )
-                i += 1
+        embed.add_field(name="Money supply", value=f"${data['total']}")
+        embed.add_field(name="Users", value=str(data["users"]))
+        embed.add_field(name="Richest", value=f"${data['max']}")
+        embed.add_field(name="Mean wallet", value=f"${data['mean']:.0f}")
+        embed.add_field(name="Median wallet", value=f"${data['median']:.0f}")
+        embed.add_field(name="Inequality (Gini)", value=f"{data['gini']:.2f}")
+        embed.add_field(name="Top 10% hold", value=f"{data['top_share'] * 100:.1f}%")
+
+        if data.get("daily"):
+            embed.add_field(
+                name=f"Daily claims (last {EconomyStats.DAILY_DAYS} days)",
+                value="\n".join(f"`{day['day']}` {day['claims']} claims, ${day['amount']}" for day in data["daily"]),
+                inline=False,
+            )
+
+        embed.set_footer(text="Last updated")
 
         await context.send(embed=embed)
 
@@ -190,6 +329,7 @@ class Economy(commands.Cog, name="🪙 Economy"):
         description="Pay someone from your wallet",
         usage="pay <user> <amount>"
     )
+    @DataContext.needs("global_author", "author")
     @commands.check(Checks.is_not_blacklisted)
     async def pay(self, context: Context, user: discord.Member, amount: int) -> None:
         if amount < 0:
@@ -200,32 +340,25 @@ class Economy(commands.Cog, name="🪙 Economy"):
             await context.send("You can't pay yourself")
             return
 
-        c = db["users"]
-        data = await CachedDB.find_one(c, {"id": context.author.id, "guild_id": context.guild.id})
+        data = await context.data.user(context.guild.id, context.author.id, create=True)
 
-        if not data:
-            data = CONSTANTS.user_data_template(context.author.id, context.guild.id)
-            c.insert_one(data)
-        if data["wallet"] < amount:
+        if data.wallet < amount:
             await context.send("You don't have enough money")
             return
 
-        target_user_data = c.find_one({"id": user.id, "guild_id": context.guild.id})
-        if not target_user_data:
-            target_user_data = CONSTANTS.user_data_template(user.id, context.guild.id)
+        target_user_data = await context.data.user(context.guild.id, user.id, create=True)
+
+        # The check above can be stale by now, this one can't
+        if not await self.bot.wallets.debit(data.query, "wallet", amount):
+            await context.send("You don't have enough money")
+            return
 
-            c.insert_one(target_user_data)
-        data["wallet"] -= amount
-        target_user_data["wallet"] += amount
-        newdata = {
-            "$set": {"wallet": data["wallet"]}
-        }
-        newdata2 = {
-            "$set": {"wallet": target_user_data["wallet"]}
-        }
+        data.wallet -= amount
+        target_user_data.wallet += amount
 
-        await CachedDB.update_one(c, {"id": context.author.id, "guild_id": context.guild.id}, newdata)
-        await CachedDB.update_one(c, {"id": user.id, "guild_id": context.guild.id}, newdata2)
+        await self.bot.wallets.update(target_user_data.query, inc={"wallet": amount})
+        self.bot.ledger.transfer(context.guild.id, context.author.id, user.id, amount, "pay")
+        self.update_leaderboard(context.guild, (context.author, data.wallet), (user, target_user_data.wallet))
 
         await context.send(f"Paid {amount}$ to {user.mention}")
 
@@ -237,20 +370,11 @@ class Economy(commands.Cog, name="🪙 Economy"):
     @commands.check(Checks.is_not_blacklisted)
     @commands.has_permissions(manage_messages=True)
     async def set(self, context: Context, user: discord.Member, amount: int) -> None:
-        c = db["users"]
-
-        target_user_data = await CachedDB.find_one(c, {"id": user.id, "guild_id": context.guild.id})
-
-        if not target_user_data:
-            target_user_data = CONSTANTS.user_data_template(context.author.id, context.guild.id)
-
-            c.insert_one(target_user_data)
-
-        newdata = {
-            "$set": {"wallet": amount}
-        }
+        data = await context.data.user(context.guild.id, user.id, create=True)
 
-        await CachedDB.update_one(c, {"id": user.id, "guild_id": context.guild.id}, newdata)
+        await self.bot.wallets.update(data.query, set={"wallet": amount})
+        self.bot.ledger.record(context.guild.id, user.id, "set", balance=amount, ref=context.author.id)
+        self.update_leaderboard(context.guild, (user, amount))
 
         await context.send(f"Set {user.mention}'s wallet to {amount}$")
 
@@ -4,7 +4,6 @@ import random
 import discord
 import aiohttp
 import json
-import requests
 import io
 
 from io import BytesIO
@@ -184,10 +183,10 @@ class Fun(commands.Cog, name="🎉 Fun"):
     @app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True)
     async def advice(self, context: Context) -> None:
         async with aiohttp.ClientSession() as session:
-            r = requests.get("https://api.adviceslip.com/advice")
-            data = json.loads(r.text)
+            async with session.get("https://api.adviceslip.com/advice") as r:
+                data = json.loads(await r.text())
 
-            await context.send(data["slip"]["advice"])
+                await context.send(data["slip"]["advice"])
 
     @commands.hybrid_command(
         name="insult",
@@ -13,8 +13,6 @@ from discord import app_commands
 from discord.ext import commands
 from discord.ext.commands import Context
 
-from deep_translator import GoogleTranslator
-
 from utils import DBClient, Checks
 
 db = DBClient.db
@@ -148,12 +146,12 @@ class General(commands.Cog, name="⬜ General"):
     @app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True)
     async def botinfo(self, context: Context) -> None:
         dpyVersion = discord.__version__
-        serverCount = len(self.bot.guilds)
-        memberCount = len(set(self.bot.get_all_members()))
+        serverCount = self.bot.stats.guilds
+        memberCount = self.bot.stats.members
 
         embed = discord.Embed(title=f'{self.bot.user.name} - Stats', color = discord.Color.blurple())
 
-        command_count = len([command for command in self.bot.walk_commands()])
+        command_count = self.bot.stats.commands
 
         embed.add_field(name="Discord.Py Version:", value=dpyVersion)
         embed.add_field(name="Ping:", value=f"{round(self.bot.latency * 1000)}ms")
@@ -190,6 +188,8 @@ class General(commands.Cog, name="⬜ General"):
     @app_commands.allowed_installs(guilds=True, users=True)
     @app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True)
     async def translate(self, context: Context, text: str, language: str = "en") -> None:
+        # deep_translator pulls in requests and bs4, only import it when needed
+        from deep_translator import GoogleTranslator
 
         translated = GoogleTranslator(source='auto', target=language).translate(text)
 
@@ -5,17 +5,12 @@ import os
 import logging
 
 import discord
-import lavalink
 from discord.ext import commands
 from discord.ext.commands import Context
-from lavalink.events import TrackStartEvent, QueueEndEvent
-from lavalink.errors import ClientError
-from lavalink.filters import LowPass, Timescale
-from lavalink.server import LoadType
 
 url_rx = re.compile(r'https?://(?:www\.)?.+')
 
-from utils import Checks
+from utils import Checks, Shutdown
 
 logger = logging.getLogger("discord_bot")
 
@@ -26,6 +21,17 @@ password = os.getenv("LAVALINK_PASSWORD")
 region = os.getenv("LAVALINK_REGION")
 name = os.getenv("LAVALINK_NAME")
 
+def get_lavalink(bot):
+    # lavalink is imported and connected on first use instead of at cog load
+    if not hasattr(bot, 'lavalink'):
+        import lavalink
+
+        bot.lavalink = lavalink.Client(bot.user.id)
+        bot.lavalink.add_node(host=host, port=port, password=password,
+                              region=region, name=name)
+
+    return bot.lavalink
+
 class LavalinkVoiceClient(discord.VoiceProtocol):
     def __init__(self, client: discord.Client, channel: discord.abc.Connectable):
         self.client = client
@@ -33,12 +39,7 @@ class LavalinkVoiceClient(discord.VoiceProtocol):
         self.guild_id = channel.guild.id
         self._destroyed = False
 
-        if not hasattr(self.client, 'lavalink'):
-            self.client.lavalink = lavalink.Client(client.user.id)
-            self.client.lavalink.add_node(host=host, port=port, password=password,
-                                          region=region, name=name)
-
-        self.lavalink = self.client.lavalink
+        self.lavalink = get_lavalink(self.client)
 
     async def on_voice_server_update(self, data):
         lavalink_data = {
@@ -78,6 +79,8 @@ class LavalinkVoiceClient(discord.VoiceProtocol):
         await self._destroy()
 
     async def _destroy(self):
+        from lavalink.errors import ClientError
+
         self.cleanup()
 
         if self._destroyed:
@@ -94,17 +97,39 @@ class LavalinkVoiceClient(discord.VoiceProtocol):
 class Music(commands.Cog, name="🎵 Music"):
     def __init__(self, bot):
         self.bot = bot
+        self._hooks_added = False
 
-        if not hasattr(bot, 'lavalink'):
-            bot.lavalink = lavalink.Client(bot.user.id)
-            bot.lavalink.add_node(host=host, port=port, password=password,
-                                  region=region, name=name)
+    @property
+    def lavalink(self):
+        client = get_lavalink(self.bot)
 
-        self.lavalink: lavalink.Client = bot.lavalink
-        self.lavalink.add_event_hooks(self)
+        if not self._hooks_added:
+            from lavalink.events import TrackStartEvent, QueueEndEvent
+
+            client.add_event_hook(self.on_track_start, event=TrackStartEvent)
+            client.add_event_hook(self.on_queue_end, event=QueueEndEvent)
+            self._hooks_added = True
+
+        return client
+
+    async def cog_load(self):
+        self.bot.shutdown_coordinator.register(self.disconnect_players, Shutdown.DISCONNECT, "disconnect players")
 
     def cog_unload(self):
-        self.lavalink._event_hooks.clear()
+        self.bot.shutdown_coordinator.unregister(self.disconnect_players)
+
+        if self._hooks_added:
+            self.bot.lavalink._event_hooks.clear()
+
+    async def disconnect_players(self):
+        if not hasattr(self.bot, 'lavalink'):
+            return
+
+        for voice_client in list(self.bot.voice_clients):
+            if isinstance(voice_client, LavalinkVoiceClient):
+                await voice_client.disconnect(force=True)
+
+        await self.bot.lavalink.close()
 
     async def cog_command_error(self, context, error):
         if isinstance(error, commands.CommandInvokeError):
@@ -114,7 +139,7 @@ class Music(commands.Cog, name="🎵 Music"):
         if context.guild is None:
             raise commands.NoPrivateMessage()
 
-        player = context.bot.lavalink.player_manager.create(context.guild.id)
+        player = context.cog.lavalink.player_manager.create(context.guild.id)
 
         should_connect = context.command.name in ('play',)
 
@@ -148,8 +173,7 @@ class Music(commands.Cog, name="🎵 Music"):
 
         return True
 
-    @lavalink.listener(TrackStartEvent)
-    async def on_track_start(self, event: TrackStartEvent):
+    async def on_track_start(self, event):
         guild_id = event.player.guild_id
         channel_id = event.player.fetch('channel')
         guild = self.bot.get_guild(guild_id)
@@ -165,8 +189,7 @@ class Music(commands.Cog, name="🎵 Music"):
 
 
 
-    @lavalink.listener(QueueEndEvent)
-    async def on_queue_end(self, event: QueueEndEvent):
+    async def on_queue_end(self, event):
         guild_id = event.player.guild_id
         guild = self.bot.get_guild(guild_id)
 
@@ -182,7 +205,9 @@ class Music(commands.Cog, name="🎵 Music"):
     @commands.check(Checks.is_not_blacklisted)
     @commands.check(create_player)
     async def play(self, context, *, query: str):
-        player = self.bot.lavalink.player_manager.get(context.guild.id)
+        from lavalink.server import LoadType
+
+        player = self.lavalink.player_manager.get(context.guild.id)
         query = query.strip('<>')
 
         if not url_rx.match(query):
@@ -222,7 +247,7 @@ class Music(commands.Cog, name="🎵 Music"):
     @commands.check(Checks.is_not_blacklisted)
     @commands.check(create_player)
     async def skip(self, context):
-        await self.bot.lavalink.player_manager.get(context.guild.id).skip()
+        await self.lavalink.player_manager.get(context.guild.id).skip()
 
     @commands.hybrid_command(
         name="pause",
@@ -232,7 +257,7 @@ class Music(commands.Cog, name="🎵 Music"):
     @commands.check(Checks.is_not_blacklisted)
     @commands.check(create_player)
     async def pause(self, context):
-        player = self.bot.lavalink.player_manager.get(context.guild.id)
+        player = self.lavalink.player_manager.get(context.guild.id)
 
         if player.is_playing:
             await player.set_pause(True)
@@ -246,7 +271,7 @@ class Music(commands.Cog, name="🎵 Music"):
     @commands.check(Checks.is_not_blacklisted)
     @commands.check(create_player)
     async def resume(self, context):
-        player = self.bot.lavalink.player_manager.get(context.guild.id)
+        player = self.lavalink.player_manager.get(context.guild.id)
 
         if player.paused:
             await player.set_pause(False)
@@ -261,7 +286,7 @@ class Music(commands.Cog, name="🎵 Music"):
     @commands.check(Checks.is_not_blacklisted)
     @commands.check(create_player)
     async def loop(self, context):
-        player = self.bot.lavalink.player_manager.get(context.guild.id)
+        player = self.lavalink.player_manager.get(context.guild.id)
         player.loop = not player.loop
 
         await context.send(f"🔁 | {'Enabled' if player.loop else 'Disabled'} loop.")
@@ -294,7 +319,7 @@ class Music(commands.Cog, name="🎵 Music"):
     @commands.check(Checks.is_not_blacklisted)
     @commands.check(create_player)
     async def lowpass(self, context, strength: float = 0.0):
-        player = self.bot.lavalink.player_manager.get(context.guild.id)
+        player = self.lavalink.player_manager.get(context.guild.id)
 
         strength = max(0, strength)
         strength = min(100, strength)
@@ -309,6 +334,8 @@ class Music(commands.Cog, name="🎵 Music"):
             embed.description = 'Disabled **Low Pass Filter**'
             return await context.send(embed=embed)
 
+        from lavalink.filters import LowPass
+
         low_pass = LowPass()
         low_pass.update(smoothing=strength)
 
@@ -327,10 +354,12 @@ class Music(commands.Cog, name="🎵 Music"):
     @commands.check(Checks.is_not_blacklisted)
     @commands.check(create_player)
     async def pitch(self, context: Context, pitch: float):
-        player = self.bot.lavalink.player_manager.get(context.guild.id)
+        player = self.lavalink.player_manager.get(context.guild.id)
 
         pitch = max(0.1, pitch)
 
+        from lavalink.filters import Timescale
+
         timescale = Timescale()
         timescale.pitch = pitch
         await player.set_filter(timescale)
@@ -347,10 +376,12 @@ class Music(commands.Cog, name="🎵 Music"):
     @commands.check(Checks.is_not_blacklisted)
     @commands.check(create_player)
     async def speed(self, context: Context, speed: float):
-        player = self.bot.lavalink.player_manager.get(context.guild.id)
+        player = self.lavalink.player_manager.get(context.guild.id)
 
         speed = max(0.1, speed)
 
+        from lavalink.filters import Timescale
+
         timescale = Timescale()
         timescale.speed = speed
         await player.set_filter(timescale)
@@ -366,7 +397,7 @@ class Music(commands.Cog, name="🎵 Music"):
     @commands.check(Checks.is_not_blacklisted)
     @commands.check(create_player)
     async def disconnect(self, context):
-        player = self.bot.lavalink.player_manager.get(context.guild.id)
+        player = self.lavalink.player_manager.get(context.guild.id)
 
         player.queue.clear()
         await player.stop()
@@ -382,7 +413,7 @@ class Music(commands.Cog, name="🎵 Music"):
     @commands.check(Checks.is_not_blacklisted)
     @commands.check(create_player)
     async def volume(self, context: Context, volume: int):
-        player = self.bot.lavalink.player_manager.get(context.guild.id)
+        player = self.lavalink.player_manager.get(context.guild.id)
 
         volume = max(1, volume)
         volume = min(100, volume)
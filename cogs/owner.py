@@ -1,5 +1,6 @@
 # This project is licensed under the terms of the GPL v3.0 license. Copyright 2024 Cyteon
 
+import asyncio
 import discord
 import ast
 import sys
@@ -8,7 +9,7 @@ from discord import app_commands
 from discord.ext import commands
 from discord.ext.commands import Context
 
-from utils import CONSTANTS, DBClient, Checks, CachedDB
+from utils import DBClient, Checks, CachedDB, Cases, CommandSync, Ledger, Models
 
 client = DBClient.client
 db = client.potatobot
@@ -57,26 +58,27 @@ class Owner(commands.Cog, name="owner"):
     @dev.command(
         name="sync",
         description="Sync the slash commands.",
-        usage="dev sync guild/global"
+        usage="dev sync guild/global [force]"
     )
     @app_commands.describe(scope="The scope of the sync. Can be `global` or `guild`")
+    @app_commands.describe(force="Sync even if the commands have not changed")
     @commands.is_owner()
-    async def sync(self, context: Context, scope: str) -> None:
+    async def sync(self, context: Context, scope: str, force: bool = False) -> None:
         await context.defer()
 
         if scope == "global":
-            await context.bot.tree.sync()
+            synced = await CommandSync.sync(context.bot.tree, force=force)
             embed = discord.Embed(
-                description="Slash commands have been globally synchronized.",
+                description="Slash commands have been globally synchronized." if synced else "Slash commands are already up to date globally.",
                 color=0xBEBEFE,
             )
             await context.send(embed=embed)
             return
         elif scope == "guild":
             context.bot.tree.copy_global_to(guild=context.guild)
-            await context.bot.tree.sync(guild=context.guild)
+            synced = await CommandSync.sync(context.bot.tree, guild=context.guild, force=force)
             embed = discord.Embed(
-                description="Slash commands have been synchronized in this guild.",
+                description="Slash commands have been synchronized in this guild." if synced else "Slash commands are already up to date in this guild.",
                 color=0xBEBEFE,
             )
             await context.send(embed=embed)
@@ -97,7 +99,7 @@ class Owner(commands.Cog, name="owner"):
 
         if scope == "global":
             context.bot.tree.clear_commands(guild=None)
-            await context.bot.tree.sync()
+            await CommandSync.sync(context.bot.tree, force=True)
             embed = discord.Embed(
                 description="Slash commands have been globally unsynchronized.",
                 color=0xBEBEFE,
@@ -106,7 +108,7 @@ class Owner(commands.Cog, name="owner"):
             return
         elif scope == "guild":
             context.bot.tree.clear_commands(guild=context.guild)
-            await context.bot.tree.sync(guild=context.guild)
+            await CommandSync.sync(context.bot.tree, guild=context.guild, force=True)
             embed = discord.Embed(
                 description="Slash commands have been unsynchronized in this guild.",
                 color=0xBEBEFE,
@@ -194,7 +196,67 @@ class Owner(commands.Cog, name="owner"):
     async def shutdown(self, context: Context) -> None:
         embed = discord.Embed(description="Shutting down. Bye! :wave:", color=0xBEBEFE)
         await context.send(embed=embed)
-        sys.exit(0)
+        self.bot.graceful_shutdown()
+
+    @dev.command(
+        name="ledger",
+        description="Verify, compact or bootstrap the economy ledger",
+        usage="dev ledger verify/compact/bootstrap [guild id]"
+    )
+    @commands.is_owner()
+    async def ledger(self, context: Context, action: str, guild_id: int = None) -> None:
+        if action not in ("verify", "compact", "bootstrap"):
+            return await context.send("Action must be one of `verify`, `compact` or `bootstrap`")
+
+        await context.defer()
+
+        # Whatever is still buffered has to be in the database first
+        await self.bot.wallets.flush()
+        await asyncio.to_thread(self.bot.ledger.flush)
+
+        if action == "compact":
+            result = await asyncio.to_thread(Ledger.compact)
+            return await context.send(f"Compacted {result['scanned']} entries into {result['snapshots']} snapshot(s)")
+
+        if action == "bootstrap":
+            count = await asyncio.to_thread(Ledger.bootstrap, guild_id)
+            return await context.send(f"Recorded opening balances for {count} user(s)")
+
+        result = await asyncio.to_thread(Ledger.verify, guild_id)
+
+        embed = discord.Embed(
+            title="Ledger Verification",
+            description=f"Checked {result['entries']} entries for {result['users']} user(s)",
+            color=0xBEBEFE if not result["snapshot_mismatches"] and not result["wallet_mismatches"] else 0xE02B2B
+        )
+
+        for name, mismatches, field in (
+            ("Snapshot Mismatches", result["snapshot_mismatches"], "snapshot"),
+            ("Wallet Mismatches", result["wallet_mismatches"], "wallet"),
+        ):
+            lines = [f"{m['guild_id']}/{m['user_id']}: {m[field]} != {m['ledger']}" for m in mismatches[:10]]
+
+            if len(mismatches) > 10:
+                lines.append(f"+{len(mismatches) - 10} more")
+
+            embed.add_field(name=f"{name} ({len(mismatches)})", value="\n".join(lines) or "None", inline=False)
+
+        await context.send(embed=embed)
+
+    @dev.command(
+        name="migrate",
+        description="Move warnings stored on users into moderation cases",
+        usage="dev migrate [force]"
+    )
+    @commands.is_owner()
+    async def migrate(self, context: Context, force: bool = False) -> None:
+        if not force and await asyncio.to_thread(Cases.migration_done):
+            return await context.send("Warnings were already migrated, pass `force` to check for leftovers")
+
+        await context.defer()
+
+        count = await asyncio.to_thread(Cases.migrate)
+        await context.send(f"Migrated {count} warning(s) to moderation cases")
 
     @commands.command(
         name="say",
@@ -276,11 +338,7 @@ class Owner(commands.Cog, name="owner"):
     @app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True)
     async def blacklist(self, context, user: discord.User, *, reason: str = "No reason provided"):
         users_global = db["users_global"]
-        user_data = users_global.find_one({"id": user.id})
-
-        if user is None:
-            user_data = CONSTANTS.user_global_data_template(user.id)
-            users_global.insert_one(user_data)
+        await Models.GlobalUser.get_or_create(user.id, fields=())
 
         newdata = {
             "$set": {
@@ -314,11 +372,7 @@ class Owner(commands.Cog, name="owner"):
     @app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True)
     async def unblacklist(self, context, user: discord.User):
         users_global = db["users_global"]
-        user_data = users_global.find_one({"id": user.id})
-
-        if user_data is None:
-            user_data = CONSTANTS.user_global_data_template(user.id)
-            users_global.insert_one(user_data)
+        await Models.GlobalUser.get_or_create(user.id, fields=())
 
         newdata = {
             "$set": {
@@ -5,10 +5,7 @@ import discord
 from discord.ext import commands
 from discord.ext.commands import Context
 
-from utils import Checks, DBClient, CONSTANTS
-
-
-db = DBClient.db
+from utils import Checks, GuildSettings
 
 class Server(commands.Cog, name="⚙️ Server"):
     def __init__(self, bot) -> None:
@@ -94,20 +91,17 @@ class Server(commands.Cog, name="⚙️ Server"):
     @commands.check(Checks.is_not_blacklisted)
     @commands.has_permissions(manage_channels=True)
     async def show(self, context: Context) -> None:
-        c = db["guilds"]
-        data = c.find_one({"id": context.guild.id})
-
-        if not data:
-            data = CONSTANTS.guild_data_template(context.guild.id)
-            c.insert_one(data)
+        data = await self.bot.guild_settings.get(context.guild.id)
+        log_channel = context.guild.get_channel(data.log_channel) if data.log_channel else None
 
         embed = discord.Embed(
             title="Server Settings",
             color=discord.Color.blue()
         )
 
-        embed.add_field( name="Daily Cash", value=data["daily_cash"] )
-        embed.add_field( name="Log Channel", value=context.guild.get_channel(data["log_channel"]).mention if data["log_channel"] else "None" )
+        embed.add_field( name="Daily Cash", value=data.daily_cash )
+        embed.add_field( name="Log Channel", value=log_channel.mention if log_channel else "None" )
+        embed.add_field( name="Anti Spam", value="On" if data.anti_spam else "Off" )
         await context.send(embed=embed)
 
     @settings.command(
@@ -118,17 +112,11 @@ class Server(commands.Cog, name="⚙️ Server"):
     @commands.check(Checks.is_not_blacklisted)
     @commands.has_permissions(administrator=True)
     async def daily_cash(self, context: Context, amount: int) -> None:
-        c = db["guilds"]
-
-        data = c.find_one({"id": context.guild.id})
-
-        if not data:
-            data = CONSTANTS.guild_data_template(context.guild.id)
-            c.insert_one(data)
-
-        newdata = { "$set": { "daily_cash": amount } }
-
-        c.update_one({"id": context.guild.id}, newdata)
+        try:
+            await self.bot.guild_settings.update(context.guild.id, daily_cash=amount)
+        except GuildSettings.InvalidSetting as e:
+            await context.send(str(e))
+            return
 
         await context.send(f"Set daily cash to {amount}")
 
@@ -140,19 +128,21 @@ class Server(commands.Cog, name="⚙️ Server"):
     @commands.check(Checks.is_not_blacklisted)
     @commands.has_permissions(manage_channels=True)
     async def log_channel(self, context: Context, channel: discord.TextChannel) -> None:
-        c = db["guilds"]
+        await self.bot.guild_settings.update(context.guild.id, log_channel=channel.id)
 
-        data = c.find_one({"id": context.guild.id})
-
-        if not data:
-            data = CONSTANTS.guild_data_template(context.guild.id)
-            c.insert_one(data)
-
-        newdata = { "$set": { "log_channel": channel.id } }
+        await context.send(f"Set log channel to {channel.mention}")
 
-        c.update_one({"id": context.guild.id}, newdata)
+    @settings.command(
+        name="anti-spam",
+        description="Turn automatic spam and raid detection on or off",
+        usage="settings anti-spam <on/off>"
+    )
+    @commands.check(Checks.is_not_blacklisted)
+    @commands.has_permissions(administrator=True)
+    async def anti_spam(self, context: Context, enabled: bool) -> None:
+        await self.bot.guild_settings.update(context.guild.id, anti_spam=enabled)
 
-        await context.send(f"Set log channel to {channel.mention}")
+        await context.send(f"Anti spam is now {'on' if enabled else 'off'}")
 
 async def setup(bot) -> None:
     await bot.add_cog(Server(bot))
@@ -1,119 +1,483 @@
 # This project is licensed under the terms of the GPL v3.0 license. Copyright 2024 Cyteon
 
+import asyncio
+import io
+import logging
 import os
 
 import re
-from datetime import datetime, timedelta
+import time
+import typing
+from datetime import datetime, timedelta, timezone
 
 import discord
 from discord import app_commands
 from discord.ext import commands
 from discord.ext.commands import Context
 
-from utils import DBClient, CONSTANTS, Checks, CachedDB
+from utils import DBClient, Checks, Members, BulkModeration, Purge, Archive, Cases
 
 client = DBClient.client
 db = client.potatobot
 
+logger = logging.getLogger("discord_bot")
+
+# Seconds to wait for a DM before going ahead with a moderation action
+DM_TIMEOUT = 3
+
+# Most messages a single cleanup will look through
+CLEANUP_MAX_SCAN = 10000
+
+# Most messages a single archive will export
+ARCHIVE_MAX_MESSAGES = 100000
+
+# Seconds to keep ignoring delete events for purged messages, the gateway
+# events can arrive after the purge request has returned
+PURGE_GRACE = 5
+
+# Discord timeouts are capped at 28 days, longer mutes are renewed by the
+# scheduler a bit before the current timeout runs out
+MAX_TIMEOUT = timedelta(days=28)
+TIMEOUT_RENEW_MARGIN = timedelta(hours=1)
+
+duration_rx = re.compile(r"^(\d+)([ydhmsw])$")
+
+def parse_duration(text: str):
+    try:
+        # Try to parse the string as a datetime
+        dt = datetime.fromisoformat(text)
+
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+
+        return dt - discord.utils.utcnow()
+    except ValueError:
+        pass
+
+    # If the string is not a valid datetime, try to parse it as a duration
+    match = duration_rx.match(text)
+
+    if not match:
+        return None
+
+    value, unit = int(match.group(1)), match.group(2)
+
+    return {
+        'y': timedelta(days=365*value),
+        'w': timedelta(days=7*value),
+        'd': timedelta(days=value),
+        'h': timedelta(hours=value),
+        'm': timedelta(minutes=value),
+        's': timedelta(seconds=value),
+    }[unit]
+
+def message_line(message: discord.Message) -> str:
+    attachments = " ".join(attachment.url for attachment in message.attachments)
+
+    return f"{message.created_at.strftime('%d.%m.%Y %H:%M:%S')} {message.author} ({message.author.id}): {message.content} {attachments}".rstrip()
+
+def stored_line(entry) -> str:
+    created_at = datetime.fromtimestamp(entry.timestamp, tz=timezone.utc)
+
+    return f"{created_at.strftime('%d.%m.%Y %H:%M:%S')} ({entry.author_id}): {entry.content}"
+
+def transcript(lines, filename: str) -> discord.File:
+    return discord.File(io.BytesIO("\n".join(lines).encode("utf-8")), filename=filename)
+
+def is_loggable(author) -> bool:
+    if author.bot:
+        return False
+
+    return not (isinstance(author, discord.Member) and author.guild_permissions.administrator)
+
+class Duration(commands.Converter):
+    async def convert(self, context: Context, argument: str) -> timedelta:
+        duration = parse_duration(argument)
+
+        if duration is None or duration <= timedelta(0):
+            raise commands.BadArgument(f"Invalid duration string: {argument}")
+
+        return duration
+
+def case_field(case: dict):
+    moderator = f"<@{case['moderator_id']}>" if case.get("moderator_id") else "Unknown"
+    value = f"{case['reason']}\nBy {moderator}"
+
+    if case.get("expires_at"):
+        value += f", expires <t:{int(case['expires_at'].replace(tzinfo=timezone.utc).timestamp())}:R>"
+
+    return f"#{case['case_id']} • {case['time'].strftime('%d.%m.%Y %H:%M:%S')}", value[:1024]
+
+class WarningsView(discord.ui.View):
+    def __init__(self, author: discord.abc.User, guild_id: int, user: discord.abc.User, total: int, cursor) -> None:
+        super().__init__(timeout=120)
+        self.author = author
+        self.guild_id = guild_id
+        self.user = user
+        self.total = total
+        self.cursor = cursor
+        self.page = 1
+
+    def embed(self, cases: list) -> discord.Embed:
+        embed = discord.Embed(
+            title=f"Warnings for {self.user}",
+            description=None if cases else "No warnings.",
+            color=0xff6961
+        )
+
+        for case in cases:
+            name, value = case_field(case)
+            embed.add_field(name=name, value=value, inline=False)
+
+        pages = max(1, -(-self.total // Cases.PAGE_SIZE))
+        embed.set_footer(text=f"Page {self.page}/{pages} • {self.total} warning(s)")
+
+        return embed
+
+    @discord.ui.button(label="Older", style=discord.ButtonStyle.gray)
+    async def older(self, interaction: discord.Interaction, button: discord.ui.Button) -> None:
+        if interaction.user != self.author:
+            await interaction.response.send_message("You cannot use this button.", ephemeral=True)
+            return
+
+        cases, self.cursor = await asyncio.to_thread(
+            Cases.list_cases, self.guild_id, self.user.id, self.cursor
+        )
+        self.page += 1
+
+        if self.cursor is None:
+            button.disabled = True
+
+        await interaction.response.edit_message(embed=self.embed(cases), view=self)
+
+class CleanupFlags(commands.FlagConverter):
+    user: discord.User = None
+    contains: str = None
+    attachments: bool = False
+    bots: bool = False
+    links: bool = False
+    minutes: int = None
+    limit: int = 100
+
 class Staff(commands.Cog, name="👮‍♂️ Staff"):
     def __init__(self, bot) -> None:
         self.bot = bot
         self.prefixDB = bot.prefixDB
+        # channel id -> [running purges, ids of the messages they delete]
+        self.purging = {}
+
+    async def get_log_channel(self, guild: discord.Guild):
+        data = await self.bot.guild_settings.get(guild.id)
+
+        if not data.log_channel:
+            return None
+
+        return guild.get_channel(data.log_channel)
+
+    async def notify(self, user: discord.abc.Messageable, **kwargs) -> bool:
+        try:
+            await asyncio.wait_for(user.send(**kwargs), timeout=DM_TIMEOUT)
+            return True
+        except Exception:
+            # Couldn't send a message in the private messages of the user
+            return False
+
+    def log_action(self, guild: discord.Guild, embed: discord.Embed) -> None:
+        self.bot.shutdown_coordinator.spawn(self._log_action(guild, embed))
+
+    async def _log_action(self, guild: discord.Guild, embed: discord.Embed) -> None:
+        try:
+            log_channel = await self.get_log_channel(guild)
+        except Exception as e:
+            logger.warning(f"Failed to get log channel for {guild.id}: {type(e).__name__}: {e}")
+            return
+
+        if log_channel:
+            self.bot.mod_log.send(log_channel, embed)
+
+    # Returns the set to add the ids of the messages being deleted to, their
+    # delete events are logged by the purge instead
+    def start_purge(self, channel_id: int) -> set:
+        entry = self.purging.setdefault(channel_id, [0, set()])
+        entry[0] += 1
+
+        return entry[1]
+
+    def end_purge(self, channel_id: int) -> None:
+        self.bot.loop.call_later(PURGE_GRACE, self.release_purge, channel_id)
+
+    def release_purge(self, channel_id: int) -> None:
+        entry = self.purging.get(channel_id)
+
+        if entry is None:
+            return
+
+        entry[0] -= 1
+
+        if entry[0] <= 0:
+            del self.purging[channel_id]
+
+    def purged(self, channel_id: int, message_id: int) -> bool:
+        entry = self.purging.get(channel_id)
+
+        return entry is not None and message_id in entry[1]
+
+    def apply_settings(self, settings) -> None:
+        if settings.log_channel:
+            self.bot.message_store.enable(settings.id)
+        else:
+            self.bot.message_store.disable(settings.id)
+
+        if settings.anti_spam:
+            self.bot.anti_spam.enable(settings.id)
+        else:
+            self.bot.anti_spam.disable(settings.id)
+
+    async def cog_load(self) -> None:
+        self.bot.guild_settings.on_change(self.apply_settings)
+
+        guilds = await self.bot.guild_settings.preload(
+            {"$or": [{"log_channel": {"$nin": [0, None]}}, {"anti_spam": True}]}
+        )
+
+        for settings in guilds:
+            self.apply_settings(settings)
+
+        self.bot.scheduler.register("unban", self.scheduled_unban)
+        self.bot.scheduler.register("unlock", self.scheduled_unlock)
+        self.bot.scheduler.register("mute", self.scheduled_mute)
+
+    def cog_unload(self) -> None:
+        # Otherwise a reload leaves these pointing at the old cog
+        self.bot.guild_settings.off_change(self.apply_settings)
+
+        self.bot.scheduler.unregister("unban", self.scheduled_unban)
+        self.bot.scheduler.unregister("unlock", self.scheduled_unlock)
+        self.bot.scheduler.unregister("mute", self.scheduled_mute)
+
+    async def scheduled_unban(self, guild: discord.Guild, job: dict) -> None:
+        user_id = job["data"]["user_id"]
+
+        try:
+            await guild.unban(discord.Object(id=user_id), reason="Temporary ban expired")
+        except discord.NotFound:
+            return
+
+        embed = discord.Embed(
+            title="Temporary Ban Expired",
+            description=f"<@{user_id}> was unbanned",
+            color=0x77dd77
+        )
+
+        self.log_action(guild, embed)
+
+    async def scheduled_unlock(self, guild: discord.Guild, job: dict) -> None:
+        channel = guild.get_channel(job["data"]["channel_id"])
+
+        if channel is None:
+            return
+
+        overwrite = channel.overwrites_for(guild.default_role)
+        overwrite.send_messages = None
+
+        await channel.set_permissions(guild.default_role, overwrite=overwrite)
+        await channel.send(f"# 🔓 This channel has been unlocked")
+
+    async def scheduled_mute(self, guild: discord.Guild, job: dict) -> None:
+        member = await Members.get_or_fetch_member(guild, job["data"]["user_id"])
+
+        if member is None:
+            return
+
+        await self.timeout_until(member, job["data"]["until"], job["data"]["reason"])
+
+    async def timeout_until(self, member: discord.Member, until: float, reason: str) -> None:
+        remaining = timedelta(seconds=until - time.time())
+
+        if remaining <= timedelta(0):
+            return
+
+        await member.timeout(min(remaining, MAX_TIMEOUT), reason=reason)
+
+        key = f"mute:{member.guild.id}:{member.id}"
+
+        if remaining > MAX_TIMEOUT:
+            await self.bot.scheduler.schedule(
+                "mute",
+                member.guild.id,
+                (discord.utils.utcnow() + MAX_TIMEOUT - TIMEOUT_RENEW_MARGIN).timestamp(),
+                {"user_id": member.id, "until": until, "reason": reason},
+                key=key
+            )
+        else:
+            await self.bot.scheduler.cancel(key)
 
     @commands.Cog.listener()
-    async def on_message_delete(self, message: discord.Message) -> None:
-        if message.author == self.bot.user or message.author.bot:
+    async def on_message(self, message: discord.Message) -> None:
+        if message.guild is None or not self.bot.message_store.enabled(message.guild.id):
             return
 
-        if message.author.guild_permissions.administrator:
+        if not is_loggable(message.author):
             return
 
-        c = db["guilds"]
-        data = await CachedDB.find_one(c, {"id": message.guild.id})
+        self.bot.message_store.add(
+            message.guild.id,
+            message.id,
+            message.author.id,
+            message.channel.id,
+            message.content,
+            message.created_at.timestamp()
+        )
 
-        if not data:
-            data = CONSTANTS.guild_data_template(message.guild.id)
-            c.insert_one(data)
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent) -> None:
+        if payload.guild_id is None or self.purged(payload.channel_id, payload.message_id):
+            return
+
+        entry = self.bot.message_store.remove(payload.guild_id, payload.message_id)
+
+        if entry is not None:
+            author_id, content = entry.author_id, entry.content
+        else:
+            message = payload.cached_message
+
+            if message is None or not is_loggable(message.author):
+                return
+
+            author_id, content = message.author.id, message.content
 
-        if not data["log_channel"]:
+        guild = self.bot.get_guild(payload.guild_id)
+
+        if not guild:
             return
 
-        log_channel = message.guild.get_channel(data["log_channel"])
+        log_channel = await self.get_log_channel(guild)
 
         if not log_channel:
             return
 
         embed = discord.Embed(
             title="Message Deleted",
-            description=f"Message sent by {message.author.mention} deleted in {message.channel.mention}",
+            description=f"Message sent by <@{author_id}> deleted in <#{payload.channel_id}>",
             color=0xff6961
         )
 
         embed.add_field(
             name="Content",
-            value=message.content
+            value=content[:1024] or "*No content*"
         )
 
-        await log_channel.send(embed=embed)
+        self.bot.mod_log.send(log_channel, embed)
 
     @commands.Cog.listener()
-    async def on_message_edit(self, before: discord.Message, after: discord.Message) -> None:
-        if before.author == self.bot.user or before.author.bot:
+    async def on_raw_bulk_message_delete(self, payload: discord.RawBulkMessageDeleteEvent) -> None:
+        if payload.guild_id is None:
             return
 
-        if before.author.guild_permissions.administrator:
+        # Someone else's bulk delete can land while a purge runs in the channel
+        message_ids = {message_id for message_id in payload.message_ids if not self.purged(payload.channel_id, message_id)}
+
+        if not message_ids:
             return
 
-        if before.content == after.content:
+        cached = {message.id: message for message in payload.cached_messages}
+        lines = []
+        unknown = 0
+
+        for message_id in sorted(message_ids):
+            entry = self.bot.message_store.remove(payload.guild_id, message_id)
+            message = cached.get(message_id)
+
+            if message is not None:
+                if not message.author.bot:
+                    lines.append(message_line(message))
+            elif entry is not None:
+                lines.append(stored_line(entry))
+            else:
+                unknown += 1
+
+        guild = self.bot.get_guild(payload.guild_id)
+
+        if not guild:
             return
 
-        c = db["guilds"]
-        data = await CachedDB.find_one(c, {"id": before.guild.id})
+        log_channel = await self.get_log_channel(guild)
 
-        if not data:
-            data = CONSTANTS.guild_data_template(before.guild.id)
-            c.insert_one(data)
+        if not log_channel:
+            return
+
+        embed = discord.Embed(
+            title="Messages Bulk Deleted",
+            description=f"**{len(message_ids)}** messages deleted in <#{payload.channel_id}>",
+            color=0xff6961
+        )
 
-        if not data["log_channel"]:
+        if unknown:
+            embed.add_field(
+                name="Not Cached",
+                value=f"{unknown} message(s) were not cached, their content is unknown"
+            )
+
+        if not lines:
+            return self.bot.mod_log.send(log_channel, embed)
+
+        try:
+            await log_channel.send(embed=embed, file=transcript(lines, f"deleted-{payload.channel_id}.txt"))
+        except discord.HTTPException:
+            pass
+
+    @commands.Cog.listener()
+    async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent) -> None:
+        if payload.guild_id is None or "content" not in payload.data:
             return
 
-        log_channel = before.guild.get_channel(data["log_channel"])
+        after = payload.data["content"]
+        entry = self.bot.message_store.update(payload.guild_id, payload.message_id, after)
+
+        if entry is not None:
+            author_id, before = entry.author_id, entry.content
+        else:
+            message = payload.cached_message
+
+            if message is None or not is_loggable(message.author):
+                return
+
+            author_id, before = message.author.id, message.content
+
+        if before == after:
+            return
+
+        guild = self.bot.get_guild(payload.guild_id)
+
+        if not guild:
+            return
+
+        log_channel = await self.get_log_channel(guild)
 
         if not log_channel:
             return
 
         embed = discord.Embed(
             title="Message Edited",
-            description=f"Message sent by {before.author.mention} edited in {before.channel.mention}",
+            description=f"Message sent by <@{author_id}> edited in <#{payload.channel_id}>",
             color=0xfdfd96
         )
 
         embed.add_field(
             name="Before",
-            value=before.content
+            value=before[:1024] or "*No content*"
         )
 
         embed.add_field(
             name="After",
-            value=after.content
+            value=after[:1024] or "*No content*"
         )
 
-        await log_channel.send(embed=embed)
+        self.bot.mod_log.send(log_channel, embed)
 
     @commands.Cog.listener()
     async def on_member_ban(self, guild: discord.Guild, user: discord.User) -> None:
-        c = db["guilds"]
-
-        data = await CachedDB.find_one(c, {"id": guild.id})
-
-        if not data:
-            data = CONSTANTS.guild_data_template(guild.id)
-            c.insert_one(data)
-
-        if not data["log_channel"]:
-            return
-
-        log_channel = guild.get_channel(data["log_channel"])
+        log_channel = await self.get_log_channel(guild)
 
         if not log_channel:
             return
@@ -124,22 +488,14 @@ class Staff(commands.Cog, name="👮‍♂️ Staff"):
             color=0xff6961
         )
 
-        await log_channel.send(embed=embed)
+        self.bot.mod_log.send(log_channel, embed)
 
     @commands.Cog.listener()
     async def on_member_unban(self, guild: discord.Guild, user: discord.User) -> None:
-        c = db["guilds"]
+        # Unbanned by hand before a temporary ban ran out
+        self.bot.shutdown_coordinator.spawn(self.bot.scheduler.cancel(f"unban:{guild.id}:{user.id}"))
 
-        data = await CachedDB.find_one(c, {"id": guild.id})
-
-        if not data:
-            data = CONSTANTS.guild_data_template(guild.id)
-            c.insert_one(data)
-
-        if not data["log_channel"]:
-            return
-
-        log_channel = guild.get_channel(data["log_channel"])
+        log_channel = await self.get_log_channel(guild)
 
         if not log_channel:
             return
@@ -150,7 +506,87 @@ class Staff(commands.Cog, name="👮‍♂️ Staff"):
             color=0x77dd77
         )
 
-        await log_channel.send(embed=embed)
+        self.bot.mod_log.send(log_channel, embed)
+
+    @commands.Cog.listener()
+    async def on_spam_detected(self, message: discord.Message, verdict) -> None:
+        author = message.author
+
+        # Staff are counted like everyone else but never acted on
+        if verdict.user_ids and (not isinstance(author, discord.Member) or author.guild_permissions.manage_messages):
+            return
+
+        try:
+            if verdict.user_ids:
+                await self.punish(author, verdict)
+            elif verdict.action == "lock" and isinstance(message.channel, discord.TextChannel):
+                await self.lock_channel(message.channel, self.anti_spam_duration("lock"))
+                await message.channel.send(f"# 🔒 This channel has been locked because of spam")
+            elif verdict.action == "lock":
+                # Threads have no permission overwrites to lock them with
+                logger.warning(f"Anti spam can't lock {type(message.channel).__name__} {message.channel.id}, no action taken in {message.guild.id}")
+            else:
+                logger.warning(f"Anti spam action '{verdict.action}' doesn't apply to a channel, no action taken in {message.guild.id}")
+        except discord.HTTPException as e:
+            logger.warning(f"Anti spam {verdict.action} failed in {message.guild.id}: {e}")
+            return
+
+        embed = discord.Embed(
+            title="Spam Detected",
+            description=f"{author.mention if verdict.user_ids else message.channel.mention} triggered the **{verdict.rule}** rule ({verdict.count} in the window), action: **{verdict.action}**",
+            color=0xff6961
+        )
+
+        self.log_action(message.guild, embed)
+
+    @commands.Cog.listener()
+    async def on_raid_detected(self, guild: discord.Guild, verdict) -> None:
+        members = [guild.get_member(user_id) for user_id in verdict.user_ids]
+        members = [member for member in members if member is not None]
+
+        results = await asyncio.gather(
+            *[self.punish(member, verdict) for member in members], return_exceptions=True
+        )
+
+        failed = sum(1 for result in results if isinstance(result, Exception))
+
+        if failed:
+            logger.warning(f"Anti raid {verdict.action} failed for {failed} member(s) in {guild.id}")
+
+        embed = discord.Embed(
+            title="Raid Detected",
+            description=f"{verdict.count} joins in the window, action **{verdict.action}** applied to {len(members) - failed} member(s)",
+            color=0xff6961
+        )
+
+        self.log_action(guild, embed)
+
+    def anti_spam_duration(self, action: str):
+        seconds = self.bot.config.get("anti_spam", {}).get(f"{action}_seconds", {"mute": 600, "ban": 0, "lock": 300}[action])
+
+        return timedelta(seconds=seconds) if seconds else None
+
+    async def punish(self, member: discord.Member, verdict) -> None:
+        reason = f"Anti spam: {verdict.rule}"
+        duration = self.anti_spam_duration(verdict.action) if verdict.action in ("mute", "ban") else None
+
+        if verdict.action == "mute":
+            await self.timeout_until(member, (discord.utils.utcnow() + (duration or MAX_TIMEOUT)).timestamp(), reason)
+        elif verdict.action == "ban":
+            await member.ban(reason=reason, delete_message_days=1)
+
+            if duration:
+                await self.bot.scheduler.schedule(
+                    "unban",
+                    member.guild.id,
+                    (discord.utils.utcnow() + duration).timestamp(),
+                    {"user_id": member.id},
+                    key=f"unban:{member.guild.id}:{member.id}"
+                )
+        elif verdict.action == "kick":
+            await member.kick(reason=reason)
+        else:
+            logger.warning(f"Anti spam action '{verdict.action}' doesn't apply to a member, no action taken in {member.guild.id}")
 
     @commands.hybrid_command(
         name="kick",
@@ -165,9 +601,10 @@ class Staff(commands.Cog, name="👮‍♂️ Staff"):
     async def kick(
         self, context: Context, user: discord.User, *, reason: str = "Not specified"
     ) -> None:
-        member = context.guild.get_member(user.id) or await context.guild.fetch_member(
-            user.id
-        )
+        member = await Members.get_or_fetch_member(context.guild, user.id)
+
+        if member is None:
+            return await context.send("User is not in this server.")
 
         if member == self.bot.user:
             return await context.send("what did i do :C")
@@ -176,57 +613,43 @@ class Staff(commands.Cog, name="👮‍♂️ Staff"):
             embed = discord.Embed(
                 description="User has administrator permissions.", color=0xE02B2B
             )
-            await context.send(embed=embed)
-        else:
-            try:
-                messaged = False
-
-                try:
-                    await member.send(f"You were kicked by **{context.author}** from **{context.guild.name}**!\nReason: {reason}")
-                    messaged = True
-                except:
-                    # Couldn't send a message in the private messages of the user
-                    pass
-                await member.kick(reason=reason)
-
-                embed = discord.Embed(
-                    description=f"**{member}** was kicked by **{context.author}**!",
-                    color=0xBEBEFE,
-                )
-                embed.add_field(name="Reason:", value=reason)
-                embed.add_field(name="Messaged User:", value="Yes" if messaged else "No")
-                await context.send(embed=embed)
+            return await context.send(embed=embed)
 
-                guilds = db["guilds"]
-                data = guilds.find_one({"id": context.guild.id})
-
-                if not data:
-                    data = CONSTANTS.guild_data_template(context.guild.id)
-                    guilds.insert_one(data)
+        # The DM has to go out before the kick, while we still share a guild with the user
+        messaged = await self.notify(
+            member,
+            content=f"You were kicked by **{context.author}** from **{context.guild.name}**!\nReason: {reason}"
+        )
 
-                if "log_channel" in data:
-                    log_channel = context.guild.get_channel(data["log_channel"])
+        try:
+            await member.kick(reason=reason)
+        except discord.HTTPException:
+            embed = discord.Embed(
+                description="An error occurred while trying to kick the user. Make sure my role is above the role of the user you want to kick.",
+                color=0xE02B2B,
+            )
+            return await context.send(embed=embed)
 
-                    if log_channel:
-                        embed = discord.Embed(
-                            title="Member Kicked",
-                            description=f"{member.mention} was kicked by {context.author.mention}",
-                            color=0xff6961
-                        )
+        embed = discord.Embed(
+            description=f"**{member}** was kicked by **{context.author}**!",
+            color=0xBEBEFE,
+        )
+        embed.add_field(name="Reason:", value=reason)
+        embed.add_field(name="Messaged User:", value="Yes" if messaged else "No")
+        await context.send(embed=embed)
 
-                        embed.add_field(
-                            name="Reason",
-                            value=reason
-                        )
+        embed = discord.Embed(
+            title="Member Kicked",
+            description=f"{member.mention} was kicked by {context.author.mention}",
+            color=0xff6961
+        )
 
-                        await log_channel.send(embed=embed)
+        embed.add_field(
+            name="Reason",
+            value=reason
+        )
 
-            except:
-                embed = discord.Embed(
-                    description="An error occurred while trying to kick the user. Make sure my role is above the role of the user you want to kick.",
-                    color=0xE02B2B,
-                )
-                await context.send(embed=embed)
+        self.log_action(context.guild, embed)
 
     @commands.hybrid_command(
         name="nick",
@@ -268,75 +691,99 @@ class Staff(commands.Cog, name="👮‍♂️ Staff"):
     async def ban(
         self, context: Context, user: discord.User, *, reason: str = "Not specified"
     ) -> None:
-        member = context.guild.get_member(user.id) or await context.guild.fetch_member(
-            user.id
-        )
-
-        if member == self.bot.user:
-            return await context.send("what did i do :C")
+        await self.ban_member(context, user, reason)
 
-        try:
-            if member.guild_permissions.administrator:
-                embed = discord.Embed(
-                    description="User has administrator permissions.", color=0xE02B2B
-                )
-                await context.send(embed=embed)
-            else:
-                messaged = False
-                try:
-                    embed = discord.Embed(
-                        title="You were banned!",
-                        description=f"You were banned from **{context.guild.name}**",
-                        color=0xff6961
-                    )
+    @commands.hybrid_command(
+        name="tempban",
+        description="Bans a user from the server for a while.",
+        usage="tempban <user> <time> [reason]",
+        extras={"example": "tempban @user 7d spamming"},
+    )
+    @commands.check(Checks.is_not_blacklisted)
+    @commands.has_permissions(ban_members=True)
+    @commands.bot_has_permissions(ban_members=True)
+    async def tempban(
+        self, context: Context, user: discord.User, time: str, *, reason: str = "Not specified"
+    ) -> None:
+        duration = parse_duration(time)
 
-                    embed.add_field(name="Reason", value=reason)
+        if duration is None or duration <= timedelta(0):
+            return await context.send(f"Invalid duration string: {time}")
 
-                    await member.send(embed=embed)
-                    messaged = True
-                except:
-                    pass
+        await self.ban_member(context, user, reason, duration)
 
-                await member.ban(reason=reason, delete_message_days=0)
+    async def ban_member(self, context: Context, user: discord.User, reason: str, duration: timedelta = None) -> None:
+        member = await Members.get_or_fetch_member(context.guild, user.id)
 
-                embed = discord.Embed(
-                    description=f"**{member}** was banned by **{context.author}**!",
-                    color=0xBEBEFE,
-                )
-                embed.add_field(name="Reason:", value=reason)
-                embed.add_field(name="Messaged User:", value="Yes" if messaged else "No")
-                await context.send(embed=embed)
+        if member is None:
+            return await context.send("User is not in this server.")
 
-                guilds = db["guilds"]
-                data = guilds.find_one({"id": context.guild.id})
+        if member == self.bot.user:
+            return await context.send("what did i do :C")
 
-                if not data:
-                    data = CONSTANTS.guild_data_template(context.guild.id)
-                    guilds.insert_one(data)
+        if member.guild_permissions.administrator:
+            embed = discord.Embed(
+                description="User has administrator permissions.", color=0xE02B2B
+            )
+            return await context.send(embed=embed)
 
-                if "log_channel" in data:
-                    log_channel = context.guild.get_channel(data["log_channel"])
+        embed = discord.Embed(
+            title="You were banned!",
+            description=f"You were banned from **{context.guild.name}**" + (f" for {duration}" if duration else ""),
+            color=0xff6961
+        )
 
-                    if log_channel:
-                        embed = discord.Embed(
-                            title="Member Banned",
-                            description=f"{member.mention} was banned by {context.author.mention}",
-                            color=0xff6961
-                        )
+        embed.add_field(name="Reason", value=reason)
 
-                        embed.add_field(
-                            name="Reason",
-                            value=reason
-                        )
+        # The DM has to go out before the ban, while we still share a guild with the user
+        messaged = await self.notify(member, embed=embed)
 
-                        await log_channel.send(embed=embed)
-        except:
+        try:
+            await member.ban(reason=reason, delete_message_days=0)
+        except discord.HTTPException:
             embed = discord.Embed(
                 title="Error!",
                 description="An error occurred while trying to ban the user. Make sure my role is above the role of the user you want to ban.",
                 color=0xE02B2B,
             )
-            await context.send(embed=embed)
+            return await context.send(embed=embed)
+
+        if duration:
+            await self.bot.scheduler.schedule(
+                "unban",
+                context.guild.id,
+                (discord.utils.utcnow() + duration).timestamp(),
+                {"user_id": member.id},
+                key=f"unban:{context.guild.id}:{member.id}"
+            )
+
+        embed = discord.Embed(
+            description=f"**{member}** was banned by **{context.author}**!",
+            color=0xBEBEFE,
+        )
+        embed.add_field(name="Reason:", value=reason)
+        embed.add_field(name="Messaged User:", value="Yes" if messaged else "No")
+
+        if duration:
+            embed.add_field(name="Duration:", value=str(duration))
+
+        await context.send(embed=embed)
+
+        embed = discord.Embed(
+            title="Member Banned",
+            description=f"{member.mention} was banned by {context.author.mention}",
+            color=0xff6961
+        )
+
+        embed.add_field(
+            name="Reason",
+            value=reason
+        )
+
+        if duration:
+            embed.add_field(name="Duration", value=str(duration))
+
+        self.log_action(context.guild, embed)
 
     @commands.hybrid_command(
         name="hackban",
@@ -353,37 +800,26 @@ class Staff(commands.Cog, name="👮‍♂️ Staff"):
 
         try:
             await context.guild.ban(user, reason=reason, delete_message_days=0)
-
+        except discord.HTTPException:
             embed = discord.Embed(
-                title="User Hackbanned",
-                description=f"**{user}** was hackbanned by **{context.author}**!",
-                color=0xBEBEFE,
+                title="Error!",
+                description="An error occurred while trying to ban the user.",
+                color=0xE02B2B,
             )
 
-            embed.add_field(name="Reason:", value=reason)
-
-            guilds = db["guilds"]
-            data = guilds.find_one({"id": context.guild.id})
+            return await context.send(embed=embed)
 
-            if not data:
-                data = CONSTANTS.guild_data_template(context.guild.id)
-                guilds.insert_one(data)
+        await context.send(f"Banned **{user}**!")
 
-            if "log_channel" in data:
-                log_channel = context.guild.get_channel(data["log_channel"])
+        embed = discord.Embed(
+            title="User Hackbanned",
+            description=f"**{user}** was hackbanned by **{context.author}**!",
+            color=0xBEBEFE,
+        )
 
-                if log_channel:
-                    await log_channel.send(embed=embed)
+        embed.add_field(name="Reason:", value=reason)
 
-            await context.send(f"Banned **{user}**!")
-        except:
-            embed = discord.Embed(
-                title="Error!",
-                description="An error occurred while trying to ban the user.",
-                color=0xE02B2B,
-            )
-
-            await context.send(embed=embed)
+        self.log_action(context.guild, embed)
 
     @commands.hybrid_command(
         name="softban",
@@ -399,9 +835,10 @@ class Staff(commands.Cog, name="👮‍♂️ Staff"):
             return await context.send("what did i do :C")
 
         try:
-            user = context.guild.get_member(user.id) or await context.guild.fetch_member(
-                user.id
-            )
+            user = await Members.get_or_fetch_member(context.guild, user.id)
+
+            if user is None:
+                return await context.send("User is not in this server.")
 
             if user.guild_permissions.administrator:
                 embed = discord.Embed(
@@ -436,57 +873,192 @@ class Staff(commands.Cog, name="👮‍♂️ Staff"):
     @commands.bot_has_permissions(ban_members=True)
     async def unban(self, context: Context, user: discord.User):
         try:
-            banned_users = context.guild.bans()
-            async for ban_entry in banned_users:
-                if ban_entry.user.id == user.id:
-                    await context.guild.unban(user)
-                    embed = discord.Embed(
-                        description=f"**{user}** was unbanned by **{context.author}**!",
-                        color=0xBEBEFE,
-                    )
-                    await context.send(embed=embed)
-
-                    try:
-                        embed = discord.Embed(
-                            title="You were unbanned!",
-                            description=f"You were unbanned from **{context.guild.name}**",
-                            color=0x77dd77
-                        )
-
-                        await user.send(embed=embed)
-                    except:
-                        pass
-
-                    guilds = db["guilds"]
-                    guild = guilds.find_one({"id": context.guild.id})
-
-                    if not guild:
-                        guild = CONSTANTS.guild_data_template(context.guild.id)
-                        guilds.insert_one(guild)
-
-                    if "log_channel" in guild:
-                        log_channel = context.guild.get_channel(guild["log_channel"])
-
-                        if log_channel:
-                            embed = discord.Embed(
-                                title="Member Unbanned",
-                                description=f"{user.mention} was unbanned by {context.author.mention}",
-                                color=0x77dd77
-                            )
-
-                            await log_channel.send(embed=embed)
-
-                    return
-            embed = discord.Embed(
-                description="User is not banned.", color=0xE02B2B
-            )
-            await context.send(embed=embed)
+            try:
+                await context.guild.fetch_ban(user)
+            except discord.NotFound:
+                embed = discord.Embed(
+                    description="User is not banned.", color=0xE02B2B
+                )
+                return await context.send(embed=embed)
+
+            await context.guild.unban(user)
         except Exception as e:
             embed = discord.Embed(
                 description="An error occurred while trying to unban the user: " + str(e),
                 color=0xE02B2B,
             )
-            await context.send(embed=embed)
+            return await context.send(embed=embed)
+
+        embed = discord.Embed(
+            description=f"**{user}** was unbanned by **{context.author}**!",
+            color=0xBEBEFE,
+        )
+        await context.send(embed=embed)
+
+        embed = discord.Embed(
+            title="You were unbanned!",
+            description=f"You were unbanned from **{context.guild.name}**",
+            color=0x77dd77
+        )
+
+        self.bot.shutdown_coordinator.spawn(self.notify(user, embed=embed))
+
+        embed = discord.Embed(
+            title="Member Unbanned",
+            description=f"{user.mention} was unbanned by {context.author.mention}",
+            color=0x77dd77
+        )
+
+        self.log_action(context.guild, embed)
+
+    @commands.hybrid_group(
+        name="bulk",
+        description="Ban or unban many users at once",
+        usage="bulk <subcommand> [args]"
+    )
+    @commands.check(Checks.is_not_blacklisted)
+    @commands.has_permissions(ban_members=True)
+    async def bulk(self, context: Context) -> None:
+        subcommands = [cmd for cmd in self.bulk.walk_commands()]
+
+        data = []
+
+        for subcommand in subcommands:
+            description = subcommand.description.partition("\n")[0]
+            data.append(f"{await self.bot.get_prefix(context)}bulk {subcommand.name} - {description}")
+
+        help_text = "\n".join(data)
+        embed = discord.Embed(
+            title=f"Help: Bulk", description="List of available commands:", color=0xBEBEFE
+        )
+        embed.add_field(
+            name="Commands", value=f"```{help_text}```", inline=False
+        )
+
+        await context.send(embed=embed)
+
+    async def run_bulk_job(self, context: Context, job: dict) -> None:
+        message = await context.send(embed=self.bulk_job_embed(job))
+        last_edit = 0
+
+        async def progress(job):
+            nonlocal last_edit
+
+            if time.monotonic() - last_edit < 2:
+                return
+
+            last_edit = time.monotonic()
+
+            try:
+                await message.edit(embed=self.bulk_job_embed(job))
+            except discord.HTTPException:
+                pass
+
+        try:
+            await BulkModeration.run_job(context.guild, job, progress)
+        except RuntimeError as e:
+            return await context.send(str(e))
+
+        await message.edit(embed=self.bulk_job_embed(job))
+
+        embed = discord.Embed(
+            title=f"Bulk {job['action'].capitalize()}",
+            description=f"{context.author.mention} bulk {job['action']}ned **{job['succeeded']}** users ({len(job['failed'])} failed, {len(job.get('skipped', []))} skipped)",
+            color=0xff6961 if job["action"] == "ban" else 0x77dd77
+        )
+
+        embed.add_field(name="Reason", value=job["reason"])
+
+        self.log_action(context.guild, embed)
+
+    def bulk_job_embed(self, job: dict) -> discord.Embed:
+        total = len(job["user_ids"])
+
+        embed = discord.Embed(
+            title=f"Bulk {job['action']} - {job['status']}",
+            description=f"Processed **{job['cursor']}/{total}** users",
+            color=0xBEBEFE
+        )
+
+        embed.add_field(name="Succeeded", value=job["succeeded"])
+        embed.add_field(name="Failed", value=len(job["failed"]))
+
+        if job.get("skipped"):
+            embed.add_field(name=f"Skipped ({len(job['skipped'])})", value=self.skipped_list(job["skipped"]), inline=False)
+
+        embed.set_footer(text=f"Job ID: {job['_id']}")
+
+        return embed
+
+    def skipped_list(self, skipped: list, limit: int = 10) -> str:
+        lines = [f"<@{entry['user_id']}> {entry['reason']}" for entry in skipped[:limit]]
+
+        if len(skipped) > limit:
+            lines.append(f"and {len(skipped) - limit} more")
+
+        return "\n".join(lines)
+
+    @bulk.command(
+        name="ban",
+        description="Ban a list of user IDs",
+        usage="bulk ban <user ids> [reason]",
+        extras={"example": "bulk ban 1226487228914602005 1226487228914602006 raid"}
+    )
+    @commands.check(Checks.is_not_blacklisted)
+    @commands.has_permissions(ban_members=True)
+    @commands.bot_has_permissions(ban_members=True)
+    async def bulk_ban(self, context: Context, *, users: str) -> None:
+        user_ids, reason = BulkModeration.parse_targets(users)
+
+        if not user_ids:
+            return await context.send("No user IDs given.")
+
+        user_ids, skipped = await BulkModeration.check_ban_targets(context.guild, context.author, user_ids)
+
+        if not user_ids:
+            return await context.send("None of those users can be banned:\n" + self.skipped_list(skipped))
+
+        job = BulkModeration.create_job(context.guild.id, context.author.id, "ban", user_ids, reason or f"Bulk ban by {context.author}", skipped)
+
+        await self.run_bulk_job(context, job)
+
+    @bulk.command(
+        name="unban",
+        description="Unban a list of user IDs",
+        usage="bulk unban <user ids> [reason]",
+        extras={"example": "bulk unban 1226487228914602005 1226487228914602006"}
+    )
+    @commands.check(Checks.is_not_blacklisted)
+    @commands.has_permissions(ban_members=True)
+    @commands.bot_has_permissions(ban_members=True)
+    async def bulk_unban(self, context: Context, *, users: str) -> None:
+        user_ids, reason = BulkModeration.parse_targets(users)
+
+        if not user_ids:
+            return await context.send("No user IDs given.")
+
+        job = BulkModeration.create_job(context.guild.id, context.author.id, "unban", user_ids, reason or f"Bulk unban by {context.author}")
+
+        await self.run_bulk_job(context, job)
+
+    @bulk.command(
+        name="resume",
+        description="Resume an interrupted bulk job",
+        usage="bulk resume <job id>"
+    )
+    @commands.check(Checks.is_not_blacklisted)
+    @commands.has_permissions(ban_members=True)
+    @commands.bot_has_permissions(ban_members=True)
+    async def bulk_resume(self, context: Context, job_id: str) -> None:
+        job = BulkModeration.get_job(context.guild.id, job_id)
+
+        if not job:
+            return await context.send("Job not found.")
+
+        if job["status"] == "done":
+            return await context.send(embed=self.bulk_job_embed(job))
+
+        await self.run_bulk_job(context, job)
 
     @commands.hybrid_command(
         name="purge",
@@ -501,45 +1073,144 @@ class Staff(commands.Cog, name="👮‍♂️ Staff"):
     @app_commands.describe(amount="The amount of messages that should be deleted.")
     async def purge(self, context: Context, amount: int) -> None:
         await context.defer()
-        purged_messages = await context.channel.purge(limit=amount + 1)
+
+        deleting = self.start_purge(context.channel.id)
+
+        def check(message: discord.Message) -> bool:
+            deleting.add(message.id)
+            return True
+
+        try:
+            purged_messages = await context.channel.purge(limit=amount + 1, check=check)
+        finally:
+            self.end_purge(context.channel.id)
+
         embed = discord.Embed(
             description=f"**{context.author}** cleared **{len(purged_messages)-1}** messages!",
             color=0xBEBEFE,
         )
         await context.channel.send(embed=embed)
 
+        await self.log_purge(context, purged_messages)
+
+    async def log_purge(self, context: Context, messages: list) -> None:
+        for message in messages:
+            self.bot.message_store.remove(context.guild.id, message.id)
+
+        log_channel = await self.get_log_channel(context.guild)
+
+        if not log_channel or not messages:
+            return
+
+        embed = discord.Embed(
+            title="Messages Purged",
+            description=f"**{len(messages)}** messages purged in {context.channel.mention} by {context.author.mention}",
+            color=0xff6961
+        )
+
+        try:
+            lines = [message_line(message) for message in sorted(messages, key=lambda message: message.id)]
+            await log_channel.send(embed=embed, file=transcript(lines, f"purged-{context.channel.id}.txt"))
+        except discord.HTTPException:
+            pass
+
     @commands.hybrid_command(
-        name="archive",
-        description="Archives in a text file the last messages with a chosen limit of messages.",
-        usage="archive <limit>",
-        extras={"example": "archive 10"}
+        name="cleanup",
+        description="Delete messages matching filters.",
+        usage="cleanup [user:] [contains:] [attachments:] [bots:] [links:] [minutes:] [limit:]",
+        extras={"example": "cleanup user:@user links:true minutes:30 limit:500"}
     )
     @commands.check(Checks.is_not_blacklisted)
     @commands.has_permissions(manage_messages=True)
-    async def archive(self, context: Context, limit: int = 10) -> None:
-        os.makedirs("logs", exist_ok=True)
-        log_file = f"logs/{context.channel.id}.log"
-        with open(log_file, "w", encoding="UTF-8") as f:
-            f.write(
-                f'Archived messages from: #{context.channel} ({context.channel.id}) in the guild "{context.guild}" ({context.guild.id}) at {datetime.now().strftime("%d.%m.%Y %H:%M:%S")}\n'
+    @commands.bot_has_permissions(manage_messages=True, read_message_history=True)
+    async def cleanup(self, context: Context, *, flags: CleanupFlags) -> None:
+        await context.defer()
+
+        pattern = None
+
+        if flags.contains:
+            try:
+                pattern = Purge.compile_pattern(flags.contains)
+            except ValueError as e:
+                return await context.send(f"Invalid pattern: {e}")
+
+        predicate = Purge.build_predicate(
+            user=flags.user,
+            pattern=pattern,
+            attachments=flags.attachments,
+            bots=flags.bots,
+            links=flags.links
+        )
+
+        after = discord.utils.utcnow() - timedelta(minutes=flags.minutes) if flags.minutes else None
+        before = context.message if context.interaction is None else None
+
+        deleting = self.start_purge(context.channel.id)
+
+        try:
+            result = await Purge.purge(
+                context.channel,
+                predicate,
+                limit=max(1, min(flags.limit, CLEANUP_MAX_SCAN)),
+                after=after,
+                before=before,
+                deleting=deleting
             )
-            async for message in context.channel.history(
-                limit=limit, before=context.message
-            ):
-                attachments = []
-                for attachment in message.attachments:
-                    attachments.append(attachment.url)
-                attachments_text = (
-                    f"[Attached File{'s' if len(attachments) >= 2 else ''}: {', '.join(attachments)}]"
-                    if len(attachments) >= 1
-                    else ""
-                )
-                f.write(
-                    f"{message.created_at.strftime('%d.%m.%Y %H:%M:%S')} {message.author} {message.id}: {message.clean_content} {attachments_text}\n"
-                )
-        f = discord.File(log_file)
-        await context.send(file=f)
-        os.remove(log_file)
+        finally:
+            self.end_purge(context.channel.id)
+
+        embed = discord.Embed(
+            description=f"**{context.author}** cleared **{len(result['deleted'])}** messages!",
+            color=0xBEBEFE,
+        )
+        embed.set_footer(
+            text=f"Scanned {result['scanned']} messages in {result['seconds']:.1f}s ({result['rate']:.1f} deleted/s)"
+            + (f", {result['failed']} couldn't be deleted" if result["failed"] else "")
+        )
+        await context.send(embed=embed)
+
+        await self.log_purge(context, result["deleted"])
+
+    @commands.hybrid_command(
+        name="archive",
+        description="Archives the last messages with a chosen limit of messages into compressed files.",
+        usage="archive <limit> [format: text/jsonl]",
+        extras={"example": "archive 1000 jsonl"}
+    )
+    @commands.check(Checks.is_not_blacklisted)
+    @commands.has_permissions(manage_messages=True)
+    async def archive(self, context: Context, limit: int = 10, format: str = "text") -> None:
+        if format not in Archive.FORMATS:
+            return await context.send(f"Format must be one of: {', '.join(Archive.FORMATS)}")
+
+        limit = max(1, min(limit, ARCHIVE_MAX_MESSAGES))
+
+        await context.defer()
+
+        result = await Archive.export(
+            context.channel,
+            limit=limit,
+            fmt=format,
+            upload_limit=context.guild.filesize_limit,
+            before=context.message if context.interaction is None else None
+        )
+
+        if not result["messages"]:
+            for _, file in result["files"]:
+                file.close()
+
+            return await context.send("There are no messages to archive.")
+
+        try:
+            for filename, file in result["files"]:
+                # discord.File wants a real file object, the spool may not be one
+                file.seek(0)
+                await context.send(file=discord.File(io.BytesIO(file.read()), filename=filename))
+        finally:
+            for _, file in result["files"]:
+                file.close()
+
+        await context.send(f"Archived **{result['messages']}** messages in {len(result['files'])} file(s).")
 
     @commands.hybrid_command(
         name="mute",
@@ -554,34 +1225,13 @@ class Staff(commands.Cog, name="👮‍♂️ Staff"):
     async def mute(self, context: Context, user: discord.Member, time: str, *, reason: str = "Not specified") -> None:
         if user == self.bot.user:
             return await context.send("what did i do :C")
-        try:
-            # Try to parse the string as a datetime
-            dt = datetime.fromisoformat(time)
-            return dt
-        except ValueError:
-            pass
 
-        # If the string is not a valid datetime, try to parse it as a duration
-        pattern = r'^(\d+)([ydhmsw])$'
-        match = re.match(pattern, time)
+        delta = parse_duration(time)
 
-        if not match:
+        if delta is None or delta <= timedelta(0):
             return await context.send(f"Invalid duration string: {time}")
 
-        value, unit = int(match.group(1)), match.group(2)
-        duration = {
-            'y': timedelta(days=365*value),
-            'w': timedelta(days=7*value),
-            'month': timedelta(days=30*value),
-            'd': timedelta(days=value),
-            'h': timedelta(hours=value),
-            'm': timedelta(minutes=value),
-            's': timedelta(seconds=value),
-        }
-
-        delta = duration[unit]
-
-        await user.timeout(delta, reason=reason)
+        await self.timeout_until(user, (discord.utils.utcnow() + delta).timestamp(), reason)
         await context.send(f"{user.mention} has been muted for {delta}")
 
         try:
@@ -601,6 +1251,7 @@ class Staff(commands.Cog, name="👮‍♂️ Staff"):
     @commands.bot_has_permissions(moderate_members=True)
     async def unmute(self, context: Context, user: discord.Member, *, reason: str = "Not specified") -> None:
         await user.timeout(None, reason=reason)
+        await self.bot.scheduler.cancel(f"mute:{context.guild.id}:{user.id}")
         await context.send(f"{user.mention} has been unmuted")
 
         try:
@@ -611,26 +1262,52 @@ class Staff(commands.Cog, name="👮‍♂️ Staff"):
     @commands.hybrid_command(
         name="lock",
         description="Lock a channel.",
-        usage="lock [optional: channel]",
-        extras={"example": "lock #general"}
+        usage="lock [optional: channel] [optional: time]",
+        extras={"example": "lock #general 1h"}
     )
     @commands.check(Checks.is_not_blacklisted)
     @commands.has_permissions(manage_channels=True)
     @commands.bot_has_permissions(manage_channels=True)
-    async def lock(self, context: Context, channel: discord.TextChannel = None) -> None:
+    async def lock(self, context: Context, channel: typing.Optional[discord.TextChannel] = None, time: str = None) -> None:
         if not channel:
             channel = context.channel
 
-        overwrite = discord.PermissionOverwrite()
-        overwrite = channel.overwrites_for(context.guild.default_role)
-        overwrite.send_messages = False
+        duration = None
 
-        await channel.set_permissions(context.guild.default_role, overwrite=overwrite)
+        if time is not None:
+            duration = parse_duration(time)
 
-        await context.send(f"{channel.mention} has been locked down")
+            if duration is None or duration <= timedelta(0):
+                return await context.send(f"Invalid duration string: {time}")
+
+        await self.lock_channel(channel, duration)
+
+        if duration:
+            await context.send(f"{channel.mention} has been locked down for {duration}")
+        else:
+            await context.send(f"{channel.mention} has been locked down")
 
         await channel.send(f"# 🔒 This channel has been locked by staff")
 
+    async def lock_channel(self, channel: discord.TextChannel, duration: timedelta = None) -> None:
+        overwrite = channel.overwrites_for(channel.guild.default_role)
+        overwrite.send_messages = False
+
+        await channel.set_permissions(channel.guild.default_role, overwrite=overwrite)
+
+        key = f"unlock:{channel.guild.id}:{channel.id}"
+
+        if duration:
+            await self.bot.scheduler.schedule(
+                "unlock",
+                channel.guild.id,
+                (discord.utils.utcnow() + duration).timestamp(),
+                {"channel_id": channel.id},
+                key=key
+            )
+        else:
+            await self.bot.scheduler.cancel(key)
+
     @commands.hybrid_command(
         name="unlock",
         description="Unlock a channel.",
@@ -649,6 +1326,7 @@ class Staff(commands.Cog, name="👮‍♂️ Staff"):
         overwrite.send_messages = None
 
         await channel.set_permissions(context.guild.default_role, overwrite=overwrite)
+        await self.bot.scheduler.cancel(f"unlock:{context.guild.id}:{channel.id}")
 
         await context.send(f"{channel.mention} has been unlocked")
 
@@ -681,29 +1359,20 @@ class Staff(commands.Cog, name="👮‍♂️ Staff"):
 
     @warnings.command(
         name="add",
-        description="Warn a user.",
-        usage="warnings add <user> <reason>"
+        description="Warn a user, optionally only for a while.",
+        usage="warnings add <user> [time] <reason>"
     )
     @commands.check(Checks.is_not_blacklisted)
     @commands.has_permissions(manage_messages=True)
-    async def warn(self, context: Context, user: discord.Member, *, reason: str = "Not specified") -> None:
-        users = db["users"]
-        data = users.find_one({"id": user.id, "guild_id": context.guild.id})
-
-        if not data:
-            data = CONSTANTS.user_data_template(user.id, context.guild.id)
-            users.insert_one(data)
-
-        if not "warnings" in data:
-            data["warnings"] = []
-
-        data["warnings"].append({"reason": reason, "time": datetime.now().strftime("%d.%m.%Y %H:%M:%S")})
-
-        newdata = {"$set": {"warnings": data["warnings"]}}
-
-        users.update_one({"id": user.id, "guild_id": context.guild.id}, newdata)
+    async def warn(self, context: Context, user: discord.Member, expires: typing.Optional[Duration] = None, *, reason: str = "Not specified") -> None:
+        case = await asyncio.to_thread(
+            Cases.create_case, context.guild.id, user.id, context.author.id, "warn", reason, expires
+        )
 
-        await context.send(f"{user.mention} has been warned for {reason}")
+        await context.send(
+            f"{user.mention} has been warned for {reason} (case #{case['case_id']})"
+            + (f", expires in {expires}" if expires else "")
+        )
 
     @warnings.command(
         name="list",
@@ -713,27 +1382,30 @@ class Staff(commands.Cog, name="👮‍♂️ Staff"):
     @commands.check(Checks.is_not_blacklisted)
     @commands.has_permissions(manage_messages=True)
     async def listwarnings(self, context: Context, user: discord.Member) -> None:
-        users = db["users"]
-        data = users.find_one({"id": user.id, "guild_id": context.guild.id})
+        (cases, cursor), total = await asyncio.gather(
+            asyncio.to_thread(Cases.list_cases, context.guild.id, user.id),
+            asyncio.to_thread(Cases.count_cases, context.guild.id, user.id),
+        )
 
-        if not data:
-            data = CONSTANTS.user_data_template(user.id, context.guild.id)
-            users.insert_one(data)
+        view = WarningsView(context.author, context.guild.id, user, total, cursor)
 
+        if cursor is None:
+            return await context.send(embed=view.embed(cases))
 
-        embed = discord.Embed(
-            title=f"Warnings for {user}",
-            color=0xff6961
-        )
+        await context.send(embed=view.embed(cases), view=view)
 
-        for w in data["warnings"]:
-            embed.add_field(
-                name=w["time"],
-                value=w["reason"],
-                inline=False
-            )
+    @warnings.command(
+        name="remove",
+        description="Remove a single warning by its case number.",
+        usage="warnings remove <case>"
+    )
+    @commands.check(Checks.is_not_blacklisted)
+    @commands.has_permissions(manage_messages=True)
+    async def removewarning(self, context: Context, case: int) -> None:
+        if not await asyncio.to_thread(Cases.delete_case, context.guild.id, case):
+            return await context.send(f"Case #{case} not found")
 
-        await context.send(embed=embed)
+        await context.send(f"Removed case #{case}")
 
     @warnings.command(
         name="clear",
@@ -743,16 +1415,7 @@ class Staff(commands.Cog, name="👮‍♂️ Staff"):
     @commands.check(Checks.is_not_blacklisted)
     @commands.has_permissions(manage_messages=True)
     async def clearwarnings(self, context: Context, user: discord.Member) -> None:
-        users = db["users"]
-        data = users.find_one({"id": user.id, "guild_id": context.guild.id})
-
-        if not data:
-            data = CONSTANTS.user_data_template(user.id, context.guild.id)
-            users.insert_one(data)
-
-        newdata = {"$set": {"warnings": []}}
-
-        users.update_one({"id": user.id, "guild_id": context.guild.id}, newdata)
+        await asyncio.to_thread(Cases.clear_cases, context.guild.id, user.id, "warn")
 
         await context.send(f"Cleared warnings for {user.mention}")
 
@@ -2,16 +2,21 @@
 
 # This project is licensed under the terms of the GPL v3.0 license. Copyright 2024 Cyteon
 
+import time
+
+# Taken before the heavy imports so the startup report covers them
+process_start = time.perf_counter()
+
+import asyncio
 import json
 import logging
 import os
 import platform
 import random
+import signal
 import sys
-import time
 import aiohttp
 import pickledb
-import pymongo
 
 import discord
 from discord import Webhook
@@ -20,7 +25,7 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-from utils import ErrorLogger
+from utils import CachedDB, CommandSync, Cooldowns, DataContext, DBClient, ErrorLogger, Members, Services, Shutdown
 
 if not os.path.isfile(f"{os.path.realpath(os.path.dirname(__file__))}/config.json"):
     sys.exit("'config.json' not found! Please add it and try again.")
@@ -32,8 +37,8 @@ intents = discord.Intents.default()
 intents.message_content = True
 intents.members = True
 
-client = pymongo.MongoClient(os.getenv("MONGODB_URL"))
-db = client.potatobot
+member_cache_flags = Members.member_cache_flags(intents, config)
+chunk_guilds_at_startup = config.get("chunk_guilds_at_startup", True)
 
 os.makedirs("pickle", exist_ok=True)
 prefixDB = pickledb.load("pickle/prefix.db", False)
@@ -84,15 +89,18 @@ class DiscordBot(commands.AutoShardedBot):
         super().__init__(
             command_prefix=self.get_prefix,
             intents=intents,
+            member_cache_flags=member_cache_flags,
+            chunk_guilds_at_startup=chunk_guilds_at_startup,
+            max_messages=config.get("max_messages", 1000),
             help_command=None,
             owner_ids=set([int(os.getenv("OWNER_ID"))]),
         )
 
         self.logger = logger
-        self.config = config
-        self.start_time = time.time()
         self.prefixDB = prefixDB
 
+        Services.attach(self, config)
+
 
 
     async def get_prefix(self, message):
@@ -102,18 +110,60 @@ class DiscordBot(commands.AutoShardedBot):
         else:
             return config["prefix"]
 
-    async def load_cogs(self) -> None:
-        for file in os.listdir(f"{os.path.realpath(os.path.dirname(__file__))}/cogs"):
-            if file.endswith(".py"):
-                extension = file[:-3]
-                try:
-                    await self.load_extension(f"cogs.{extension}")
-                    self.logger.info(f"Loaded extension '{extension}'")
-                except Exception as e:
-                    exception = f"{type(e).__name__}: {e}"
-                    self.logger.error(
-                        f"Failed to load extension {extension}\n{exception}"
-                    )
+    async def get_context(self, origin, /, *, cls=DataContext.Context):
+        return await super().get_context(origin, cls=cls)
+
+    async def add_cog(self, cog: commands.Cog, /, **kwargs) -> None:
+        await super().add_cog(cog, **kwargs)
+        self.stats.add_cog(cog)
+
+    async def remove_cog(self, name: str, /, **kwargs):
+        cog = await super().remove_cog(name, **kwargs)
+
+        if cog is not None:
+            self.stats.remove_cog(cog)
+
+        return cog
+
+    async def load_cog(self, extension: str) -> float:
+        start_time = time.perf_counter()
+
+        try:
+            await self.load_extension(f"cogs.{extension}")
+            self.logger.info(f"Loaded extension '{extension}'")
+        except Exception as e:
+            exception = f"{type(e).__name__}: {e}"
+            self.logger.error(
+                f"Failed to load extension {extension}\n{exception}"
+            )
+
+        return (time.perf_counter() - start_time) * 1000
+
+    async def load_cogs(self) -> dict:
+        extensions = [
+            file[:-3]
+            for file in sorted(os.listdir(f"{os.path.realpath(os.path.dirname(__file__))}/cogs"))
+            if file.endswith(".py")
+        ]
+
+        start_time = time.perf_counter()
+        timings = await asyncio.gather(*[self.load_cog(extension) for extension in extensions])
+        total = (time.perf_counter() - start_time) * 1000
+
+        report = dict(zip(extensions, timings))
+
+        for extension, took in sorted(report.items(), key=lambda item: item[1], reverse=True):
+            self.logger.info(f"  {extension:<10} {took:8.2f}ms")
+        self.logger.info(f"Loaded {len(extensions)} extensions in {total:.2f}ms")
+
+        return report
+
+    async def check_db(self) -> None:
+        try:
+            await asyncio.to_thread(DBClient.client.admin.command, "ping")
+            self.logger.info(f"Connection to db successful: {DBClient.client.address}")
+        except Exception as e:
+            self.logger.error(f"Connection to db failed: {type(e).__name__}: {e}")
 
     @tasks.loop(minutes=1.0)
     async def status_task(self) -> None:
@@ -125,7 +175,40 @@ class DiscordBot(commands.AutoShardedBot):
         await self.wait_until_ready()
 
 
+    def startup_mark(self, name: str) -> float:
+        took = (time.perf_counter() - process_start) * 1000
+        self.startup_report[name] = round(took, 2)
+        self.logger.info(f"Startup: reached {name} after {took:.2f}ms")
+        return took
+
+    def graceful_shutdown(self) -> asyncio.Task:
+        return self.shutdown_coordinator.request(self)
+
+    async def close_connections(self) -> None:
+        await asyncio.to_thread(CachedDB.close)
+        await asyncio.to_thread(DBClient.client.close)
+
+    def add_signal_handlers(self) -> None:
+        loop = asyncio.get_running_loop()
+
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, self.graceful_shutdown)
+            except (NotImplementedError, RuntimeError):
+                # Signal handlers aren't supported by the Windows event loop
+                pass
+
     async def setup_hook(self) -> None:
+        self.startup_mark("setup_hook")
+
+        self.add_signal_handlers()
+        self.shutdown_coordinator.register(self.scheduler.stop, Shutdown.FLUSH, "stop scheduler")
+        self.shutdown_coordinator.register(self.guild_settings.stop, Shutdown.FLUSH, "stop settings subscription")
+        self.shutdown_coordinator.register(self.mod_log.flush, Shutdown.FLUSH, "flush mod logs")
+        self.shutdown_coordinator.register(self.wallets.stop, Shutdown.FLUSH, "flush wallet writes")
+        self.shutdown_coordinator.register(self.ledger.stop, Shutdown.FLUSH, "flush ledger")
+        self.shutdown_coordinator.register(self.close_connections, Shutdown.CLOSE, "close connections")
+
         self.logger.info(f"Logged in as {self.user.name}")
         self.logger.info(f"discord.py API version: {discord.__version__}")
         self.logger.info(f"Python version: {platform.python_version()}")
@@ -135,15 +218,47 @@ class DiscordBot(commands.AutoShardedBot):
 
         self.logger.info("-------------------")
 
-        self.logger.info(f"Connection to db successful: {client.address}")
+        _, cogs = await asyncio.gather(self.check_db(), self.load_cogs())
+        self.startup_report["cogs"] = {extension: round(took, 2) for extension, took in cogs.items()}
+        self.startup_mark("cogs_loaded")
 
-        self.logger.info("-------------------")
+        if config.get("sync_commands_on_startup", False):
+            try:
+                await CommandSync.sync(self.tree)
+            except Exception as e:
+                self.logger.error(f"Failed to sync commands on startup: {type(e).__name__}: {e}")
+
+        self.guild_settings.start()
+        self.scheduler.start()
+        self.wallets.start()
+        self.ledger.start()
+        self.status_task.start()
 
-        await self.load_cogs()
+    async def on_ready(self) -> None:
+        if "ready" not in self.startup_report:
+            self.startup_mark("ready")
 
-        self.status_task.start()
+    async def on_guild_available(self, guild: discord.Guild):
+        self.stats.add_guild(guild)
+
+    async def on_guild_unavailable(self, guild: discord.Guild):
+        self.stats.remove_guild(guild)
+
+    async def on_member_join(self, member: discord.Member):
+        self.stats.member_joined(member.guild)
+
+        if self.anti_spam.enabled(member.guild.id):
+            verdict = self.anti_spam.check_join(member)
+
+            if verdict is not None:
+                self.dispatch("raid_detected", member.guild, verdict)
+
+    async def on_member_remove(self, member: discord.Member):
+        self.stats.member_left(member.guild)
 
     async def on_guild_remove(self, guild: discord.Guild):
+        self.stats.remove_guild(guild)
+
         async with aiohttp.ClientSession() as session:
             to_send = Webhook.from_url(config["bot_logs_webhook"], session=session)
 
@@ -158,6 +273,8 @@ class DiscordBot(commands.AutoShardedBot):
         self.logger.info("Bot left guild " + guild.name)
 
     async def on_guild_join(self, guild: discord.Guild):
+        self.stats.add_guild(guild)
+
         async with aiohttp.ClientSession() as session:
             to_send = Webhook.from_url(config["bot_logs_webhook"], session=session)
 
@@ -178,6 +295,13 @@ class DiscordBot(commands.AutoShardedBot):
         if message.author == self.user or message.author.bot:
             return
 
+        if message.guild is not None and self.anti_spam.enabled(message.guild.id):
+            verdict = self.anti_spam.check_message(message)
+
+            if verdict is not None:
+                self.dispatch("spam_detected", message, verdict)
+                return
+
         arr = message.content.split(" ")
 
         arr[0] = arr[0].lower()
@@ -219,6 +343,12 @@ class DiscordBot(commands.AutoShardedBot):
             )
 
     async def on_command_error(self, context: commands.Context, error) -> None:
+        await self.shutdown_coordinator.command_finished(context)
+
+        # Rejected before the command did anything, don't charge a cooldown for it
+        if isinstance(error, (commands.CheckFailure, commands.UserInputError)):
+            Cooldowns.refund(context)
+
         if isinstance(error, commands.CommandOnCooldown):
             minutes, seconds = divmod(error.retry_after, 60)
             hours, minutes = divmod(minutes, 60)
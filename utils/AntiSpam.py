@@ -0,0 +1,246 @@
+# This project is licensed under the terms of the GPL v3.0 license. Copyright 2024 Cyteon
+
+import logging
+import time
+from array import array
+from collections import OrderedDict, namedtuple
+
+logger = logging.getLogger("discord_bot")
+
+Verdict = namedtuple("Verdict", ["rule", "action", "count", "user_ids", "channel_id"])
+
+DEFAULT_RULES = {
+    "messages": {"count": 8, "seconds": 5, "action": "mute"},
+    "duplicates": {"count": 4, "seconds": 30, "action": "mute"},
+    "mentions": {"count": 15, "seconds": 30, "action": "ban"},
+    "channel": {"count": 40, "seconds": 5, "action": "lock"},
+    "joins": {"count": 10, "seconds": 10, "action": "mute"},
+}
+
+# What each rule can do: the channel rule has no user to act on, the others
+# have no channel to lock
+ACTIONS = {
+    "messages": ("mute", "kick", "ban"),
+    "duplicates": ("mute", "kick", "ban"),
+    "mentions": ("mute", "kick", "ban"),
+    "channel": ("lock",),
+    "joins": ("mute", "kick", "ban"),
+}
+
+# Recent message hashes kept per user for the duplicate check
+DUPLICATE_SLOTS = 8
+
+MAX_TRACKED_USERS = 50000
+MAX_TRACKED_CHANNELS = 20000
+
+# Counts events over the last `seconds` seconds in one second buckets, the
+# buckets that fell out of the window are cleared lazily on the next add
+class Window:
+    __slots__ = ("buckets", "tick", "total")
+
+    def __init__(self, seconds: int) -> None:
+        self.buckets = array("I", bytes(4 * seconds))
+        self.tick = 0
+        self.total = 0
+
+    def add(self, tick: int, amount: int = 1) -> int:
+        size = len(self.buckets)
+        gap = tick - self.tick
+
+        if gap >= size:
+            for i in range(size):
+                self.buckets[i] = 0
+            self.total = 0
+        else:
+            for i in range(self.tick + 1, tick + 1):
+                self.total -= self.buckets[i % size]
+                self.buckets[i % size] = 0
+
+        self.tick = tick
+        self.buckets[tick % size] += amount
+        self.total += amount
+
+        return self.total
+
+    def reset(self) -> None:
+        for i in range(len(self.buckets)):
+            self.buckets[i] = 0
+        self.total = 0
+
+class UserState:
+    __slots__ = ("messages", "mentions", "hashes", "hash_ticks", "next_hash")
+
+    def __init__(self, rules: dict) -> None:
+        self.messages = Window(rules["messages"]["seconds"])
+        self.mentions = Window(rules["mentions"]["seconds"])
+        self.hashes = array("Q", bytes(8 * DUPLICATE_SLOTS))
+        self.hash_ticks = array("q", [-(1 << 62)] * DUPLICATE_SLOTS)
+        self.next_hash = 0
+
+    def duplicates(self, content_hash: int, tick: int, seconds: int) -> int:
+        self.hashes[self.next_hash] = content_hash
+        self.hash_ticks[self.next_hash] = tick
+        self.next_hash = (self.next_hash + 1) % DUPLICATE_SLOTS
+
+        return sum(
+            1 for i in range(DUPLICATE_SLOTS)
+            if self.hashes[i] == content_hash and tick - self.hash_ticks[i] < seconds
+        )
+
+    def reset(self) -> None:
+        self.messages.reset()
+        self.mentions.reset()
+
+        for i in range(DUPLICATE_SLOTS):
+            self.hash_ticks[i] = -(1 << 62)
+
+class GuildState:
+    __slots__ = ("joins", "joiners", "next_joiner", "raid_until")
+
+    def __init__(self, rules: dict) -> None:
+        self.joins = Window(rules["joins"]["seconds"])
+        self.joiners = array("Q", bytes(8 * rules["joins"]["count"]))
+        self.next_joiner = 0
+        self.raid_until = 0
+
+class Detector:
+    def __init__(self, config: dict = None) -> None:
+        config = config or {}
+
+        self.rules = {
+            rule: {**defaults, **config.get(rule, {})}
+            for rule, defaults in DEFAULT_RULES.items()
+        }
+
+        for rule, settings in self.rules.items():
+            if settings["action"] not in ACTIONS[rule]:
+                logger.warning(
+                    f"Anti spam action '{settings['action']}' can't be used for the {rule} rule, "
+                    f"expected one of {', '.join(ACTIONS[rule])}, using '{DEFAULT_RULES[rule]['action']}'"
+                )
+                settings["action"] = DEFAULT_RULES[rule]["action"]
+
+        self.raid_seconds = config.get("raid_seconds", 300)
+        self.max_users = config.get("max_tracked_users", MAX_TRACKED_USERS)
+        self.max_channels = config.get("max_tracked_channels", MAX_TRACKED_CHANNELS)
+
+        self.guild_ids = set()
+        self.users = OrderedDict()
+        self.channels = OrderedDict()
+        self.guilds = {}
+
+    def enabled(self, guild_id: int) -> bool:
+        return guild_id in self.guild_ids
+
+    def enable(self, guild_id: int) -> None:
+        self.guild_ids.add(guild_id)
+
+    def disable(self, guild_id: int) -> None:
+        self.guild_ids.discard(guild_id)
+        self.guilds.pop(guild_id, None)
+
+    def verdict(self, rule: str, count: int, user_ids=(), channel_id: int = None) -> Verdict:
+        return Verdict(rule, self.rules[rule]["action"], count, list(user_ids), channel_id)
+
+    def user_state(self, guild_id: int, user_id: int) -> UserState:
+        key = (guild_id, user_id)
+        state = self.users.get(key)
+
+        if state is None:
+            state = self.users[key] = UserState(self.rules)
+
+            if len(self.users) > self.max_users:
+                self.users.popitem(last=False)
+        else:
+            self.users.move_to_end(key)
+
+        return state
+
+    def channel_window(self, channel_id: int) -> Window:
+        channel = self.channels.get(channel_id)
+
+        if channel is None:
+            channel = self.channels[channel_id] = Window(self.rules["channel"]["seconds"])
+
+            if len(self.channels) > self.max_channels:
+                self.channels.popitem(last=False)
+        else:
+            self.channels.move_to_end(channel_id)
+
+        return channel
+
+    def check_message(self, message, now: float = None):
+        tick = int(now if now is not None else time.time())
+        rules = self.rules
+
+        channel = self.channel_window(message.channel.id)
+        state = self.user_state(message.guild.id, message.author.id)
+
+        count = state.messages.add(tick)
+
+        if count >= rules["messages"]["count"]:
+            state.reset()
+            return self.verdict("messages", count, [message.author.id], message.channel.id)
+
+        mentions = len(message.raw_mentions) + len(message.raw_role_mentions) + (5 if message.mention_everyone else 0)
+
+        if mentions:
+            count = state.mentions.add(tick, mentions)
+
+            if count >= rules["mentions"]["count"]:
+                state.reset()
+                return self.verdict("mentions", count, [message.author.id], message.channel.id)
+
+        if message.content:
+            content_hash = hash(message.content.strip().lower()) & 0xFFFFFFFFFFFFFFFF
+            count = state.duplicates(content_hash, tick, rules["duplicates"]["seconds"])
+
+            if count >= rules["duplicates"]["count"]:
+                state.reset()
+                return self.verdict("duplicates", count, [message.author.id], message.channel.id)
+
+        count = channel.add(tick)
+
+        if count >= rules["channel"]["count"]:
+            channel.reset()
+            return self.verdict("channel", count, channel_id=message.channel.id)
+
+        return None
+
+    def check_join(self, member, now: float = None):
+        now = now if now is not None else time.time()
+        rule = self.rules["joins"]
+
+        state = self.guilds.get(member.guild.id)
+
+        if state is None:
+            state = self.guilds[member.guild.id] = GuildState(self.rules)
+
+        state.joiners[state.next_joiner] = member.id
+        state.next_joiner = (state.next_joiner + 1) % len(state.joiners)
+
+        if now < state.raid_until:
+            state.raid_until = now + self.raid_seconds
+            return self.verdict("joins", state.joins.add(int(now)), [member.id])
+
+        count = state.joins.add(int(now))
+
+        if count < rule["count"]:
+            return None
+
+        # Everyone who joined during the burst is acted on, and so is every
+        # join until things have been quiet for raid_seconds
+        state.raid_until = now + self.raid_seconds
+        user_ids = [user_id for user_id in state.joiners if user_id]
+
+        for i in range(len(state.joiners)):
+            state.joiners[i] = 0
+
+        return self.verdict("joins", count, user_ids)
+
+    def stats(self) -> dict:
+        return {
+            "guilds": len(self.guild_ids),
+            "users": len(self.users),
+            "channels": len(self.channels),
+        }
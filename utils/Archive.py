@@ -0,0 +1,163 @@
+# This project is licensed under the terms of the GPL v3.0 license. Copyright 2024 Cyteon
+
+import asyncio
+import gzip
+import json
+import tempfile
+import time
+import uuid
+import zlib
+
+import discord
+
+# Messages formatted on the event loop before a batch is compressed in a thread
+BATCH_SIZE = 1000
+
+# Parts are kept in memory up to this size before spilling to disk
+SPOOL_SIZE = 8 * 1024 * 1024
+
+# Uncompressed bytes written between size checks
+CHUNK_SIZE = 64 * 1024
+
+FORMATS = ("text", "jsonl")
+
+def attachment_record(message: discord.Message, attachment: discord.Attachment) -> dict:
+    return {
+        "message_id": message.id,
+        "id": attachment.id,
+        "filename": attachment.filename,
+        "url": attachment.url,
+        "size": attachment.size,
+        "content_type": attachment.content_type,
+    }
+
+def message_record(message: discord.Message) -> dict:
+    return {
+        "id": message.id,
+        "author_id": message.author.id,
+        "author": str(message.author),
+        "created_at": message.created_at.isoformat(),
+        "edited_at": message.edited_at.isoformat() if message.edited_at else None,
+        "content": message.content,
+        "attachments": [attachment.id for attachment in message.attachments],
+        "embeds": len(message.embeds),
+        "reference": message.reference.message_id if message.reference else None,
+    }
+
+def message_text(message: discord.Message) -> str:
+    attachments = [attachment.url for attachment in message.attachments]
+    attachments_text = (
+        f"[Attached File{'s' if len(attachments) >= 2 else ''}: {', '.join(attachments)}]"
+        if len(attachments) >= 1
+        else ""
+    )
+
+    return f"{message.created_at.strftime('%d.%m.%Y %H:%M:%S')} {message.author} {message.id}: {message.clean_content} {attachments_text}"
+
+class GzipParts:
+    def __init__(self, basename: str, extension: str, part_size: int) -> None:
+        self.basename = basename
+        self.extension = extension
+        self.part_size = part_size
+
+        self.parts = []
+        self.file = None
+        self.gzip = None
+
+    def _open(self) -> None:
+        self.file = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+        self.gzip = gzip.GzipFile(fileobj=self.file, mode="wb")
+
+    def _close_part(self) -> None:
+        self.gzip.close()
+        self.file.seek(0)
+        self.parts.append(self.file)
+
+        self.file = None
+        self.gzip = None
+
+    def write(self, lines: list) -> None:
+        chunk = []
+        size = 0
+
+        for line in lines:
+            data = (line + "\n").encode("utf-8")
+
+            if chunk and size + len(data) > CHUNK_SIZE:
+                self._write_chunk(b"".join(chunk))
+                chunk, size = [], 0
+
+            chunk.append(data)
+            size += len(data)
+
+        if chunk:
+            self._write_chunk(b"".join(chunk))
+
+    def _write_chunk(self, data: bytes) -> None:
+        if self.gzip is None:
+            self._open()
+        # Deflate grows incompressible data by a few bytes per block at most,
+        # so a part that passes this can't go over part_size with the chunk
+        elif self.file.tell() + len(data) + len(data) // 1000 + 64 > self.part_size:
+            self._close_part()
+            self._open()
+
+        self.gzip.write(data)
+
+        # Sync flush so tell() is the real compressed size
+        self.gzip.flush(zlib.Z_SYNC_FLUSH)
+
+    def close(self) -> list:
+        if self.gzip is not None:
+            self._close_part()
+
+        if len(self.parts) == 1:
+            return [(f"{self.basename}.{self.extension}.gz", self.parts[0])]
+
+        return [
+            (f"{self.basename}.part{i}.{self.extension}.gz", part)
+            for i, part in enumerate(self.parts, start=1)
+        ]
+
+async def export(channel, limit: int, fmt: str, upload_limit: int, before=None) -> dict:
+    basename = f"archive-{channel.id}-{int(time.time())}-{uuid.uuid4().hex[:8]}"
+    part_size = int(upload_limit * 0.9)
+
+    messages = GzipParts(basename, "jsonl" if fmt == "jsonl" else "txt", part_size)
+    manifest = GzipParts(f"{basename}-attachments", "jsonl", part_size)
+
+    count = 0
+    lines = []
+    attachments = []
+
+    header = f'Archived messages from: #{channel} ({channel.id}) in the guild "{channel.guild}" ({channel.guild.id}) at {discord.utils.utcnow().strftime("%d.%m.%Y %H:%M:%S")}'
+
+    if fmt == "text":
+        lines.append(header)
+
+    async for message in channel.history(limit=limit, before=before):
+        count += 1
+
+        if fmt == "jsonl":
+            lines.append(json.dumps(message_record(message), ensure_ascii=False))
+        else:
+            lines.append(message_text(message))
+
+        for attachment in message.attachments:
+            attachments.append(json.dumps(attachment_record(message, attachment), ensure_ascii=False))
+
+        if len(lines) >= BATCH_SIZE:
+            await asyncio.to_thread(messages.write, lines)
+            await asyncio.to_thread(manifest.write, attachments)
+            lines, attachments = [], []
+
+    await asyncio.to_thread(messages.write, lines)
+    await asyncio.to_thread(manifest.write, attachments)
+
+    files = await asyncio.to_thread(messages.close)
+    files += await asyncio.to_thread(manifest.close)
+
+    return {
+        "messages": count,
+        "files": files,
+    }
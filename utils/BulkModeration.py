@@ -0,0 +1,203 @@
+# This project is licensed under the terms of the GPL v3.0 license. Copyright 2024 Cyteon
+
+import asyncio
+import logging
+import re
+import time
+
+import discord
+from bson import ObjectId
+
+from utils import DBClient, Members
+
+logger = logging.getLogger("discord_bot")
+
+db = DBClient.db
+
+# The bulk ban endpoint accepts at most 200 users per request
+BAN_BATCH = 200
+UNBAN_BATCH = 50
+UNBAN_CONCURRENCY = 5
+
+id_rx = re.compile(r"^(?:<@!?)?(\d{15,20})>?$")
+
+_locks = {}
+
+def parse_targets(text: str):
+    user_ids = []
+    reason = []
+
+    for token in text.replace(",", " ").split():
+        match = id_rx.match(token)
+
+        if match:
+            user_ids.append(int(match.group(1)))
+        else:
+            reason.append(token)
+
+    # keep the order but drop duplicates so a resumed job lines up with the cursor
+    return list(dict.fromkeys(user_ids)), " ".join(reason)
+
+# Why `member` can't be banned by `author`, the same rules as the ban command
+# plus the role hierarchy that ban leaves to discord
+def ban_protection(guild: discord.Guild, author: discord.Member, member: discord.Member):
+    if member.id == guild.me.id:
+        return "is me"
+
+    if member.id == author.id:
+        return "is you"
+
+    if member.id == guild.owner_id:
+        return "owns the server"
+
+    if member.guild_permissions.administrator:
+        return "is an administrator"
+
+    if author.id != guild.owner_id and member.top_role >= author.top_role:
+        return "has a role above or equal to yours"
+
+    if member.top_role >= guild.me.top_role:
+        return "has a role above or equal to mine"
+
+    return None
+
+# Splits the ids into ones that may be banned and skipped ones with a reason,
+# ids that aren't members are banned by id as there is nothing to check
+async def check_ban_targets(guild: discord.Guild, author: discord.Member, user_ids: list):
+    members, unresolved = await Members.resolve_members(guild, user_ids)
+
+    allowed = []
+    skipped = []
+
+    for user_id in user_ids:
+        member = members.get(user_id)
+
+        if member is not None:
+            reason = ban_protection(guild, author, member)
+        elif user_id in unresolved:
+            reason = "couldn't be looked up"
+        else:
+            reason = None
+
+        if reason is None:
+            allowed.append(user_id)
+        else:
+            skipped.append({"user_id": user_id, "reason": reason})
+
+    return allowed, skipped
+
+def create_job(guild_id: int, author_id: int, action: str, user_ids: list, reason: str, skipped: list = None) -> dict:
+    job = {
+        "guild_id": guild_id,
+        "author_id": author_id,
+        "action": action,
+        "user_ids": user_ids,
+        "reason": reason,
+        "cursor": 0,
+        "succeeded": 0,
+        "failed": [],
+        "skipped": skipped or [],
+        "status": "pending",
+        "created_at": time.time(),
+    }
+
+    job["_id"] = db["moderation_jobs"].insert_one(job).inserted_id
+
+    return job
+
+def get_job(guild_id: int, job_id: str):
+    try:
+        return db["moderation_jobs"].find_one({"_id": ObjectId(job_id), "guild_id": guild_id})
+    except Exception:
+        return None
+
+def save_progress(job: dict, processed: int, succeeded: int, failed: list) -> None:
+    job["cursor"] += processed
+    job["succeeded"] += succeeded
+    job["failed"].extend(failed)
+
+    db["moderation_jobs"].update_one(
+        {"_id": job["_id"]},
+        {
+            "$set": {"cursor": job["cursor"], "status": "running"},
+            "$inc": {"succeeded": succeeded},
+            "$push": {"failed": {"$each": failed}},
+        }
+    )
+
+def finish(job: dict, status: str) -> None:
+    job["status"] = status
+    db["moderation_jobs"].update_one({"_id": job["_id"]}, {"$set": {"status": status}})
+
+async def ban_batch(guild: discord.Guild, user_ids: list, reason: str):
+    users = [discord.Object(id=user_id) for user_id in user_ids]
+
+    if hasattr(guild, "bulk_ban"):
+        result = await guild.bulk_ban(users, reason=reason, delete_message_seconds=0)
+        return len(result.banned), [user.id for user in result.failed]
+
+    # discord.py < 2.4 has no bulk ban, fall back to concurrent single bans
+    semaphore = asyncio.Semaphore(UNBAN_CONCURRENCY)
+
+    async def ban(user):
+        async with semaphore:
+            try:
+                await guild.ban(user, reason=reason, delete_message_days=0)
+                return True
+            except discord.HTTPException:
+                return False
+
+    results = await asyncio.gather(*[ban(user) for user in users])
+
+    return sum(results), [user.id for user, ok in zip(users, results) if not ok]
+
+async def unban_batch(guild: discord.Guild, user_ids: list, reason: str):
+    semaphore = asyncio.Semaphore(UNBAN_CONCURRENCY)
+
+    async def unban(user_id):
+        async with semaphore:
+            try:
+                await guild.unban(discord.Object(id=user_id), reason=reason)
+                return True
+            except discord.HTTPException:
+                return False
+
+    results = await asyncio.gather(*[unban(user_id) for user_id in user_ids])
+
+    return sum(results), [user_id for user_id, ok in zip(user_ids, results) if not ok]
+
+async def run_job(guild: discord.Guild, job: dict, progress=None) -> dict:
+    lock = _locks.setdefault(guild.id, asyncio.Lock())
+
+    if lock.locked():
+        raise RuntimeError("Another bulk moderation job is already running in this server.")
+
+    async with lock:
+        if job["action"] == "ban":
+            run_batch, size = ban_batch, BAN_BATCH
+        else:
+            run_batch, size = unban_batch, UNBAN_BATCH
+
+        user_ids = job["user_ids"]
+
+        try:
+            while job["cursor"] < len(user_ids):
+                batch = user_ids[job["cursor"]:job["cursor"] + size]
+
+                try:
+                    succeeded, failed = await run_batch(guild, batch, job["reason"])
+                except discord.HTTPException as e:
+                    logger.warning(f"Bulk {job['action']} batch failed in {guild.id}: {e}")
+                    succeeded, failed = 0, batch
+
+                save_progress(job, len(batch), succeeded, failed)
+
+                if progress:
+                    await progress(job)
+        except asyncio.CancelledError:
+            finish(job, "interrupted")
+            raise
+
+        finish(job, "done")
+
+    return job
@@ -6,27 +6,14 @@ from dataclasses import dataclass
 
 from typing import Final
 
+from utils import Models
+
+# The defaults live on the models, documents missing a field decode to them
 def guild_data_template(guild_id):
-    return {
-        "id": guild_id,
-        "daily_cash": 50,
-        "log_channel": 0,
-    }
+    return Models.Guild.new(guild_id).to_document()
 
 def user_data_template(user_id, guild_id):
-    return {
-        "id": user_id,
-        "guild_id": guild_id,
-        "wallet": 0,
-        "last_daily": 0,
-        "last_robbed_at": 0,
-        "jailed": False,
-        "warnings": [],
-    }
+    return Models.User.new(user_id, guild_id).to_document()
 
 def user_global_data_template(user_id):
-    return {
-        "id": user_id,
-        "blacklisted": False,
-        "blacklist_reason": "",
-    }
+    return Models.GlobalUser.new(user_id).to_document()
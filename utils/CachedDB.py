@@ -1,6 +1,5 @@
 # This project is licensed under the terms of the GPL v3.0 license. Copyright 2024 Cyteon
 
-import pymongo
 import redis
 import json
 import logging
@@ -10,14 +9,25 @@ from bson import ObjectId
 
 logger = logging.getLogger("discord_bot")
 
-mongo_client_pool = pymongo.MongoClient(os.getenv("MONGODB_URL"), maxPoolSize=50)
-mongo_db = mongo_client_pool.potatobot
+_redis_client = None
 
-redis_pool = redis.ConnectionPool.from_url(os.getenv("REDIS_URL"), max_connections=100)
-redis_client = redis.Redis(connection_pool=redis_pool)
+def get_redis() -> redis.Redis:
+    global _redis_client
 
-print("Connected to MongoDB at: ", mongo_client_pool.host)
-print("Connected to Redis at: ", redis_client.connection_pool.connection_kwargs["host"])
+    if _redis_client is None:
+        redis_pool = redis.ConnectionPool.from_url(os.getenv("REDIS_URL"), max_connections=100)
+        _redis_client = redis.Redis(connection_pool=redis_pool)
+
+        logger.info(f"Using Redis at: {redis_pool.connection_kwargs.get('host')}")
+
+    return _redis_client
+
+def close() -> None:
+    global _redis_client
+
+    if _redis_client is not None:
+        _redis_client.connection_pool.disconnect()
+        _redis_client = None
 
 class JSONEncoder(json.JSONEncoder):
     def default(self, obj):
@@ -31,7 +41,7 @@ async def find_one(collection, query, ex=30):
     start_time = time.time() * 1000
 
     cache_key = f"{collection.name}:{json.dumps(query, cls=JSONEncoder)}"
-    cached_result = redis_client.get(cache_key)
+    cached_result = get_redis().get(cache_key)
 
     if cached_result:
         logger.info(f"Cache hit for query {cache_key} - took {time.time() * 1000 - start_time:.2f}ms")
@@ -41,7 +51,7 @@ async def find_one(collection, query, ex=30):
 
         if result:
             result = json.loads(JSONEncoder().encode(result))
-            redis_client.set(cache_key, json.dumps(result), ex=ex)
+            get_redis().set(cache_key, json.dumps(result), ex=ex)
 
         logger.info(f"Cache miss for query {cache_key} - took {time.time() * 1000 - start_time:.2f}ms")
         return result
@@ -50,7 +60,7 @@ async def update_one(collection, filter, update, upsert=False):
     result = collection.update_one(filter, update, upsert=upsert)
 
     cache_key = f"{collection.name}:{json.dumps(filter, cls=JSONEncoder)}"
-    redis_client.delete(cache_key)
+    get_redis().delete(cache_key)
 
     return result
 
@@ -58,7 +68,7 @@ def sync_find_one(collection, query, ex=30):
     start_time = time.time() * 1000
 
     cache_key = f"{collection.name}:{json.dumps(query, cls=JSONEncoder)}"
-    cached_result = redis_client.get(cache_key)
+    cached_result = get_redis().get(cache_key)
 
     if cached_result:
         logger.info(f"Cache hit for query {cache_key} - took {time.time() * 1000 - start_time:.2f}ms")
@@ -68,7 +78,7 @@ def sync_find_one(collection, query, ex=30):
 
         if result:
             result = json.loads(JSONEncoder().encode(result))
-            redis_client.set(cache_key, json.dumps(result), ex=ex)
+            get_redis().set(cache_key, json.dumps(result), ex=ex)
 
         logger.info(f"Cache miss for query {cache_key} - took {time.time() * 1000 - start_time:.2f}ms")
         return result
@@ -77,6 +87,6 @@ def sync_update_one(collection, filter, update, upsert=False):
     result = collection.update_one(filter, update, upsert=upsert)
 
     cache_key = f"{collection.name}:{json.dumps(filter, cls=JSONEncoder)}"
-    redis_client.delete(cache_key)
+    get_redis().delete(cache_key)
 
     return result
@@ -0,0 +1,167 @@
+# This project is licensed under the terms of the GPL v3.0 license. Copyright 2024 Cyteon
+
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+import pymongo
+
+from utils import DBClient
+
+logger = logging.getLogger("discord_bot")
+
+db = DBClient.db
+
+PAGE_SIZE = 10
+
+# Format the embedded warnings used to store their time in
+LEGACY_TIME_FORMAT = "%d.%m.%Y %H:%M:%S"
+
+# Marker in the migrations collection once embedded warnings are moved over
+MIGRATION = "warnings_to_cases"
+
+_indexes_created = False
+
+def ensure_indexes() -> None:
+    global _indexes_created
+
+    if _indexes_created:
+        return
+
+    cases = db["moderation_cases"]
+
+    cases.create_index([("guild_id", pymongo.ASCENDING), ("user_id", pymongo.ASCENDING), ("time", pymongo.DESCENDING)])
+    cases.create_index([("guild_id", pymongo.ASCENDING), ("case_id", pymongo.ASCENDING)], unique=True)
+    cases.create_index("legacy_id", unique=True, sparse=True)
+
+    # Only documents with an expires_at date are removed by the ttl monitor
+    cases.create_index("expires_at", expireAfterSeconds=0)
+
+    _indexes_created = True
+
+def next_case_id(guild_id: int) -> int:
+    counter = db["case_counters"].find_one_and_update(
+        {"_id": guild_id},
+        {"$inc": {"seq": 1}},
+        upsert=True,
+        return_document=pymongo.ReturnDocument.AFTER,
+    )
+
+    return counter["seq"]
+
+def new_case(guild_id: int, user_id: int, moderator_id: int, action: str, reason: str, time: datetime = None, expires_at: datetime = None) -> dict:
+    case = {
+        "guild_id": guild_id,
+        "case_id": next_case_id(guild_id),
+        "user_id": user_id,
+        "moderator_id": moderator_id,
+        "action": action,
+        "reason": reason,
+        "time": time or datetime.now(timezone.utc),
+    }
+
+    if expires_at is not None:
+        case["expires_at"] = expires_at
+
+    return case
+
+def create_case(guild_id: int, user_id: int, moderator_id: int, action: str, reason: str, expires_in: timedelta = None) -> dict:
+    ensure_indexes()
+
+    expires_at = datetime.now(timezone.utc) + expires_in if expires_in else None
+    case = new_case(guild_id, user_id, moderator_id, action, reason, expires_at=expires_at)
+
+    db["moderation_cases"].insert_one(case)
+
+    return case
+
+def active_filter() -> dict:
+    # The ttl monitor only runs once a minute, hide what it hasn't removed yet
+    return {"$or": [{"expires_at": {"$exists": False}}, {"expires_at": {"$gt": datetime.now(timezone.utc)}}]}
+
+def list_cases(guild_id: int, user_id: int, cursor: tuple = None, limit: int = PAGE_SIZE):
+    ensure_indexes()
+
+    query = {"guild_id": guild_id, "user_id": user_id, "$and": [active_filter()]}
+
+    if cursor is not None:
+        time, case_id = cursor
+        query["$and"].append({"$or": [{"time": {"$lt": time}}, {"time": time, "case_id": {"$lt": case_id}}]})
+
+    cases = list(
+        db["moderation_cases"]
+        .find(query)
+        .sort([("time", pymongo.DESCENDING), ("case_id", pymongo.DESCENDING)])
+        .limit(limit + 1)
+    )
+
+    if len(cases) > limit:
+        cases = cases[:limit]
+        return cases, (cases[-1]["time"], cases[-1]["case_id"])
+
+    return cases, None
+
+def count_cases(guild_id: int, user_id: int) -> int:
+    ensure_indexes()
+
+    return db["moderation_cases"].count_documents({"guild_id": guild_id, "user_id": user_id, **active_filter()})
+
+def delete_case(guild_id: int, case_id: int) -> bool:
+    return db["moderation_cases"].delete_one({"guild_id": guild_id, "case_id": case_id}).deleted_count > 0
+
+def clear_cases(guild_id: int, user_id: int, action: str = None) -> int:
+    query = {"guild_id": guild_id, "user_id": user_id}
+
+    if action is not None:
+        query["action"] = action
+
+    return db["moderation_cases"].delete_many(query).deleted_count
+
+def parse_legacy_time(value: str) -> datetime:
+    try:
+        return datetime.strptime(value, LEGACY_TIME_FORMAT).replace(tzinfo=timezone.utc)
+    except (TypeError, ValueError):
+        return datetime.now(timezone.utc)
+
+def migration_done() -> bool:
+    return db["migrations"].find_one({"_id": MIGRATION}, {"_id": 1}) is not None
+
+# Run by an owner with `dev migrate`, the users query has no index to use
+def migrate() -> int:
+    ensure_indexes()
+
+    users = db["users"]
+    migrated = 0
+
+    for data in users.find({"warnings": {"$exists": True}}, {"id": 1, "guild_id": 1, "warnings": 1}):
+        for i, warning in enumerate(data["warnings"] or []):
+            legacy_id = f"{data['_id']}:{i}"
+
+            # Keyed on the source entry so an interrupted or concurrent
+            # migration never inserts the same warning twice
+            if db["moderation_cases"].find_one({"legacy_id": legacy_id}, {"_id": 1}):
+                continue
+
+            case = new_case(
+                data["guild_id"],
+                data["id"],
+                None,
+                "warn",
+                warning.get("reason", "Not specified"),
+                time=parse_legacy_time(warning.get("time")),
+            )
+            case["legacy_id"] = legacy_id
+
+            db["moderation_cases"].update_one({"legacy_id": legacy_id}, {"$setOnInsert": case}, upsert=True)
+            migrated += 1
+
+        users.update_one({"_id": data["_id"]}, {"$unset": {"warnings": ""}})
+
+    db["migrations"].update_one(
+        {"_id": MIGRATION}, {"$set": {"time": time.time(), "migrated": migrated}}, upsert=True
+    )
+
+    if migrated:
+        logger.info(f"Migrated {migrated} warning(s) to moderation cases")
+
+    return migrated
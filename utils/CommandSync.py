@@ -0,0 +1,58 @@
+# This project is licensed under the terms of the GPL v3.0 license. Copyright 2024 Cyteon
+
+import hashlib
+import inspect
+import json
+import logging
+
+import discord
+from discord import app_commands
+
+from utils import DBClient
+
+logger = logging.getLogger("discord_bot")
+
+db = DBClient.db
+
+def serialize_command(command, tree: app_commands.CommandTree) -> dict:
+    # discord.py < 2.4 doesn't take the tree
+    if inspect.signature(command.to_dict).parameters:
+        return command.to_dict(tree)
+
+    return command.to_dict()
+
+def tree_hash(tree: app_commands.CommandTree, guild: discord.abc.Snowflake = None) -> str:
+    payload = [serialize_command(command, tree) for command in tree.get_commands(guild=guild)]
+    payload.sort(key=lambda command: (command.get("type", 1), command["name"]))
+
+    encoded = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+# Per application, a dev bot sharing the database with prod has its own
+# commands to keep in sync
+def scope_key(tree: app_commands.CommandTree, guild: discord.abc.Snowflake = None) -> str:
+    return f"{tree.client.application_id}:{guild.id if guild else 'global'}"
+
+def stored_hash(tree: app_commands.CommandTree, guild: discord.abc.Snowflake = None):
+    data = db["command_sync"].find_one({"scope": scope_key(tree, guild)})
+
+    return data["hash"] if data else None
+
+async def sync(tree: app_commands.CommandTree, guild: discord.abc.Snowflake = None, force: bool = False) -> bool:
+    current = tree_hash(tree, guild)
+
+    if not force and stored_hash(tree, guild) == current:
+        logger.info(f"Command tree for {scope_key(tree, guild)} unchanged ({current[:12]}), skipping sync")
+        return False
+
+    await tree.sync(guild=guild)
+
+    db["command_sync"].update_one(
+        {"scope": scope_key(tree, guild)},
+        {"$set": {"hash": current}},
+        upsert=True
+    )
+
+    logger.info(f"Synced command tree for {scope_key(tree, guild)} ({current[:12]})")
+    return True
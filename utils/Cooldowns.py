@@ -0,0 +1,169 @@
+# This project is licensed under the terms of the GPL v3.0 license. Copyright 2024 Cyteon
+
+import logging
+import time
+
+import redis
+from discord.ext import commands
+
+from utils import CachedDB
+
+logger = logging.getLogger("discord_bot")
+
+# Token bucket holding `rate` tokens that refill over `per` seconds.
+# Returns "0" if a token was taken, otherwise the seconds until the next one
+# (as a string, redis truncates lua numbers to integers). The time comes
+# from redis, every cluster process shares the bucket but not a clock
+TOKEN_BUCKET = """
+redis.replicate_commands()
+
+local rate = tonumber(ARGV[1])
+local per = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+
+local data = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(data[1]) or rate
+local ts = tonumber(data[2]) or now
+
+tokens = math.min(rate, tokens + math.max(0, now - ts) * rate / per)
+
+if tokens < 1 then
+    return tostring((1 - tokens) * per / rate)
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens - 1), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(per * 1000))
+
+return '0'
+"""
+
+# Gives back a token taken by TOKEN_BUCKET, never above `rate`
+REFUND = """
+redis.replicate_commands()
+
+local rate = tonumber(ARGV[1])
+local per = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+
+local data = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(data[1])
+local ts = tonumber(data[2])
+
+if tokens and ts then
+    tokens = math.min(rate, tokens + math.max(0, now - ts) * rate / per + 1)
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+end
+
+return 0
+"""
+
+_script = None
+_refund_script = None
+
+# key -> time the key is known to be on cooldown until, so repeated attempts
+# during a cooldown are rejected without a round trip
+_blocked = {}
+
+# used while redis is unreachable so cooldowns still apply per process
+_fallback = {}
+
+def get_script():
+    global _script
+
+    if _script is None:
+        _script = CachedDB.get_redis().register_script(TOKEN_BUCKET)
+
+    return _script
+
+def get_refund_script():
+    global _refund_script
+
+    if _refund_script is None:
+        _refund_script = CachedDB.get_redis().register_script(REFUND)
+
+    return _refund_script
+
+def bucket_key(context: commands.Context, bucket_type: commands.BucketType) -> str:
+    key = bucket_type.get_key(context.message)
+
+    if isinstance(key, tuple):
+        key = ":".join(str(part) for part in key)
+
+    return f"cooldown:{context.command.qualified_name}:{bucket_type.name}:{key}"
+
+def local_retry_after(key: str, rate: int, per: float, now: float) -> float:
+    tokens, ts = _fallback.get(key, (rate, now))
+    tokens = min(rate, tokens + max(0, now - ts) * rate / per)
+
+    if tokens < 1:
+        return (1 - tokens) * per / rate
+
+    _fallback[key] = (tokens - 1, now)
+    return 0.0
+
+# Only rejections are answered locally. Buckets are shared by every cluster
+# process, a user bucket covers guilds on other shards too, so a local
+# estimate of the tokens left would let a user through once per process.
+# Taking a token is one EVALSHA, and only on invocations that go ahead
+def retry_after(key: str, rate: int, per: float) -> float:
+    now = time.time()
+
+    blocked_until = _blocked.get(key)
+
+    if blocked_until is not None:
+        if blocked_until > now:
+            return blocked_until - now
+
+        del _blocked[key]
+
+    try:
+        result = float(get_script()(keys=[key], args=[rate, per]))
+    except redis.RedisError as e:
+        logger.warning(f"Redis cooldown check failed for {key}, using local bucket: {e}")
+        result = local_retry_after(key, rate, per, now)
+
+    if result > 0:
+        _blocked[key] = now + result
+
+        if len(_blocked) > 10000:
+            for stale in [k for k, until in _blocked.items() if until <= now]:
+                del _blocked[stale]
+
+    return result
+
+# Gives the token back to an invocation that took one but did nothing with
+# it: it failed a later check or its arguments, or returned early
+def refund(context: commands.Context) -> None:
+    taken = getattr(context, "cooldown_token", None)
+
+    if taken is None:
+        return
+
+    key, rate, per = taken
+    context.cooldown_token = None
+    _blocked.pop(key, None)
+
+    try:
+        get_refund_script()(keys=[key], args=[rate, per])
+    except redis.RedisError as e:
+        logger.warning(f"Redis cooldown refund failed for {key}: {e}")
+
+        # The token most likely came from the local bucket too
+        if key in _fallback:
+            tokens, ts = _fallback[key]
+            _fallback[key] = (min(rate, tokens + 1), ts)
+
+def cooldown(rate: int, per: float, type: commands.BucketType = commands.BucketType.default):
+    def predicate(context: commands.Context) -> bool:
+        key = bucket_key(context, type)
+        wait = retry_after(key, rate, per)
+
+        if wait > 0:
+            raise commands.CommandOnCooldown(commands.Cooldown(rate, per), wait, type)
+
+        context.cooldown_token = (key, rate, per)
+        return True
+
+    return commands.check(predicate)
@@ -3,5 +3,6 @@
 import pymongo
 import os
 
-client = pymongo.MongoClient(os.getenv("MONGODB_URL"))
+# connect=False defers the connection until the first operation
+client = pymongo.MongoClient(os.getenv("MONGODB_URL"), connect=False)
 db = client.potatobot
@@ -0,0 +1,98 @@
+# This project is licensed under the terms of the GPL v3.0 license. Copyright 2024 Cyteon
+
+import asyncio
+
+from discord.ext import commands
+
+from utils import DBClient, Models
+
+db = DBClient.db
+
+# Documents looked up during one command or event, each one is read at
+# most once no matter how many checks and helpers ask for it. Wallets come
+# with pending write-behind deltas already applied
+class DataContext:
+    def __init__(self, bot) -> None:
+        self.bot = bot
+        self.models = {}
+        self.guilds = {}
+
+    async def load(self, model, keys: list, create: bool) -> dict:
+        wanted = [key for key in dict.fromkeys(keys) if (model, key) not in self.models]
+
+        if wanted:
+            found = await model.find_many(wanted)
+
+            for key in wanted:
+                data = found.get(key)
+
+                if data is not None and model is Models.User:
+                    data = self.bot.wallets.apply(data.query, data)
+
+                self.models[(model, key)] = data
+
+        if create:
+            missing = [key for key in dict.fromkeys(keys) if self.models[(model, key)] is None]
+
+            if missing:
+                created = [model.new(*key) for key in missing]
+                await asyncio.to_thread(db[model.collection].insert_many, [data.to_document() for data in created])
+
+                for key, data in zip(missing, created):
+                    self.models[(model, key)] = data
+
+        return {key: self.models[(model, key)] for key in keys}
+
+    async def users(self, guild_id: int, *user_ids: int, create: bool = False) -> dict:
+        found = await self.load(Models.User, [(user_id, guild_id) for user_id in user_ids], create)
+
+        return {user_id: data for (user_id, _), data in found.items()}
+
+    async def user(self, guild_id: int, user_id: int, create: bool = False):
+        return (await self.users(guild_id, user_id, create=create))[user_id]
+
+    async def global_user(self, user_id: int, create: bool = False):
+        return (await self.load(Models.GlobalUser, [(user_id,)], create))[(user_id,)]
+
+    async def guild(self, guild_id: int):
+        if guild_id not in self.guilds:
+            self.guilds[guild_id] = await self.bot.guild_settings.get(guild_id)
+
+        return self.guilds[guild_id]
+
+    async def prefetch(self, context: commands.Context, needs: tuple) -> None:
+        lookups = []
+
+        if "global_author" in needs:
+            lookups.append(self.global_user(context.author.id, create=True))
+
+        if context.guild is not None:
+            if "author" in needs:
+                lookups.append(self.user(context.guild.id, context.author.id, create=True))
+
+            if "guild" in needs:
+                lookups.append(self.guild(context.guild.id))
+
+        await asyncio.gather(*lookups)
+
+class Context(commands.Context):
+    def __init__(self, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.data = DataContext(self.bot)
+
+def of(context: commands.Context) -> DataContext:
+    data = getattr(context, "data", None)
+
+    if data is None:
+        data = context.data = DataContext(context.bot)
+
+    return data
+
+# Loads what the command is going to read in one go before the rest of its
+# checks run, put it above them: "global_author", "author" and "guild"
+def needs(*entities: str):
+    async def predicate(context: commands.Context) -> bool:
+        await of(context).prefetch(context, entities)
+        return True
+
+    return commands.check(predicate)
@@ -0,0 +1,141 @@
+# This project is licensed under the terms of the GPL v3.0 license. Copyright 2024 Cyteon
+
+import json
+import time
+from datetime import datetime, timedelta, timezone
+
+import pymongo
+from bson import ObjectId
+
+from utils import CachedDB, DBClient
+
+db = DBClient.db
+
+# Days of daily claims kept in the stats document
+DAILY_DAYS = 7
+
+_indexes_created = False
+
+def ensure_indexes() -> None:
+    global _indexes_created
+
+    if _indexes_created:
+        return
+
+    # Lets the wallet pipeline read a guild in wallet order without sorting
+    db["users"].create_index([("guild_id", pymongo.ASCENDING), ("wallet", pymongo.ASCENDING)])
+
+    # Only daily claims, so the busier pay/rob entries don't pay for it
+    db["economy_ledger"].create_index(
+        [("guild_id", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)],
+        name="daily_claims",
+        partialFilterExpression={"kind": "daily"},
+    )
+
+    _indexes_created = True
+
+def cache_key(guild_id: int) -> str:
+    return f"economy_stats:{json.dumps({'_id': guild_id})}"
+
+def merge_stage(when_not_matched: str = "insert") -> dict:
+    return {"$merge": {"into": "economy_stats", "on": "_id", "whenMatched": "merge", "whenNotMatched": when_not_matched}}
+
+def wallet_pipeline(guild_id: int, now: float) -> list:
+    return [
+        {"$match": {"guild_id": guild_id}},
+        {"$sort": {"wallet": pymongo.ASCENDING}},
+        {"$setWindowFields": {
+            "sortBy": {"wallet": pymongo.ASCENDING},
+            "output": {
+                "rank": {"$documentNumber": {}},
+                "users": {"$count": {}, "window": {"documents": ["unbounded", "unbounded"]}},
+            },
+        }},
+        {"$project": {
+            "_id": 0,
+            "rank": 1,
+            "users": 1,
+            "wallet": {"$ifNull": ["$wallet", 0]},
+            # Debts don't make anyone poorer than broke for the inequality numbers
+            "positive": {"$max": [{"$ifNull": ["$wallet", 0]}, 0]},
+        }},
+        {"$group": {
+            "_id": guild_id,
+            "users": {"$first": "$users"},
+            "total": {"$sum": "$wallet"},
+            "min": {"$min": "$wallet"},
+            "max": {"$max": "$wallet"},
+            "positive_total": {"$sum": "$positive"},
+            "weighted": {"$sum": {"$multiply": ["$rank", "$positive"]}},
+            "median_low": {"$sum": {"$cond": [
+                {"$eq": ["$rank", {"$floor": {"$divide": [{"$add": ["$users", 1]}, 2]}}]}, "$wallet", 0
+            ]}},
+            "median_high": {"$sum": {"$cond": [
+                {"$eq": ["$rank", {"$add": [{"$floor": {"$divide": ["$users", 2]}}, 1]}]}, "$wallet", 0
+            ]}},
+            "top": {"$sum": {"$cond": [
+                {"$gt": ["$rank", {"$subtract": ["$users", {"$ceil": {"$divide": ["$users", 10]}}]}]}, "$positive", 0
+            ]}},
+        }},
+        {"$project": {
+            "users": 1,
+            "total": 1,
+            "min": 1,
+            "max": 1,
+            "mean": {"$divide": ["$total", "$users"]},
+            "median": {"$divide": [{"$add": ["$median_low", "$median_high"]}, 2]},
+            # Gini over wallets sorted ascending: 2 * sum(i * x_i) / (n * sum(x)) - (n + 1) / n
+            "gini": {"$cond": [
+                {"$gt": ["$positive_total", 0]},
+                {"$subtract": [
+                    {"$divide": [{"$multiply": [2, "$weighted"]}, {"$multiply": ["$users", "$positive_total"]}]},
+                    {"$divide": [{"$add": ["$users", 1]}, "$users"]},
+                ]},
+                0,
+            ]},
+            "top_share": {"$cond": [
+                {"$gt": ["$positive_total", 0]}, {"$divide": ["$top", "$positive_total"]}, 0
+            ]},
+            "daily": {"$literal": []},
+            "time": {"$literal": now},
+        }},
+        merge_stage(),
+    ]
+
+def daily_pipeline(guild_id: int, since: ObjectId) -> list:
+    return [
+        {"$match": {"guild_id": guild_id, "kind": "daily", "_id": {"$gte": since}}},
+        {"$group": {
+            "_id": {"$dateToString": {"format": "%Y-%m-%d", "date": {"$toDate": "$_id"}}},
+            "claims": {"$sum": 1},
+            "amount": {"$sum": "$delta"},
+        }},
+        {"$sort": {"_id": pymongo.ASCENDING}},
+        {"$group": {"_id": guild_id, "daily": {"$push": {"day": "$_id", "claims": "$claims", "amount": "$amount"}}}},
+        # A guild without users has no stats document to add these to
+        merge_stage("discard"),
+    ]
+
+def refresh(guild_id: int) -> None:
+    ensure_indexes()
+
+    now = time.time()
+    since = ObjectId.from_datetime(
+        datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=DAILY_DAYS - 1)
+    )
+
+    # Both pipelines write their result into economy_stats on the server,
+    # nothing but the command's own read ever comes back over the wire
+    db["users"].aggregate(wallet_pipeline(guild_id, now))
+    db["economy_ledger"].aggregate(daily_pipeline(guild_id, since))
+
+    CachedDB.get_redis().delete(cache_key(guild_id))
+
+async def get(guild_id: int, ex: int = 300):
+    return await CachedDB.find_one(db["economy_stats"], {"_id": guild_id}, ex=ex)
+
+def requested(guild_id: int) -> None:
+    db["economy_stats"].update_one({"_id": guild_id}, {"$set": {"requested_at": time.time()}})
+
+def due(since: float) -> list:
+    return [data["_id"] for data in db["economy_stats"].find({"requested_at": {"$gt": since}}, {"_id": 1})]
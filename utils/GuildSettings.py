@@ -0,0 +1,225 @@
+# This project is licensed under the terms of the GPL v3.0 license. Copyright 2024 Cyteon
+
+import asyncio
+import json
+import logging
+import time
+import uuid
+
+from pymongo import ReturnDocument
+
+from utils import CachedDB, DBClient, Models
+
+logger = logging.getLogger("discord_bot")
+
+db = DBClient.db
+
+CHANNEL = "guild_settings"
+
+MAX_DAILY_CASH = 1000000
+
+# Seconds to wait before subscribing again after losing redis
+RETRY_DELAY = 5
+
+class InvalidSetting(ValueError):
+    pass
+
+def check_daily_cash(value: int) -> None:
+    if not 0 <= value <= MAX_DAILY_CASH:
+        raise InvalidSetting(f"Daily cash has to be between 0 and {MAX_DAILY_CASH}")
+
+def check_log_channel(value: int) -> None:
+    if value < 0:
+        raise InvalidSetting("Log channel has to be a channel id, or 0 for none")
+
+SCHEMA = {
+    "daily_cash": (int, check_daily_cash),
+    "log_channel": (int, check_log_channel),
+    "anti_spam": (bool, None),
+}
+
+def validate(changes: dict) -> None:
+    for field, value in changes.items():
+        if field not in SCHEMA:
+            raise InvalidSetting(f"Unknown setting: {field}")
+
+        kind, check = SCHEMA[field]
+
+        # bool is an int too, don't let True through as a channel id
+        if not isinstance(value, kind) or (kind is int and isinstance(value, bool)):
+            raise InvalidSetting(f"{field} has the wrong type, expected {kind.__name__}")
+
+        if check is not None:
+            check(value)
+
+# Owns every read and write of `guilds` documents. Settings are kept per
+# process as Guild models, a write updates the local copy and tells every
+# other process over redis pub/sub to drop theirs. Entries also expire
+# after `max_age` seconds in case a message was missed
+class GuildSettings:
+    def __init__(self, max_age: float = 600, owns=None) -> None:
+        self.max_age = max_age
+        self.owns = owns or (lambda guild_id: True)
+
+        self.origin = uuid.uuid4().hex
+        self.cache = {}
+        self.hooks = []
+        self.reloads = set()
+        self.task = None
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def on_change(self, hook) -> None:
+        self.hooks.append(hook)
+
+    def off_change(self, hook) -> None:
+        self.hooks = [registered for registered in self.hooks if registered != hook]
+
+    def start(self) -> None:
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    # A read only, guilds without a document get the defaults and only get
+    # one once something is changed
+    def load(self, guild_id: int) -> Models.Guild:
+        data = db["guilds"].find_one({"id": guild_id})
+
+        if data is None:
+            return Models.Guild.new(guild_id)
+
+        return Models.Guild.from_document(data)
+
+    def store(self, settings: Models.Guild) -> Models.Guild:
+        self.cache[settings.id] = (settings, time.monotonic() + self.max_age)
+        return settings
+
+    async def get(self, guild_id: int) -> Models.Guild:
+        entry = self.cache.get(guild_id)
+
+        if entry is not None and entry[1] > time.monotonic():
+            self.hits += 1
+            return entry[0]
+
+        self.misses += 1
+
+        return self.store(await asyncio.to_thread(self.load, guild_id))
+
+    async def preload(self, query: dict) -> list:
+        documents = await asyncio.to_thread(lambda: list(db["guilds"].find(query)))
+
+        return [self.store(Models.Guild.from_document(data)) for data in documents]
+
+    async def update(self, guild_id: int, **changes) -> Models.Guild:
+        validate(changes)
+
+        defaults = {
+            field: value for field, value in Models.Guild.new(guild_id).to_document().items()
+            if field not in changes
+        }
+
+        data = await asyncio.to_thread(
+            db["guilds"].find_one_and_update,
+            {"id": guild_id},
+            {"$set": changes, "$setOnInsert": defaults},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+
+        settings = self.store(Models.Guild.from_document(data))
+
+        await asyncio.to_thread(self.publish, guild_id)
+        await self.changed(settings)
+
+        return settings
+
+    def publish(self, guild_id: int) -> None:
+        try:
+            client = CachedDB.get_redis()
+
+            # Anything still reading guilds through CachedDB sees it too
+            client.delete(f"guilds:{json.dumps({'id': guild_id})}")
+            client.publish(CHANNEL, f"{self.origin}:{guild_id}")
+        except Exception as e:
+            # The other processes pick it up once their copy expires
+            logger.warning(f"Failed to broadcast settings change for {guild_id}: {type(e).__name__}: {e}")
+
+    async def changed(self, settings: Models.Guild) -> None:
+        for hook in self.hooks:
+            try:
+                result = hook(settings)
+
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception as e:
+                logger.error(f"Settings hook failed for {settings.id}: {type(e).__name__}: {e}")
+
+    def received(self, data: bytes) -> None:
+        origin, _, guild_id = data.decode().partition(":")
+
+        if origin == self.origin:
+            return
+
+        guild_id = int(guild_id)
+
+        self.cache.pop(guild_id, None)
+        self.invalidations += 1
+
+        if self.hooks and self.owns(guild_id):
+            task = asyncio.create_task(self.reload(guild_id))
+            self.reloads.add(task)
+            task.add_done_callback(self.reloads.discard)
+
+    async def reload(self, guild_id: int) -> None:
+        try:
+            settings = await self.get(guild_id)
+        except Exception as e:
+            logger.warning(f"Failed to reload settings for {guild_id}: {type(e).__name__}: {e}")
+            return
+
+        await self.changed(settings)
+
+    async def run(self) -> None:
+        subscribed = False
+
+        while True:
+            pubsub = None
+
+            try:
+                pubsub = CachedDB.get_redis().pubsub(ignore_subscribe_messages=True)
+                await asyncio.to_thread(pubsub.subscribe, CHANNEL)
+
+                # Whatever was published while not subscribed is lost
+                if subscribed:
+                    self.cache.clear()
+
+                subscribed = True
+
+                while True:
+                    message = await asyncio.to_thread(pubsub.get_message, timeout=1.0)
+
+                    if message is not None and message["type"] == "message":
+                        self.received(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Lost guild settings subscription, retrying in {RETRY_DELAY}s: {type(e).__name__}: {e}")
+                await asyncio.sleep(RETRY_DELAY)
+            finally:
+                if pubsub is not None:
+                    pubsub.close()
+
+    def stats(self) -> dict:
+        return {
+            "cached": len(self.cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,95 @@
+# This project is licensed under the terms of the GPL v3.0 license. Copyright 2024 Cyteon
+
+import logging
+import uuid
+
+import redis
+
+from utils import CachedDB, DBClient
+
+logger = logging.getLogger("discord_bot")
+
+db = DBClient.db
+
+PAGE_SIZE = 10
+
+# Members written to redis per ZADD while rebuilding a leaderboard
+RECONCILE_CHUNK = 5000
+
+def leaderboard_key(guild_id: int) -> str:
+    return f"baltop:{guild_id}"
+
+def set_balances(guild_id: int, balances: dict) -> None:
+    if not balances:
+        return
+
+    try:
+        CachedDB.get_redis().zadd(leaderboard_key(guild_id), balances)
+    except redis.RedisError as e:
+        # The reconciliation job puts it right again later
+        logger.warning(f"Failed to update leaderboard for {guild_id}: {e}")
+
+def remove(guild_id: int, *user_ids: int) -> None:
+    try:
+        CachedDB.get_redis().zrem(leaderboard_key(guild_id), *user_ids)
+    except redis.RedisError as e:
+        logger.warning(f"Failed to update leaderboard for {guild_id}: {e}")
+
+def exists(guild_id: int) -> bool:
+    return CachedDB.get_redis().exists(leaderboard_key(guild_id)) > 0
+
+def reconcile(guild_id: int, exclude: set = frozenset()) -> int:
+    key = leaderboard_key(guild_id)
+    temp_key = f"{key}:rebuild:{uuid.uuid4().hex[:8]}"
+    client = CachedDB.get_redis()
+
+    count = 0
+    chunk = {}
+
+    try:
+        for data in db["users"].find({"guild_id": guild_id}, {"id": 1, "wallet": 1}):
+            if data["id"] in exclude:
+                continue
+
+            chunk[data["id"]] = data.get("wallet", 0)
+
+            if len(chunk) >= RECONCILE_CHUNK:
+                client.zadd(temp_key, chunk)
+                count += len(chunk)
+                chunk = {}
+
+        if chunk:
+            client.zadd(temp_key, chunk)
+            count += len(chunk)
+
+        # Swap the rebuilt set in at once so readers never see half of it
+        if count:
+            client.rename(temp_key, key)
+        else:
+            client.delete(key)
+    finally:
+        client.delete(temp_key)
+
+    return count
+
+def page(guild_id: int, page: int, size: int = PAGE_SIZE) -> list:
+    start = (page - 1) * size
+
+    entries = CachedDB.get_redis().zrevrange(leaderboard_key(guild_id), start, start + size - 1, withscores=True)
+
+    return [(int(user_id), int(wallet)) for user_id, wallet in entries]
+
+def rank(guild_id: int, user_id: int):
+    client = CachedDB.get_redis()
+    key = leaderboard_key(guild_id)
+
+    with client.pipeline(transaction=False) as pipeline:
+        pipeline.zrevrank(key, user_id)
+        pipeline.zscore(key, user_id)
+        pipeline.zcard(key)
+        position, wallet, total = pipeline.execute()
+
+    if position is None:
+        return None, None, total
+
+    return position + 1, int(wallet), total
@@ -0,0 +1,363 @@
+# This project is licensed under the terms of the GPL v3.0 license. Copyright 2024 Cyteon
+
+import asyncio
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import pymongo
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from utils import DBClient
+
+logger = logging.getLogger("discord_bot")
+
+db = DBClient.db
+
+# Entries newer than this are left for the next compaction. Entries get
+# their _id right before the insert, this only has to cover a slow insert
+# and clock differences between processes
+COMPACTION_LAG = timedelta(minutes=5)
+
+_indexes_created = False
+
+def ensure_indexes() -> None:
+    global _indexes_created
+
+    if _indexes_created:
+        return
+
+    db["economy_ledger"].create_index(
+        [("guild_id", pymongo.ASCENDING), ("user_id", pymongo.ASCENDING), ("_id", pymongo.ASCENDING)]
+    )
+    # Lets a retried insert skip entries that made it in the first time
+    db["economy_ledger"].create_index("op", unique=True, sparse=True)
+    db["economy_snapshots"].create_index(
+        [("guild_id", pymongo.ASCENDING), ("user_id", pymongo.ASCENDING)], unique=True
+    )
+
+    _indexes_created = True
+
+def entry(guild_id: int, user_id: int, kind: str, delta: int = 0, balance: int = None, ref: int = None, tx: ObjectId = None) -> dict:
+    data = {
+        # Stays the same across retries, unlike the _id
+        "op": ObjectId(),
+        "guild_id": guild_id,
+        "user_id": user_id,
+        "kind": kind,
+        "delta": delta,
+        "time": time.time(),
+    }
+
+    # An absolute balance, everything before this entry no longer counts
+    if balance is not None:
+        data["set"] = balance
+
+    if ref is not None:
+        data["ref"] = ref
+
+    if tx is not None:
+        data["tx"] = tx
+
+    return data
+
+def fold(balance: int, data: dict) -> int:
+    if "set" in data:
+        return data["set"]
+
+    return balance + data["delta"]
+
+class LedgerWriter:
+    def __init__(self, collection, interval: float = 1.0, max_entries: int = 500) -> None:
+        self.collection = collection
+        self.interval = interval
+        self.max_entries = max_entries
+
+        self.pending = []
+        self.lock = threading.Lock()
+        self.task = None
+        self.flushes = set()
+
+    def start(self) -> None:
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+        # Size triggered flushes still running in the executor
+        if self.flushes:
+            await asyncio.gather(*self.flushes, return_exceptions=True)
+
+        await asyncio.to_thread(self.flush)
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+
+            if self.pending:
+                await asyncio.to_thread(self.flush)
+
+    def record(self, guild_id: int, user_id: int, kind: str, delta: int = 0, balance: int = None, ref: int = None, tx: ObjectId = None) -> None:
+        with self.lock:
+            self.pending.append(entry(guild_id, user_id, kind, delta, balance, ref, tx))
+            full = len(self.pending) >= self.max_entries
+
+        if full:
+            future = asyncio.get_running_loop().run_in_executor(None, self.flush)
+            self.flushes.add(future)
+            future.add_done_callback(self.flushed)
+
+    def flushed(self, future) -> None:
+        self.flushes.discard(future)
+
+        if not future.cancelled() and future.exception() is not None:
+            e = future.exception()
+            logger.error(f"Ledger flush failed: {type(e).__name__}: {e}")
+
+    def transfer(self, guild_id: int, from_id: int, to_id: int, amount: int, kind: str) -> None:
+        tx = ObjectId()
+
+        self.record(guild_id, from_id, kind, -amount, ref=to_id, tx=tx)
+        self.record(guild_id, to_id, kind, amount, ref=from_id, tx=tx)
+
+    def flush(self) -> int:
+        # Flushes run in a worker thread while commands keep recording
+        with self.lock:
+            batch, self.pending = self.pending, []
+
+        if not batch:
+            return 0
+
+        try:
+            ensure_indexes()
+        except PyMongoError as e:
+            logger.error(f"Ledger indexes couldn't be created, retrying the insert of {len(batch)} entries later: {e}")
+            self.requeue(batch)
+            return 0
+
+        # Taken at insert time, also on a retry. An _id from when the entry
+        # was recorded could be behind the compaction watermark by the time
+        # it gets in, and compaction and balance() would never see it
+        for data in batch:
+            data["_id"] = ObjectId()
+
+        try:
+            self.collection.insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            # Entries that did get in are skipped as duplicates of their op on retry
+            errors = [error for error in e.details.get("writeErrors", []) if error.get("code") != 11000]
+
+            if errors:
+                logger.error(f"Ledger insert rejected {len(errors)} of {len(batch)} entries, retrying later")
+                self.requeue([batch[error["index"]] for error in errors])
+                return 0
+        except PyMongoError as e:
+            logger.error(f"Ledger insert of {len(batch)} entries failed, retrying later: {e}")
+            self.requeue(batch)
+            return 0
+
+        return len(batch)
+
+    def requeue(self, batch: list) -> None:
+        with self.lock:
+            self.pending = batch + self.pending
+
+def balance(guild_id: int, user_id: int) -> int:
+    snapshot = db["economy_snapshots"].find_one({"guild_id": guild_id, "user_id": user_id})
+
+    query = {"guild_id": guild_id, "user_id": user_id}
+    total = 0
+
+    if snapshot is not None:
+        query["_id"] = {"$gt": snapshot["last_entry"]}
+        total = snapshot["balance"]
+
+    for data in db["economy_ledger"].find(query, {"delta": 1, "set": 1}).sort("_id", pymongo.ASCENDING):
+        total = fold(total, data)
+
+    return total
+
+def compact() -> dict:
+    ensure_indexes()
+
+    meta = db["economy_ledger_meta"].find_one({"_id": "compaction"}) or {}
+    watermark = meta.get("last_entry", ObjectId("0" * 24))
+    cutoff = ObjectId.from_datetime(datetime.now(timezone.utc) - COMPACTION_LAG)
+
+    tails = {}
+    last_entry = watermark
+    scanned = 0
+
+    cursor = db["economy_ledger"].find(
+        {"_id": {"$gt": watermark, "$lt": cutoff}},
+        {"guild_id": 1, "user_id": 1, "delta": 1, "set": 1}
+    ).sort("_id", pymongo.ASCENDING)
+
+    for data in cursor:
+        key = (data["guild_id"], data["user_id"])
+        reset, delta = tails.get(key, (None, 0))
+
+        if "set" in data:
+            reset, delta = data["set"], 0
+        else:
+            delta += data["delta"]
+
+        tails[key] = (reset, delta)
+        last_entry = data["_id"]
+        scanned += 1
+
+    if not tails:
+        return {"scanned": 0, "snapshots": 0}
+
+    operations = []
+
+    for (guild_id, user_id), (reset, delta) in tails.items():
+        # Only matches snapshots that don't include this range yet, a
+        # rerun after a crash hits the unique index instead of adding twice
+        query = {
+            "guild_id": guild_id,
+            "user_id": user_id,
+            "last_entry": {"$not": {"$gt": watermark}},
+        }
+
+        if reset is not None:
+            update = {"$set": {"balance": reset + delta, "last_entry": last_entry, "time": time.time()}}
+        else:
+            update = {"$inc": {"balance": delta}, "$set": {"last_entry": last_entry, "time": time.time()}}
+
+        operations.append(UpdateOne(query, update, upsert=True))
+
+    written = len(operations)
+
+    try:
+        db["economy_snapshots"].bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        errors = [error for error in e.details.get("writeErrors", []) if error.get("code") != 11000]
+
+        if errors:
+            raise
+
+        written -= len(e.details.get("writeErrors", []))
+
+    db["economy_ledger_meta"].update_one(
+        {"_id": "compaction"}, {"$set": {"last_entry": last_entry, "time": time.time()}}, upsert=True
+    )
+
+    return {"scanned": scanned, "snapshots": written}
+
+def verify(guild_id: int = None, wallets: bool = True) -> dict:
+    ensure_indexes()
+
+    query = {} if guild_id is None else {"guild_id": guild_id}
+    sort = [("guild_id", pymongo.ASCENDING), ("user_id", pymongo.ASCENDING)]
+
+    snapshots = db["economy_snapshots"].find(query).sort(sort)
+    entries = db["economy_ledger"].find(query, {"guild_id": 1, "user_id": 1, "delta": 1, "set": 1}).sort(
+        sort + [("_id", pymongo.ASCENDING)]
+    )
+
+    result = {"users": 0, "entries": 0, "snapshot_mismatches": [], "wallet_mismatches": []}
+    balances = {}
+
+    snapshot = next(snapshots, None)
+    current = None
+
+    def finish(key, total, tail_total, snapshot_doc):
+        if snapshot_doc is not None and total != snapshot_doc["balance"]:
+            result["snapshot_mismatches"].append({
+                "guild_id": key[0], "user_id": key[1], "snapshot": snapshot_doc["balance"], "ledger": total,
+            })
+
+        balances[key] = tail_total
+        result["users"] += 1
+
+    # Both streams are sorted by user, walk them side by side. Each user's
+    # entries are summed up to the snapshot's last entry and compared with
+    # it, the rest is the tail on top of the snapshot
+    total = tail_total = 0
+    current_snapshot = None
+
+    for data in entries:
+        key = (data["guild_id"], data["user_id"])
+
+        if key != current:
+            if current is not None:
+                finish(current, total, tail_total, current_snapshot)
+
+            while snapshot is not None and (snapshot["guild_id"], snapshot["user_id"]) < key:
+                # A snapshot without any ledger entries left to check it against
+                finish((snapshot["guild_id"], snapshot["user_id"]), 0, snapshot["balance"], snapshot)
+                snapshot = next(snapshots, None)
+
+            current_snapshot = None
+
+            if snapshot is not None and (snapshot["guild_id"], snapshot["user_id"]) == key:
+                current_snapshot = snapshot
+                snapshot = next(snapshots, None)
+
+            current = key
+            total = 0
+            tail_total = current_snapshot["balance"] if current_snapshot else 0
+
+        result["entries"] += 1
+
+        if current_snapshot is not None and data["_id"] <= current_snapshot["last_entry"]:
+            total = fold(total, data)
+        else:
+            tail_total = fold(tail_total, data)
+
+    if current is not None:
+        finish(current, total, tail_total, current_snapshot)
+
+    while snapshot is not None:
+        finish((snapshot["guild_id"], snapshot["user_id"]), 0, snapshot["balance"], snapshot)
+        snapshot = next(snapshots, None)
+
+    if wallets:
+        keys = list(balances)
+
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            users = db["users"].find(
+                {"$or": [{"guild_id": g, "id": u} for g, u in chunk]}, {"guild_id": 1, "id": 1, "wallet": 1}
+            )
+            found = {(data["guild_id"], data["id"]): data.get("wallet", 0) for data in users}
+
+            for key in chunk:
+                if found.get(key, 0) != balances[key]:
+                    result["wallet_mismatches"].append({
+                        "guild_id": key[0], "user_id": key[1], "wallet": found.get(key, 0), "ledger": balances[key],
+                    })
+
+    return result
+
+def bootstrap(guild_id: int = None) -> int:
+    ensure_indexes()
+
+    query = {} if guild_id is None else {"guild_id": guild_id}
+    batch = []
+    count = 0
+
+    for data in db["users"].find(query, {"guild_id": 1, "id": 1, "wallet": 1}):
+        if db["economy_ledger"].find_one({"guild_id": data["guild_id"], "user_id": data["id"]}, {"_id": 1}):
+            continue
+
+        batch.append(entry(data["guild_id"], data["id"], "opening", balance=data.get("wallet", 0)))
+
+        if len(batch) >= 1000:
+            db["economy_ledger"].insert_many(batch, ordered=False)
+            count += len(batch)
+            batch = []
+
+    if batch:
+        db["economy_ledger"].insert_many(batch, ordered=False)
+        count += len(batch)
+
+    return count
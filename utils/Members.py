@@ -0,0 +1,64 @@
+# This project is licensed under the terms of the GPL v3.0 license. Copyright 2024 Cyteon
+
+import asyncio
+import logging
+
+import discord
+
+logger = logging.getLogger("discord_bot")
+
+# Discord only accepts up to 100 user ids per member query
+QUERY_LIMIT = 100
+
+def member_cache_flags(intents: discord.Intents, config: dict) -> discord.MemberCacheFlags:
+    flags = discord.MemberCacheFlags.from_intents(intents)
+
+    for flag, value in config.get("member_cache", {}).items():
+        if not hasattr(flags, flag):
+            logger.warning(f"Unknown member cache flag '{flag}' in config, ignoring")
+            continue
+
+        setattr(flags, flag, value)
+
+    return flags
+
+async def get_or_fetch_member(guild: discord.Guild, user_id: int):
+    member = guild.get_member(user_id)
+
+    if member is not None:
+        return member
+
+    try:
+        return await guild.fetch_member(user_id)
+    except discord.NotFound:
+        return None
+
+# Returns the members found and the ids that couldn't be looked up. An id in
+# neither was looked up and confirmed not to be a member
+async def resolve_members(guild: discord.Guild, user_ids, cache: bool = False):
+    members = {}
+    missing = []
+    unresolved = set()
+
+    for user_id in user_ids:
+        member = guild.get_member(user_id)
+
+        if member is not None:
+            members[user_id] = member
+        else:
+            missing.append(user_id)
+
+    for i in range(0, len(missing), QUERY_LIMIT):
+        batch = missing[i:i + QUERY_LIMIT]
+
+        try:
+            fetched = await guild.query_members(user_ids=batch, limit=len(batch), cache=cache)
+        except (discord.ClientException, asyncio.TimeoutError) as e:
+            logger.warning(f"Failed to query members in {guild.id}: {e}")
+            unresolved.update(batch)
+            continue
+
+        for member in fetched:
+            members[member.id] = member
+
+    return members, unresolved
@@ -0,0 +1,160 @@
+# This project is licensed under the terms of the GPL v3.0 license. Copyright 2024 Cyteon
+
+from array import array
+from collections import namedtuple
+
+StoredMessage = namedtuple("StoredMessage", ["id", "author_id", "channel_id", "content", "timestamp"])
+
+# Ring buffer of recent message contents for one guild. Ids and timestamps
+# live in flat arrays and contents as utf-8 bytes, the oldest entries are
+# evicted once the entry capacity or the byte budget is reached
+class GuildStore:
+    def __init__(self, capacity: int, budget: int) -> None:
+        self.capacity = capacity
+        self.budget = budget
+
+        self.ids = array("Q", bytes(8 * capacity))
+        self.authors = array("Q", bytes(8 * capacity))
+        self.channels = array("Q", bytes(8 * capacity))
+        self.timestamps = array("d", bytes(8 * capacity))
+        self.contents = [None] * capacity
+
+        self.index = {}
+        self.head = 0
+        self.count = 0
+        self.size = 0
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def _evict(self) -> None:
+        slot = self.head
+        content = self.contents[slot]
+
+        if content is not None:
+            self.size -= len(content)
+            self.contents[slot] = None
+            self.index.pop(self.ids[slot], None)
+
+        self.head = (self.head + 1) % self.capacity
+        self.count -= 1
+
+    def add(self, message_id: int, author_id: int, channel_id: int, content: bytes, timestamp: float) -> None:
+        if message_id in self.index:
+            self.update(message_id, content)
+            return
+
+        if len(content) > self.budget:
+            return
+
+        while self.count and (self.count == self.capacity or self.size + len(content) > self.budget):
+            self._evict()
+
+        slot = (self.head + self.count) % self.capacity
+
+        self.ids[slot] = message_id
+        self.authors[slot] = author_id
+        self.channels[slot] = channel_id
+        self.timestamps[slot] = timestamp
+        self.contents[slot] = content
+
+        self.index[message_id] = slot
+        self.count += 1
+        self.size += len(content)
+
+    def _entry(self, slot: int) -> StoredMessage:
+        return StoredMessage(
+            self.ids[slot],
+            self.authors[slot],
+            self.channels[slot],
+            self.contents[slot].decode("utf-8", errors="replace"),
+            self.timestamps[slot],
+        )
+
+    def get(self, message_id: int):
+        slot = self.index.get(message_id)
+
+        if slot is None:
+            return None
+
+        return self._entry(slot)
+
+    def update(self, message_id: int, content: bytes):
+        slot = self.index.get(message_id)
+
+        if slot is None:
+            return None
+
+        entry = self._entry(slot)
+
+        self.size += len(content) - len(self.contents[slot])
+        self.contents[slot] = content
+
+        # Keep the budget after an edit grew the content, never evicting the
+        # edited message itself
+        while self.size > self.budget and self.head != slot:
+            self._evict()
+
+        return entry
+
+    def remove(self, message_id: int):
+        slot = self.index.pop(message_id, None)
+
+        if slot is None:
+            return None
+
+        entry = self._entry(slot)
+
+        self.size -= len(self.contents[slot])
+        self.contents[slot] = None
+
+        return entry
+
+class MessageStore:
+    def __init__(self, capacity: int = 2000, budget: int = 1024 * 1024, max_content: int = 2000) -> None:
+        self.capacity = capacity
+        self.budget = budget
+        self.max_content = max_content
+
+        self.guilds = {}
+
+    def enabled(self, guild_id: int) -> bool:
+        return guild_id in self.guilds
+
+    def enable(self, guild_id: int) -> None:
+        if guild_id not in self.guilds:
+            self.guilds[guild_id] = GuildStore(self.capacity, self.budget)
+
+    def disable(self, guild_id: int) -> None:
+        self.guilds.pop(guild_id, None)
+
+    def encode(self, content: str) -> bytes:
+        return content[:self.max_content].encode("utf-8")
+
+    def add(self, guild_id: int, message_id: int, author_id: int, channel_id: int, content: str, timestamp: float) -> None:
+        store = self.guilds.get(guild_id)
+
+        if store is not None:
+            store.add(message_id, author_id, channel_id, self.encode(content), timestamp)
+
+    def get(self, guild_id: int, message_id: int):
+        store = self.guilds.get(guild_id)
+
+        return store.get(message_id) if store is not None else None
+
+    def update(self, guild_id: int, message_id: int, content: str):
+        store = self.guilds.get(guild_id)
+
+        return store.update(message_id, self.encode(content)) if store is not None else None
+
+    def remove(self, guild_id: int, message_id: int):
+        store = self.guilds.get(guild_id)
+
+        return store.remove(message_id) if store is not None else None
+
+    def stats(self) -> dict:
+        return {
+            "guilds": len(self.guilds),
+            "messages": sum(len(store) for store in self.guilds.values()),
+            "bytes": sum(store.size for store in self.guilds.values()),
+        }
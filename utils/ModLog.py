@@ -0,0 +1,114 @@
+# This project is licensed under the terms of the GPL v3.0 license. Copyright 2024 Cyteon
+
+import asyncio
+import logging
+from collections import Counter, deque
+
+import discord
+
+logger = logging.getLogger("discord_bot")
+
+# Discord limits a message to 10 embeds and 6000 characters across them
+MAX_EMBEDS = 10
+MAX_CHARACTERS = 6000
+
+class ChannelBuffer:
+    def __init__(self, channel: discord.abc.Messageable) -> None:
+        self.channel = channel
+        self.embeds = deque()
+        self.overflow = Counter()
+        self.full = asyncio.Event()
+        self.task = None
+
+class ModLog:
+    def __init__(self, interval: float = 2.0, max_queued: int = 500) -> None:
+        self.interval = interval
+        self.max_queued = max_queued
+
+        self._buffers = {}
+
+    def send(self, channel: discord.abc.Messageable, embed: discord.Embed) -> None:
+        buffer = self._buffers.get(channel.id)
+
+        if buffer is None:
+            buffer = self._buffers[channel.id] = ChannelBuffer(channel)
+
+        buffer.channel = channel
+
+        if len(buffer.embeds) >= self.max_queued:
+            buffer.overflow[embed.title or "log entries"] += 1
+        else:
+            buffer.embeds.append(embed)
+
+        if len(buffer.embeds) >= MAX_EMBEDS:
+            buffer.full.set()
+
+        if buffer.task is None:
+            buffer.task = asyncio.create_task(self._run(buffer))
+
+    async def _run(self, buffer: ChannelBuffer) -> None:
+        try:
+            try:
+                await asyncio.wait_for(buffer.full.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+            while buffer.embeds or buffer.overflow:
+                buffer.full.clear()
+                await self._send_batch(buffer)
+        finally:
+            buffer.task = None
+
+            if not buffer.embeds and not buffer.overflow:
+                self._buffers.pop(buffer.channel.id, None)
+
+    def _next_batch(self, buffer: ChannelBuffer) -> list:
+        batch = []
+        size = 0
+
+        while buffer.embeds and len(batch) < MAX_EMBEDS:
+            length = len(buffer.embeds[0])
+
+            if batch and size + length > MAX_CHARACTERS:
+                break
+
+            batch.append(buffer.embeds.popleft())
+            size += length
+
+        if not buffer.embeds and buffer.overflow and len(batch) < MAX_EMBEDS:
+            summary = discord.Embed(
+                description="\n".join(f"+{count} more {title.lower()}" for title, count in buffer.overflow.most_common()),
+                color=0xE02B2B
+            )
+
+            if not batch or size + len(summary) <= MAX_CHARACTERS:
+                batch.append(summary)
+                buffer.overflow.clear()
+
+        return batch
+
+    async def _send_batch(self, buffer: ChannelBuffer) -> None:
+        batch = self._next_batch(buffer)
+
+        if not batch:
+            return
+
+        try:
+            await buffer.channel.send(embeds=batch)
+        except discord.HTTPException as e:
+            logger.warning(f"Failed to send {len(batch)} log embed(s) to {buffer.channel.id}: {e}")
+
+    async def flush(self) -> None:
+        tasks = []
+
+        for buffer in list(self._buffers.values()):
+            buffer.full.set()
+
+            if buffer.task is None and (buffer.embeds or buffer.overflow):
+                buffer.task = asyncio.create_task(self._run(buffer))
+
+            if buffer.task is not None:
+                tasks.append(buffer.task)
+
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
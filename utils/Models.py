@@ -0,0 +1,247 @@
+# This project is licensed under the terms of the GPL v3.0 license. Copyright 2024 Cyteon
+
+import asyncio
+import json
+import logging
+
+import redis
+
+from utils import CachedDB, DBClient
+
+logger = logging.getLogger("discord_bot")
+
+db = DBClient.db
+
+# A document as a fixed set of slots instead of a dict. Missing fields get
+# their default on decode, fields left out by a projection stay unset and
+# raise AttributeError when read, so a command can't silently act on a
+# default it never loaded
+class Model:
+    __slots__ = ()
+
+    collection = None
+    key = ()
+    fields = {}
+    cache_ex = 30
+
+    def __init__(self, **values) -> None:
+        for name, default in self.fields.items():
+            setattr(self, name, values.get(name, default))
+
+    @classmethod
+    def new(cls, *key):
+        return cls(**dict(zip(cls.key, key)))
+
+    @classmethod
+    def from_document(cls, data: dict, fields=None):
+        if data is None:
+            return None
+
+        model = cls.__new__(cls)
+        defaults = cls.fields
+
+        for name in defaults if fields is None else fields:
+            setattr(model, name, data.get(name, defaults[name]))
+
+        return model
+
+    @classmethod
+    def from_bytes(cls, raw: bytes, fields=None):
+        return cls.from_document(json.loads(raw), fields)
+
+    @classmethod
+    def projection(cls, fields) -> dict:
+        return {"_id": 0, **{name: 1 for name in (*cls.key, *fields)}}
+
+    @classmethod
+    def query_for(cls, *key) -> dict:
+        return dict(zip(cls.key, key))
+
+    @classmethod
+    def cache_key(cls, query: dict) -> str:
+        return f"{cls.collection}:{json.dumps(query, cls=CachedDB.JSONEncoder)}"
+
+    # Reads through the same cache entries as CachedDB.find_one, so writes
+    # made with CachedDB.update_one invalidate them as before. With `fields`
+    # only those are decoded, and with ex=0 only those are fetched too, the
+    # cache entry has to hold the whole document
+    @classmethod
+    async def find(cls, query: dict, fields=None, ex: int = 30):
+        if fields is not None:
+            fields = (*cls.key, *(name for name in fields if name not in cls.key))
+
+        if not ex:
+            if fields is None:
+                return cls.from_document(db[cls.collection].find_one(query))
+
+            return cls.from_document(db[cls.collection].find_one(query, cls.projection(fields)), fields)
+
+        if fields is None:
+            return cls.from_document(await CachedDB.find_one(db[cls.collection], query, ex=ex))
+
+        cache_key = cls.cache_key(query)
+
+        try:
+            raw = CachedDB.get_redis().get(cache_key)
+        except redis.RedisError as e:
+            logger.warning(f"Failed to read {cls.collection} from cache: {e}")
+            raw = None
+
+        if raw:
+            return cls.from_bytes(raw, fields)
+
+        data = db[cls.collection].find_one(query)
+
+        if data is None:
+            return None
+
+        raw = CachedDB.JSONEncoder().encode(data)
+
+        try:
+            CachedDB.get_redis().set(cache_key, raw, ex=ex)
+        except redis.RedisError as e:
+            logger.warning(f"Failed to cache {cls.collection}: {e}")
+
+        return cls.from_document(data, fields)
+
+    # Several documents in one MGET, and one $or query for the cache misses
+    @classmethod
+    def find_many_sync(cls, keys: list, ex: int = None) -> dict:
+        ex = ex or cls.cache_ex
+        queries = [cls.query_for(*key) for key in keys]
+        cache_keys = [cls.cache_key(query) for query in queries]
+
+        try:
+            client = CachedDB.get_redis()
+            raws = client.mget(cache_keys)
+        except redis.RedisError as e:
+            logger.warning(f"Failed to read {cls.collection} from cache: {e}")
+            client, raws = None, [None] * len(keys)
+
+        found = {}
+        missing = []
+
+        for key, raw in zip(keys, raws):
+            if raw:
+                found[key] = cls.from_bytes(raw)
+            else:
+                missing.append(key)
+
+        if not missing:
+            return found
+
+        documents = db[cls.collection].find({"$or": [cls.query_for(*key) for key in missing]})
+        encoded = {}
+
+        for data in documents:
+            model = cls.from_document(data)
+            key = tuple(getattr(model, name) for name in cls.key)
+
+            found[key] = model
+            encoded[cls.cache_key(model.query)] = CachedDB.JSONEncoder().encode(data)
+
+        if encoded and client is not None:
+            try:
+                with client.pipeline(transaction=False) as pipeline:
+                    for cache_key, raw in encoded.items():
+                        pipeline.set(cache_key, raw, ex=ex)
+
+                    pipeline.execute()
+            except redis.RedisError as e:
+                logger.warning(f"Failed to cache {cls.collection}: {e}")
+
+        return found
+
+    @classmethod
+    async def find_many(cls, keys: list, ex: int = None) -> dict:
+        return await asyncio.to_thread(cls.find_many_sync, keys, ex)
+
+    @classmethod
+    async def get(cls, *key, fields=None, ex: int = 30):
+        return await cls.find(cls.query_for(*key), fields, ex)
+
+    @classmethod
+    async def get_or_create(cls, *key, fields=None, ex: int = 30):
+        model = await cls.get(*key, fields=fields, ex=ex)
+
+        if model is None:
+            model = cls.new(*key)
+            db[cls.collection].insert_one(model.to_document())
+
+        return model
+
+    @property
+    def query(self) -> dict:
+        return {name: getattr(self, name) for name in self.key}
+
+    def loaded(self, name: str) -> bool:
+        return hasattr(self, name)
+
+    def to_document(self) -> dict:
+        return {name: getattr(self, name) for name in self.fields if hasattr(self, name)}
+
+    def copy(self):
+        model = type(self).__new__(type(self))
+
+        for name in self.fields:
+            if hasattr(self, name):
+                setattr(model, name, getattr(self, name))
+
+        return model
+
+    # Pending $inc/$set deltas on top of what was read, fields that weren't
+    # loaded stay unloaded
+    def apply(self, inc: dict, set: dict):
+        model = self.copy()
+
+        for name, value in set.items():
+            if name in self.fields:
+                setattr(model, name, value)
+
+        for name, delta in inc.items():
+            if hasattr(model, name):
+                setattr(model, name, getattr(model, name) + delta)
+
+        return model
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.to_document()!r})"
+
+class User(Model):
+    __slots__ = ("id", "guild_id", "wallet", "last_daily", "last_robbed_at", "jailed")
+
+    collection = "users"
+    key = ("id", "guild_id")
+    fields = {
+        "id": 0,
+        "guild_id": 0,
+        "wallet": 0,
+        "last_daily": 0,
+        "last_robbed_at": 0,
+        "jailed": False,
+    }
+
+class Guild(Model):
+    __slots__ = ("id", "daily_cash", "log_channel", "anti_spam")
+
+    collection = "guilds"
+    key = ("id",)
+    fields = {
+        "id": 0,
+        "daily_cash": 50,
+        "log_channel": 0,
+        "anti_spam": False,
+    }
+
+class GlobalUser(Model):
+    __slots__ = ("id", "blacklisted", "blacklist_reason")
+
+    collection = "users_global"
+    key = ("id",)
+    # Read by the blacklist check before every command
+    cache_ex = 120
+    fields = {
+        "id": 0,
+        "blacklisted": False,
+        "blacklist_reason": "",
+    }
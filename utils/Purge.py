@@ -0,0 +1,166 @@
+# This project is licensed under the terms of the GPL v3.0 license. Copyright 2024 Cyteon
+
+import logging
+import re
+import time
+from datetime import timedelta
+
+import discord
+
+try:
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_parse
+
+logger = logging.getLogger("discord_bot")
+
+# Discord bulk deletes at most 100 messages at once, and only messages
+# younger than 14 days (with some margin for clock drift)
+BULK_LIMIT = 100
+BULK_MAX_AGE = timedelta(days=14) - timedelta(minutes=5)
+
+link_rx = re.compile(r"https?://\S+")
+
+# Patterns come from moderators and run against every scanned message
+MAX_PATTERN_LENGTH = 100
+
+REPEATS = {sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT} | (
+    {sre_parse.POSSESSIVE_REPEAT} if hasattr(sre_parse, "POSSESSIVE_REPEAT") else set()
+)
+
+def _can_backtrack(items) -> bool:
+    for op, value in items:
+        if op in REPEATS or op is sre_parse.BRANCH:
+            return True
+
+        if op is sre_parse.SUBPATTERN and _can_backtrack(value[-1]):
+            return True
+
+        if op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT) and _can_backtrack(value[1]):
+            return True
+
+    return False
+
+def _check_repeats(items) -> None:
+    for op, value in items:
+        if op in REPEATS:
+            # A repeated group that can itself match in several ways, like
+            # (a+)+ or (a|a)*, takes exponential time on a near miss
+            if _can_backtrack(value[2]):
+                raise ValueError("Nested quantifiers aren't allowed")
+
+            _check_repeats(value[2])
+        elif op is sre_parse.SUBPATTERN:
+            _check_repeats(value[-1])
+        elif op is sre_parse.BRANCH:
+            for branch in value[1]:
+                _check_repeats(branch)
+        elif op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            _check_repeats(value[1])
+
+def compile_pattern(text: str) -> re.Pattern:
+    if len(text) > MAX_PATTERN_LENGTH:
+        raise ValueError(f"Pattern can be at most {MAX_PATTERN_LENGTH} characters")
+
+    try:
+        _check_repeats(sre_parse.parse(text))
+        return re.compile(text, re.IGNORECASE)
+    except re.error as e:
+        raise ValueError(str(e))
+
+def build_predicate(user=None, pattern=None, attachments=False, bots=False, links=False):
+    checks = []
+
+    if user is not None:
+        checks.append(lambda message: message.author.id == user.id)
+
+    if pattern is not None:
+        checks.append(lambda message: pattern.search(message.content) is not None)
+
+    if attachments:
+        checks.append(lambda message: bool(message.attachments))
+
+    if bots:
+        checks.append(lambda message: message.author.bot)
+
+    if links:
+        checks.append(lambda message: link_rx.search(message.content) is not None)
+
+    def predicate(message: discord.Message) -> bool:
+        if message.pinned:
+            return False
+
+        return all(check(message) for check in checks)
+
+    return predicate
+
+# Messages that couldn't be deleted for any other reason than already being
+# gone are added to `failed`, the purge carries on with the rest
+async def delete_single(message: discord.Message, failed: list) -> bool:
+    try:
+        await message.delete()
+        return True
+    except discord.NotFound:
+        return False
+    except discord.HTTPException as e:
+        logger.warning(f"Failed to delete message {message.id} in {message.channel.id}: {e}")
+        failed.append(message)
+        return False
+
+async def delete_batch(channel, batch: list, failed: list) -> list:
+    if not batch:
+        return []
+
+    try:
+        await channel.delete_messages(batch)
+        return list(batch)
+    except discord.HTTPException:
+        # e.g. one of the messages was already deleted, retry one by one
+        return [message for message in batch if await delete_single(message, failed)]
+
+# `deleting` gets the id of every message before it is deleted
+async def purge(channel, predicate, limit: int, after=None, before=None, deleting: set = None) -> dict:
+    start_time = time.perf_counter()
+    cutoff = discord.utils.utcnow() - BULK_MAX_AGE
+
+    scanned = 0
+    deleted = []
+    failed = []
+    batch = []
+
+    async for message in channel.history(limit=limit, after=after, before=before, oldest_first=False):
+        scanned += 1
+
+        if not predicate(message):
+            continue
+
+        if deleting is not None:
+            deleting.add(message.id)
+
+        if message.created_at < cutoff:
+            # history is newest first, so every remaining match is too old too
+            deleted.extend(await delete_batch(channel, batch, failed))
+            batch = []
+
+            if await delete_single(message, failed):
+                deleted.append(message)
+
+            continue
+
+        batch.append(message)
+
+        if len(batch) >= BULK_LIMIT:
+            deleted.extend(await delete_batch(channel, batch, failed))
+            batch = []
+
+    deleted.extend(await delete_batch(channel, batch, failed))
+
+    seconds = time.perf_counter() - start_time
+
+    return {
+        "scanned": scanned,
+        "deleted": deleted,
+        "failed": len(failed),
+        "seconds": seconds,
+        "rate": len(deleted) / seconds if seconds > 0 else 0.0,
+    }
@@ -0,0 +1,281 @@
+# This project is licensed under the terms of the GPL v3.0 license. Copyright 2024 Cyteon
+
+import asyncio
+import logging
+import math
+import os
+import socket
+import time
+
+import pymongo
+from pymongo.errors import DuplicateKeyError
+
+from utils import DBClient
+
+logger = logging.getLogger("discord_bot")
+
+db = DBClient.db
+
+# Wheel levels as (slots, seconds per slot), one second ticks up to a day.
+# Jobs further out than that only live in mongo until a refill picks them up
+LEVELS = ((60, 1), (60, 60), (24, 3600))
+HORIZON = 24 * 3600
+
+REFILL_INTERVAL = 600
+
+# How long a process owns a claimed job before another one may take it over
+LEASE = 60
+
+MAX_ATTEMPTS = 5
+RETRY_DELAY = 60
+
+owner = f"{socket.gethostname()}:{os.getpid()}"
+
+_indexes_created = False
+
+def ensure_indexes() -> None:
+    global _indexes_created
+
+    if _indexes_created:
+        return
+
+    db["scheduled_actions"].create_index([("due", pymongo.ASCENDING)])
+    db["scheduled_actions"].create_index("key", unique=True, sparse=True)
+
+    _indexes_created = True
+
+class TimerWheel:
+    def __init__(self, now: int) -> None:
+        self.tick = now
+        self.levels = [[{} for _ in range(slots)] for slots, _ in LEVELS]
+        self.slots = {}
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    def __contains__(self, job_id) -> bool:
+        return job_id in self.slots
+
+    def add(self, job_id, due: int, guild_id: int) -> None:
+        self.remove(job_id)
+
+        delta = due - self.tick
+
+        for level, (slots, resolution) in enumerate(LEVELS):
+            if delta < slots * resolution or level == len(LEVELS) - 1:
+                # Anything overdue fires on the next tick
+                slot = (max(due, self.tick + 1) // resolution) % slots
+                break
+
+        self.levels[level][slot][job_id] = (due, guild_id)
+        self.slots[job_id] = (level, slot)
+
+    def remove(self, job_id) -> None:
+        position = self.slots.pop(job_id, None)
+
+        if position is not None:
+            level, slot = position
+            self.levels[level][slot].pop(job_id, None)
+
+    def advance(self, now: int) -> list:
+        expired = []
+
+        while self.tick < now:
+            self.tick += 1
+
+            # Cascade coarser slots down as the tick reaches their start
+            for level in range(len(LEVELS) - 1, 0, -1):
+                slots, resolution = LEVELS[level]
+
+                if self.tick % resolution == 0:
+                    bucket = self.levels[level][(self.tick // resolution) % slots]
+                    entries = list(bucket.items())
+                    bucket.clear()
+
+                    for job_id, (due, guild_id) in entries:
+                        del self.slots[job_id]
+
+                        if due <= self.tick:
+                            expired.append((job_id, guild_id))
+                        else:
+                            self.add(job_id, due, guild_id)
+
+            bucket = self.levels[0][self.tick % LEVELS[0][0]]
+
+            for job_id, (due, guild_id) in list(bucket.items()):
+                if due <= self.tick:
+                    del bucket[job_id]
+                    del self.slots[job_id]
+                    expired.append((job_id, guild_id))
+
+        return expired
+
+class Scheduler:
+    def __init__(self, bot) -> None:
+        self.bot = bot
+        self.handlers = {}
+        self.wheel = TimerWheel(int(time.time()))
+        self.loaded_until = 0
+        self.task = None
+
+    def register(self, action: str, handler) -> None:
+        self.handlers[action] = handler
+
+    # Leaves the action alone if something else registered it since
+    def unregister(self, action: str, handler) -> None:
+        if self.handlers.get(action) == handler:
+            del self.handlers[action]
+
+    def start(self) -> None:
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def schedule(self, action: str, guild_id: int, due: float, data: dict, key: str = None):
+        # Whole seconds like the wheel, rounded up so it never fires a job
+        # before the claim considers it due
+        due = math.ceil(due)
+
+        job = {
+            "action": action,
+            "guild_id": guild_id,
+            "due": due,
+            "data": data,
+            "attempts": 0,
+            "locked_until": 0,
+            "created_at": time.time(),
+        }
+
+        def save():
+            ensure_indexes()
+
+            if key is None:
+                return db["scheduled_actions"].insert_one(job).inserted_id
+
+            job["key"] = key
+
+            try:
+                return db["scheduled_actions"].find_one_and_replace(
+                    {"key": key}, job, upsert=True, return_document=pymongo.ReturnDocument.AFTER
+                )["_id"]
+            except DuplicateKeyError:
+                # Lost an upsert race with another process, it replaces the same key
+                return db["scheduled_actions"].find_one_and_replace(
+                    {"key": key}, job, return_document=pymongo.ReturnDocument.AFTER
+                )["_id"]
+
+        job_id = await asyncio.to_thread(save)
+
+        if due < self.loaded_until:
+            self.wheel.add(job_id, due, guild_id)
+
+        return job_id
+
+    async def cancel(self, key: str) -> bool:
+        job = await asyncio.to_thread(db["scheduled_actions"].find_one_and_delete, {"key": key})
+
+        if job is None:
+            return False
+
+        self.wheel.remove(job["_id"])
+        return True
+
+    async def refill(self) -> None:
+        until = time.time() + HORIZON
+
+        def load():
+            ensure_indexes()
+            return list(db["scheduled_actions"].find({"due": {"$lt": until}}, {"due": 1, "guild_id": 1}))
+
+        for job in await asyncio.to_thread(load):
+            if job["_id"] not in self.wheel:
+                self.wheel.add(job["_id"], math.ceil(job["due"]), job["guild_id"])
+
+        self.loaded_until = until
+
+    def claim(self, job_id):
+        now = time.time()
+
+        return db["scheduled_actions"].find_one_and_update(
+            {"_id": job_id, "due": {"$lte": now}, "locked_until": {"$lt": now}},
+            {"$set": {"locked_until": now + LEASE, "owner": owner}},
+            return_document=pymongo.ReturnDocument.AFTER,
+        )
+
+    async def fire(self, job_id, guild_id: int) -> None:
+        guild = self.bot.get_guild(guild_id)
+
+        if guild is None:
+            # Another cluster process owns this guild, or it's unavailable
+            # right now and the job is picked up again on the next refill
+            return
+
+        job = await asyncio.to_thread(self.claim, job_id)
+
+        if job is None:
+            current = await asyncio.to_thread(
+                db["scheduled_actions"].find_one, {"_id": job_id}, {"due": 1, "guild_id": 1}
+            )
+
+            # Rescheduled to later, or fired a little early. Otherwise it was
+            # cancelled or another process holds it, which a refill picks up
+            # again if its lease runs out
+            if current is not None and current["due"] > time.time():
+                self.wheel.add(job_id, math.ceil(current["due"]), current["guild_id"])
+
+            return
+
+        handler = self.handlers.get(job["action"])
+
+        if handler is None:
+            logger.warning(f"No handler for scheduled action {job['action']}")
+            return
+
+        try:
+            await handler(guild, job)
+        except Exception as e:
+            attempts = job["attempts"] + 1
+            logger.warning(f"Scheduled {job['action']} failed in {guild.id} (attempt {attempts}): {type(e).__name__}: {e}")
+
+            if attempts < MAX_ATTEMPTS:
+                due = math.ceil(time.time() + RETRY_DELAY * attempts)
+
+                await asyncio.to_thread(
+                    db["scheduled_actions"].update_one,
+                    {"_id": job_id},
+                    {"$set": {"due": due, "attempts": attempts, "locked_until": 0}}
+                )
+
+                self.wheel.add(job_id, due, guild.id)
+                return
+
+        # The handler may have rescheduled the job under the same key
+        await asyncio.to_thread(
+            db["scheduled_actions"].delete_one, {"_id": job_id, "owner": owner, "locked_until": job["locked_until"]}
+        )
+
+    async def run(self) -> None:
+        await self.bot.wait_until_ready()
+
+        next_refill = 0
+
+        while True:
+            now = time.time()
+
+            if now >= next_refill:
+                try:
+                    await self.refill()
+                    next_refill = now + REFILL_INTERVAL
+                except Exception as e:
+                    logger.error(f"Failed to load scheduled actions: {type(e).__name__}: {e}")
+                    next_refill = now + RETRY_DELAY
+
+            for job_id, guild_id in self.wheel.advance(int(now)):
+                self.bot.shutdown_coordinator.spawn(self.fire(job_id, guild_id))
+
+            await asyncio.sleep(1 - (time.time() % 1))
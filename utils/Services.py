@@ -0,0 +1,54 @@
+# This project is licensed under the terms of the GPL v3.0 license. Copyright 2024 Cyteon
+
+import time
+
+from utils import AntiSpam, DBClient, GuildSettings, Ledger, MessageStore, ModLog, Scheduler, Shutdown, Stats, WriteBehind
+
+# Everything the cogs expect to find on the bot. Shared by the bot itself
+# and the startup benchmark, so the benchmark loads cogs the way the bot does
+def attach(bot, config: dict) -> None:
+    bot.config = config
+    bot.start_time = time.time()
+    bot.stats = Stats.Stats()
+    bot.startup_report = {}
+
+    mod_log_config = config.get("mod_log", {})
+    bot.mod_log = ModLog.ModLog(
+        interval=mod_log_config.get("interval", 2.0),
+        max_queued=mod_log_config.get("max_queued", 500)
+    )
+
+    message_store_config = config.get("message_store", {})
+    bot.message_store = MessageStore.MessageStore(
+        capacity=message_store_config.get("capacity", 2000),
+        budget=message_store_config.get("budget", 1024 * 1024),
+        max_content=message_store_config.get("max_content", 2000)
+    )
+
+    write_behind_config = config.get("write_behind", {})
+    bot.wallets = WriteBehind.WriteBuffer(
+        DBClient.db["users"],
+        enabled=write_behind_config.get("enabled", False),
+        interval=write_behind_config.get("interval_ms", 500) / 1000,
+        max_ops=write_behind_config.get("max_ops", 200)
+    )
+
+    ledger_config = config.get("ledger", {})
+    bot.ledger = Ledger.LedgerWriter(
+        DBClient.db["economy_ledger"],
+        interval=ledger_config.get("interval_ms", 1000) / 1000,
+        max_entries=ledger_config.get("max_entries", 500)
+    )
+
+    bot.guild_settings = GuildSettings.GuildSettings(
+        max_age=config.get("guild_settings", {}).get("max_age", 600),
+        owns=lambda guild_id: bot.get_guild(guild_id) is not None
+    )
+
+    bot.scheduler = Scheduler.Scheduler(bot)
+    bot.anti_spam = AntiSpam.Detector(config.get("anti_spam", {}))
+
+    bot.shutdown_coordinator = Shutdown.ShutdownCoordinator(config.get("shutdown_timeout", 30))
+    bot.add_check(bot.shutdown_coordinator.check)
+    bot.before_invoke(bot.shutdown_coordinator.command_started)
+    bot.after_invoke(bot.shutdown_coordinator.command_finished)
@@ -0,0 +1,114 @@
+# This project is licensed under the terms of the GPL v3.0 license. Copyright 2024 Cyteon
+
+import asyncio
+import logging
+import time
+
+from discord.ext import commands
+
+logger = logging.getLogger("discord_bot")
+
+# Callbacks run in phase order: queued writes and logs are flushed before
+# players are disconnected, and pools are closed last
+FLUSH = 0
+DISCONNECT = 1
+CLOSE = 2
+
+class ShuttingDown(commands.CheckFailure):
+    pass
+
+class ShutdownCoordinator:
+    def __init__(self, timeout: float = 30) -> None:
+        self.timeout = timeout
+        self.accepting = True
+
+        self._in_flight = set()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._tasks = set()
+        self._callbacks = []
+        self._shutdown_task = None
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._in_flight)
+
+    async def check(self, context: commands.Context) -> bool:
+        if not self.accepting:
+            raise ShuttingDown("The bot is restarting, please try again in a moment.")
+
+        return True
+
+    # Tracked per context rather than counted, a command that finishes
+    # twice or never started can't throw the count off. Safe to call again
+    # from the error handler for commands whose after hooks didn't run
+    async def command_started(self, context: commands.Context) -> None:
+        self._in_flight.add(context)
+        self._idle.clear()
+
+    async def command_finished(self, context: commands.Context) -> None:
+        self._in_flight.discard(context)
+
+        if not self._in_flight:
+            self._idle.set()
+
+    def spawn(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+        return task
+
+    def register(self, callback, phase: int = FLUSH, name: str = None) -> None:
+        self._callbacks.append((phase, name or getattr(callback, "__qualname__", repr(callback)), callback))
+
+    def unregister(self, callback) -> None:
+        self._callbacks = [entry for entry in self._callbacks if entry[2] != callback]
+
+    def request(self, bot) -> asyncio.Task:
+        if self._shutdown_task is None:
+            self._shutdown_task = asyncio.create_task(self.shutdown(bot))
+
+        return self._shutdown_task
+
+    async def drain(self, deadline: float) -> None:
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout=max(0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            logger.warning(f"Shutdown: {self.in_flight} command(s) still running after the deadline")
+
+        if self._tasks:
+            _, pending = await asyncio.wait(set(self._tasks), timeout=max(0, deadline - time.monotonic()))
+
+            if pending:
+                logger.warning(f"Shutdown: cancelling {len(pending)} background task(s)")
+
+                for task in pending:
+                    task.cancel()
+
+                # Let them run their cleanup before the flush callbacks and
+                # the pools they may still be using go away
+                results = await asyncio.gather(*pending, return_exceptions=True)
+
+                for result in results:
+                    if isinstance(result, Exception):
+                        logger.warning(f"Shutdown: background task failed while cancelling: {type(result).__name__}: {result}")
+
+    async def shutdown(self, bot) -> None:
+        start_time = time.monotonic()
+        deadline = start_time + self.timeout
+
+        self.accepting = False
+        logger.info(f"Shutdown: draining {self.in_flight} command(s), waiting up to {self.timeout}s")
+
+        await self.drain(deadline)
+
+        for phase, name, callback in sorted(self._callbacks, key=lambda entry: entry[0]):
+            try:
+                await asyncio.wait_for(callback(), timeout=max(1, deadline - time.monotonic()))
+            except Exception as e:
+                logger.error(f"Shutdown: {name} failed: {type(e).__name__}: {e}")
+
+        logger.info(f"Shutdown: finished in {(time.monotonic() - start_time) * 1000:.2f}ms")
+
+        await bot.close()
@@ -0,0 +1,61 @@
+# This project is licensed under the terms of the GPL v3.0 license. Copyright 2024 Cyteon
+
+import discord
+from discord.ext import commands
+
+class Stats:
+    def __init__(self) -> None:
+        self.guilds = 0
+        self.members = 0
+        self.commands = 0
+
+        self._guild_members = {}
+        self._cog_commands = {}
+
+    def add_guild(self, guild: discord.Guild) -> None:
+        if guild.id in self._guild_members:
+            return
+
+        count = guild.member_count or 0
+        self._guild_members[guild.id] = count
+
+        self.guilds += 1
+        self.members += count
+
+    def remove_guild(self, guild: discord.Guild) -> None:
+        count = self._guild_members.pop(guild.id, None)
+
+        if count is None:
+            return
+
+        self.guilds -= 1
+        self.members -= count
+
+    def member_joined(self, guild: discord.Guild) -> None:
+        if guild.id not in self._guild_members:
+            return
+
+        self._guild_members[guild.id] += 1
+        self.members += 1
+
+    def member_left(self, guild: discord.Guild) -> None:
+        if guild.id not in self._guild_members:
+            return
+
+        self._guild_members[guild.id] -= 1
+        self.members -= 1
+
+    def add_cog(self, cog: commands.Cog) -> None:
+        count = len(list(cog.walk_commands()))
+        self.commands += count - self._cog_commands.get(cog.qualified_name, 0)
+        self._cog_commands[cog.qualified_name] = count
+
+    def remove_cog(self, cog: commands.Cog) -> None:
+        self.commands -= self._cog_commands.pop(cog.qualified_name, 0)
+
+    def to_dict(self) -> dict:
+        return {
+            "guilds": self.guilds,
+            "members": self.members,
+            "commands": self.commands,
+        }
@@ -0,0 +1,361 @@
+# This project is licensed under the terms of the GPL v3.0 license. Copyright 2024 Cyteon
+
+import asyncio
+import json
+import logging
+import time
+import uuid
+
+import redis
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from utils import CachedDB
+
+logger = logging.getLogger("discord_bot")
+
+# Set to the flush's token by every write-behind update, a retry only
+# applies where it isn't there yet
+FLUSH_FIELD = "_flush"
+
+class PendingUpdate:
+    __slots__ = ("filter", "inc", "set", "insert")
+
+    def __init__(self, filter: dict, insert: dict) -> None:
+        self.filter = filter
+        self.inc = {}
+        self.set = {}
+        self.insert = insert
+
+    def add(self, inc: dict, set: dict) -> None:
+        for field, value in set.items():
+            self.inc.pop(field, None)
+            self.set[field] = value
+
+        for field, delta in inc.items():
+            # $set and $inc can't touch the same field in one update
+            if field in self.set:
+                self.set[field] += delta
+            else:
+                self.inc[field] = self.inc.get(field, 0) + delta
+
+    def document(self, token: str = None) -> dict:
+        update = {}
+
+        if self.inc:
+            update["$inc"] = self.inc
+
+        if self.set or token:
+            update["$set"] = {**self.set, FLUSH_FIELD: token} if token else self.set
+
+        if self.insert:
+            update["$setOnInsert"] = {
+                field: value for field, value in self.insert.items()
+                if field not in self.inc and field not in self.set and field not in self.filter
+            }
+
+        return update
+
+    def operation(self, token: str = None) -> UpdateOne:
+        return UpdateOne(self.filter, self.document(token), upsert=self.insert is not None)
+
+    # For updates whose first write failed without saying whether it landed
+    def retry_operations(self, token: str) -> list:
+        operations = [UpdateOne({**self.filter, FLUSH_FIELD: {"$ne": token}}, self.document(token))]
+
+        if self.insert is not None:
+            # Creates the document with the deltas already applied, only if
+            # it doesn't exist at all. Safe in either order with the first one
+            document = {field: value for field, value in self.insert.items() if field not in self.filter}
+            document.update(self.set)
+
+            for field, delta in self.inc.items():
+                document[field] = document.get(field, 0) + delta
+
+            document[FLUSH_FIELD] = token
+            operations.append(UpdateOne(self.filter, {"$setOnInsert": document}, upsert=True))
+
+        return operations
+
+# Coalesces $inc/$set updates per document and writes them as one
+# bulk_write every `interval` seconds or `max_ops` updates, whichever comes
+# first. With enabled=False every update is written straight away.
+# Debits go through debit(), which checks the balance and takes the money
+# in one conditional update
+class WriteBuffer:
+    def __init__(self, collection, enabled: bool = False, interval: float = 0.5, max_ops: int = 200) -> None:
+        self.collection = collection
+        self.enabled = enabled
+        self.interval = interval
+        self.max_ops = max_ops
+
+        self.pending = {}
+        self.flushing = {}
+        self.retrying = []
+        self.ops = 0
+        self.lock = asyncio.Lock()
+        self.task = None
+
+        self.writes = 0
+        self.coalesced = 0
+
+    def key(self, filter: dict) -> tuple:
+        return tuple(sorted(filter.items()))
+
+    def cache_key(self, filter: dict) -> str:
+        return f"{self.collection.name}:{json.dumps(filter, cls=CachedDB.JSONEncoder)}"
+
+    def start(self) -> None:
+        if self.enabled and self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+        await self.flush()
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+
+            if self.pending or self.retrying:
+                await self.flush()
+
+    def queue(self, filter: dict, inc: dict, set: dict, insert: dict = None) -> None:
+        key = self.key(filter)
+        entry = self.pending.get(key)
+
+        if entry is None:
+            entry = self.pending[key] = PendingUpdate(filter, insert)
+
+        entry.add(inc, set)
+        self.ops += 1
+
+    async def update(self, filter: dict, inc: dict = None, set: dict = None, insert: dict = None) -> None:
+        inc = inc or {}
+        set = set or {}
+
+        if not self.enabled:
+            entry = PendingUpdate(filter, insert)
+            entry.add(inc, set)
+
+            await CachedDB.update_one(self.collection, filter, entry.document(), upsert=insert is not None)
+            return
+
+        self.queue(filter, inc, set, insert)
+
+        if self.ops >= self.max_ops:
+            await self.flush()
+
+    # Takes `amount` from `field` only if there is that much, returns whether
+    # it did. Written straight away even with the buffer enabled, pending
+    # credits count towards the balance, retried ones only if they're debits
+    # since they may have landed already
+    async def debit(self, filter: dict, field: str, amount: int, set: dict = None) -> bool:
+        set = set or {}
+        key = self.key(filter)
+
+        # Waits out a running flush, its deltas would otherwise be counted
+        # here and be in the stored balance too once it lands
+        async with self.lock:
+            balance, known = 0, False
+
+            for entry, retried in self.queued(key):
+                if field in entry.set:
+                    balance, known = entry.set[field], True
+                else:
+                    delta = entry.inc.get(field, 0)
+                    balance += min(delta, 0) if retried else delta
+
+            if known:
+                # A pending $set decides the balance, whatever is stored now
+                if balance < amount:
+                    return False
+
+                self.queue(filter, {field: -amount}, set)
+            else:
+                update = {"$inc": {field: -amount}}
+
+                if set:
+                    update["$set"] = set
+
+                result = CachedDB.sync_update_one(self.collection, {**filter, field: {"$gte": amount - balance}}, update)
+
+                if result.matched_count == 0:
+                    return False
+
+        if self.ops >= self.max_ops:
+            await self.flush()
+
+        return True
+
+    def queued(self, key: tuple) -> list:
+        entries = [(batch[key], True) for _, batch in self.retrying if key in batch]
+
+        if key in self.flushing:
+            entries.append((self.flushing[key], False))
+
+        if key in self.pending:
+            entries.append((self.pending[key], False))
+
+        return entries
+
+    def apply(self, filter: dict, data: dict):
+        entries = self.queued(self.key(filter))
+
+        if not entries or data is None:
+            return data
+
+        if not isinstance(data, dict):
+            for entry, _ in entries:
+                data = data.apply(entry.inc, entry.set)
+
+            return data
+
+        data = dict(data)
+
+        for entry, _ in entries:
+            data.update(entry.set)
+
+            for field, delta in entry.inc.items():
+                data[field] = data.get(field, 0) + delta
+
+        return data
+
+    # The write runs in a thread. Until it's done its entries stay in
+    # `flushing` so reads still see them, a read that lands right as the
+    # write does may briefly count them twice. Shielded so cancelling a
+    # caller can't lose the batch half way
+    async def flush(self) -> int:
+        return await asyncio.shield(self._flush())
+
+    async def _flush(self) -> int:
+        async with self.lock:
+            if not self.pending and not self.retrying:
+                return 0
+
+            start_time = time.perf_counter()
+
+            if self.retrying:
+                # Newer updates wait for the older ones, or a retried $set
+                # could overwrite a newer value
+                written, self.retrying = await asyncio.to_thread(self.retry, self.retrying)
+            else:
+                self.flushing, self.pending = self.pending, {}
+                ops, self.ops = self.ops, 0
+
+                token = uuid.uuid4().hex
+                entries = list(self.flushing.items())
+
+                try:
+                    failed = await asyncio.to_thread(self.write, entries, token)
+                except Exception as e:
+                    logger.error(f"Write-behind flush of {len(entries)} update(s) failed, retrying later: {type(e).__name__}: {e}")
+                    failed = entries
+
+                if failed:
+                    self.retrying.append((token, dict(failed)))
+
+                self.flushing = {}
+
+                failed_keys = {key for key, _ in failed}
+                written = [entry for key, entry in entries if key not in failed_keys]
+
+                self.coalesced += max(0, ops - len(entries))
+
+            if not written:
+                return 0
+
+            try:
+                CachedDB.get_redis().delete(*[self.cache_key(entry.filter) for entry in written])
+            except redis.RedisError as e:
+                logger.warning(f"Failed to invalidate cache after write-behind flush: {e}")
+
+            self.writes += len(written)
+
+            logger.debug(f"Flushed {len(written)} write(s) in {(time.perf_counter() - start_time) * 1000:.2f}ms")
+
+            return len(written)
+
+    def write(self, entries: list, token: str) -> list:
+        failed = []
+
+        try:
+            self.collection.bulk_write([entry.operation(token) for _, entry in entries], ordered=False)
+        except BulkWriteError as e:
+            # Only retry what was rejected, the rest has been applied
+            indexes = {error["index"] for error in e.details.get("writeErrors", [])}
+            failed = [entries[i] for i in sorted(indexes)]
+            logger.error(f"Write-behind flush: {len(failed)} of {len(entries)} update(s) were rejected, retrying later")
+        except PyMongoError as e:
+            # Some of it may have been written, the token keeps the
+            # retry from applying those twice
+            logger.error(f"Write-behind flush of {len(entries)} update(s) failed, retrying later: {e}")
+            failed = entries
+
+        failed_keys = {key for key, _ in failed}
+        self.clear_token(token, [entry for key, entry in entries if key not in failed_keys])
+
+        return failed
+
+    def retry(self, retrying: list) -> tuple:
+        still_retrying = []
+        written = []
+
+        for token, batch in retrying:
+            entries = list(batch.items())
+            operations = []
+            owners = []
+
+            for i, (_, entry) in enumerate(entries):
+                for operation in entry.retry_operations(token):
+                    operations.append(operation)
+                    owners.append(i)
+
+            failed = []
+
+            try:
+                self.collection.bulk_write(operations, ordered=False)
+            except BulkWriteError as e:
+                indexes = {owners[error["index"]] for error in e.details.get("writeErrors", [])}
+                failed = [entries[i] for i in sorted(indexes)]
+            except PyMongoError as e:
+                logger.error(f"Write-behind retry of {len(entries)} update(s) failed again: {e}")
+                failed = entries
+
+            if failed:
+                still_retrying.append((token, dict(failed)))
+
+            failed_keys = {key for key, _ in failed}
+            confirmed = [entry for key, entry in entries if key not in failed_keys]
+
+            self.clear_token(token, confirmed)
+            written += confirmed
+
+        return written, still_retrying
+
+    # Once an update is known to have landed its token has done its job,
+    # don't leave it in the document for every read to carry around
+    def clear_token(self, token: str, entries: list) -> None:
+        if not entries:
+            return
+
+        try:
+            self.collection.bulk_write(
+                [UpdateOne({**entry.filter, FLUSH_FIELD: token}, {"$unset": {FLUSH_FIELD: ""}}) for entry in entries],
+                ordered=False
+            )
+        except PyMongoError as e:
+            logger.warning(f"Failed to clear write-behind tokens, the next flush replaces them: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "pending": len(self.pending),
+            "retrying": sum(len(batch) for _, batch in self.retrying),
+            "writes": self.writes,
+            "coalesced": self.coalesced,
+        }